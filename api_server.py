@@ -0,0 +1,425 @@
+"""HTTP API for formatting text and transcribing audio without the UI
+
+Endpoints:
+    GET    /health
+    GET    /schema                  JSON schema of a /format request
+    POST   /format                  {"text", "doc_type", "custom_prompt", "tone", "stream"}
+    POST   /jobs?doc_type=Email     raw WAV body; returns {"job_id": ...}
+    GET    /jobs/<id>               job status, transcript and result
+    GET    /jobs/<id>/events        server-sent events until the job finishes
+    DELETE /jobs/<id>               cancel a job
+    POST   /recordings?format=webm  start a recording; returns {"recording_id": ...}
+    POST   /recordings/<id>/chunks?seq=0
+                                    next chunk of audio (raw body), sent while recording
+    POST   /recordings/<id>/finish?doc_type=Email
+                                    stop: transcription starts at once; returns {"job_id": ...}
+    DELETE /recordings/<id>         discard a recording
+
+Examples:
+    python api_server.py
+    python api_server.py --port 8502 --fake-backends    # in-process fakes from load_test.py
+
+In the container the API runs on a thread of the UI process (see
+start_api_server), so both share one processor, Bedrock admission controller
+and model router and are held to one quota together.
+
+With "stream": true, /format returns one JSON object per line as text arrives;
+the closing {"done": true} line carries the complete formatted_text.
+Recording chunks (e.g. MediaRecorder's dataavailable blobs) must be sent in
+order, one at a time; a resent chunk is ignored. Only API clients use
+/recordings; the UI still uploads each recording whole when it stops. /jobs takes WAV only; send
+other formats (webm, ogg, mp3, ...) as a recording, which names its format.
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import metrics
+from bedrock_admission import BedrockBusyError
+from job_manager import get_job_manager
+from metrics import start_metrics_server
+from recording_upload import ChunkOrderError, RecordingError, get_recording_manager
+from session_resources import AudioBuffer
+from speech_processor import get_shared_processor
+from config import (
+    DOCUMENT_PROMPTS, EMAIL_TONES, API_PORT, API_WORKERS, API_MAX_TEXT_CHARS, API_MAX_AUDIO_MB,
+    BEDROCK_RPM, BEDROCK_TPM, BEDROCK_MAX_CONCURRENCY
+)
+
+MAX_AUDIO_BYTES = API_MAX_AUDIO_MB * 1024 * 1024
+MAX_JSON_BYTES = API_MAX_TEXT_CHARS * 4 + 64 * 1024  # UTF-8 text plus the other fields
+EVENT_POLL_SECONDS = 0.5
+BUSY_RETRY_AFTER_SECONDS = 30
+RESTART_DELAY_SECONDS = 5
+
+logger = logging.getLogger('speech_formatter.api')
+
+FORMAT_REQUEST_SCHEMA = {
+    '$schema': 'https://json-schema.org/draft/2020-12/schema',
+    'title': 'FormatRequest',
+    'type': 'object',
+    'required': ['text'],
+    'additionalProperties': False,
+    'properties': {
+        'text': {'type': 'string', 'minLength': 1, 'maxLength': API_MAX_TEXT_CHARS},
+        'doc_type': {'type': 'string', 'enum': list(DOCUMENT_PROMPTS), 'default': 'Email'},
+        'custom_prompt': {'type': ['string', 'null'], 'description': 'Email only; same as the UI setting'},
+        'tone': {'type': ['string', 'null'], 'enum': list(EMAIL_TONES) + [None]},
+        'stream': {'type': 'boolean', 'default': False}
+    }
+}
+
+JSON_TYPES = {'string': str, 'boolean': bool, 'object': dict, 'null': type(None)}
+
+
+class APIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def validate(payload, schema=FORMAT_REQUEST_SCHEMA):
+    """Check a request against the subset of JSON schema used above; raises APIError"""
+    if not isinstance(payload, dict):
+        raise APIError(400, "Request body must be a JSON object")
+    for field in schema['required']:
+        if field not in payload:
+            raise APIError(400, f"Missing field: {field}")
+    for field, value in payload.items():
+        rules = schema['properties'].get(field)
+        if rules is None:
+            raise APIError(400, f"Unknown field: {field}")
+        types = rules['type'] if isinstance(rules['type'], list) else [rules['type']]
+        if not any(isinstance(value, JSON_TYPES[t]) for t in types):
+            raise APIError(400, f"{field} must be {' or '.join(types)}")
+        if 'enum' in rules and value not in rules['enum']:
+            raise APIError(400, f"{field} must be one of {rules['enum']}")
+        if isinstance(value, str) and len(value) < rules.get('minLength', 0):
+            raise APIError(400, f"{field} must not be empty")
+        if isinstance(value, str) and len(value) > rules.get('maxLength', len(value)):
+            raise APIError(413, f"{field} is longer than {rules['maxLength']} characters")
+
+
+def prompt_kwargs(request):
+    """Prompt settings passed through to SpeechProcessor.format_with_bedrock"""
+    return {k: request[k] for k in ('custom_prompt', 'tone') if request.get(k) is not None}
+
+
+def job_payload(job):
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'queue_position': job.queue_position,
+        'transcript': job.transcript,
+        'partial_text': job.partial_text,
+        'result': job.result,
+        'error': job.error,
+        'audio_stats': job.audio_stats
+    }
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    server_version = 'SpeechFormatterAPI/1.0'
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def log_message(self, format, *args):
+        pass  # Requests are covered by the api_request metric
+
+    def _handle(self, method):
+        started = time.perf_counter()
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        status = 500
+        try:
+            status = self._route(method, parts, parse_qs(url.query))
+        except APIError as e:
+            status = self._send_json(e.status, {'error': str(e)})
+        except BedrockBusyError as e:
+            status = self._send_json(503, {'error': str(e)}, {'Retry-After': str(BUSY_RETRY_AFTER_SECONDS)})
+        except (BrokenPipeError, ConnectionResetError):
+            status = 499  # Client went away mid-response
+        except Exception as e:
+            status = self._send_json(500, {'error': str(e)})
+        finally:
+            # Job and recording IDs are collapsed so each endpoint reports as one series
+            endpoint = '/'.join('<id>' if i == 1 and parts[0] in ('jobs', 'recordings') else p
+                                for i, p in enumerate(parts))
+            metrics.record('api_request', time.perf_counter() - started,
+                           endpoint=f"{method} /{endpoint}", status=str(status))
+
+    def _route(self, method, parts, query):
+        if method == 'GET' and parts == ['health']:
+            return self._send_json(200, {
+                'status': 'ok', 'jobs': get_job_manager().stats(), 'recordings': get_recording_manager().stats()
+            })
+        if method == 'GET' and parts == ['schema']:
+            return self._send_json(200, FORMAT_REQUEST_SCHEMA)
+        if method == 'POST' and parts == ['format']:
+            return self._format()
+        if method == 'POST' and parts == ['jobs']:
+            return self._submit_audio(query)
+        if parts[:1] == ['jobs'] and len(parts) in (2, 3):
+            job = get_job_manager().get(parts[1])
+            if job is None:
+                raise APIError(404, "Unknown or expired job")
+            if method == 'GET' and len(parts) == 2:
+                return self._send_json(200, job_payload(job))
+            if method == 'GET' and parts[2:] == ['events']:
+                return self._job_events(job)
+            if method == 'DELETE' and len(parts) == 2:
+                get_job_manager().cancel(job.id)
+                return self._send_json(202, {'job_id': job.id, 'status': 'cancelling'})
+        if parts[:1] == ['recordings']:
+            return self._recording(method, parts[1:], query)
+        raise APIError(404, "Not found")
+
+    def _body_length(self, limit):
+        if self.headers.get('Content-Length') is None:
+            raise APIError(411, "Content-Length required")
+        try:
+            length = int(self.headers['Content-Length'])
+        except ValueError:
+            raise APIError(400, "Invalid Content-Length")
+        if length > limit:
+            raise APIError(413, f"Request body larger than {limit} bytes")
+        return length
+
+    def _read_body(self, limit):
+        return self.rfile.read(self._body_length(limit))
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def _write_line(self, payload):
+        self.wfile.write(json.dumps(payload).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+    def _start_stream(self, content_type):
+        # HTTP/1.0 without Content-Length: closing the connection ends the body
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+    def _format(self):
+        try:
+            request = json.loads(self._read_body(MAX_JSON_BYTES))
+        except ValueError:
+            raise APIError(400, "Request body must be valid JSON")
+        validate(request)
+        processor = self.server.processor
+        doc_type = request.get('doc_type', 'Email')
+        kwargs = prompt_kwargs(request)
+
+        if not request.get('stream'):
+            formatted = processor.format_with_bedrock(request['text'], doc_type, **kwargs)
+            return self._send_json(200, {'doc_type': doc_type, 'formatted_text': formatted})
+
+        result = {}
+        chunks = processor.format_with_bedrock_stream(request['text'], doc_type, result=result, **kwargs)
+        # Wait for the first chunk before sending headers, so a call that cannot
+        # start (e.g. Bedrock busy) still gets a proper error status
+        first = next(chunks, None)
+        self._start_stream('application/x-ndjson')
+        try:
+            if first is not None:
+                self._write_line({'text': first})
+            for chunk in chunks:
+                self._write_line({'text': chunk})
+            # Same text as the non-streaming response, for clients that keep the result
+            self._write_line({'done': True, 'formatted_text': result['text']})
+        except (BrokenPipeError, ConnectionResetError):
+            chunks.close()
+            raise
+        except Exception as e:
+            # Headers are already sent; report the failure in the body
+            self._write_line({'error': str(e)})
+        return 200
+
+    def _submit_audio(self, query):
+        settings = {k: v[0] for k, v in query.items() if k in ('doc_type', 'custom_prompt', 'tone')}
+        # Same rules as /format for the prompt settings; the text comes from the audio
+        validate(settings, {**FORMAT_REQUEST_SCHEMA, 'required': []})
+        length = self._body_length(MAX_AUDIO_BYTES)
+        if not length:
+            raise APIError(400, "Request body must contain audio")
+        # Large uploads go straight to a temp file, which the job streams to S3
+        audio = AudioBuffer.from_stream(self.rfile, length)
+        with audio.open() as f:
+            header = f.read(12)
+        if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            audio.close()
+            raise APIError(400, "Body must be WAV audio; send other formats with POST /recordings?format=...")
+        try:
+            job_id = get_job_manager().submit_audio(
+                self.server.processor, audio.open(), settings.get('doc_type', 'Email'), **prompt_kwargs(settings)
+            )
+        finally:
+            # The job's open handle keeps the file readable until it is uploaded
+            audio.close()
+        return self._send_json(202, {'job_id': job_id, 'status_url': f"/jobs/{job_id}"},
+                               {'Location': f"/jobs/{job_id}"})
+
+    def _recording(self, method, parts, query):
+        manager = get_recording_manager()
+        try:
+            if method == 'POST' and not parts:
+                recording_id = manager.start(self.server.processor, query.get('format', ['webm'])[0])
+                return self._send_json(201, {'recording_id': recording_id}, {'Location': f"/recordings/{recording_id}"})
+            if len(parts) == 1 and method == 'DELETE':
+                manager.abort(parts[0])
+                return self._send_json(200, {'recording_id': parts[0], 'status': 'discarded'})
+            if len(parts) == 2 and method == 'POST' and parts[1] == 'chunks':
+                return self._recording_chunk(manager, parts[0], query)
+            if len(parts) == 2 and method == 'POST' and parts[1] == 'finish':
+                settings = {k: v[0] for k, v in query.items() if k in ('doc_type', 'custom_prompt', 'tone')}
+                validate(settings, {**FORMAT_REQUEST_SCHEMA, 'required': []})
+                job_id = manager.finish(parts[0], settings.get('doc_type', 'Email'), **prompt_kwargs(settings))
+                return self._send_json(202, {'job_id': job_id, 'status_url': f"/jobs/{job_id}"},
+                                       {'Location': f"/jobs/{job_id}"})
+        except ChunkOrderError as e:
+            raise APIError(409, str(e))
+        except RecordingError as e:
+            raise APIError(400, str(e))
+        except KeyError:
+            raise APIError(404, "Unknown or expired recording")
+        raise APIError(404, "Not found")
+
+    def _recording_chunk(self, manager, recording_id, query):
+        try:
+            seq = int(query['seq'][0])
+        except (KeyError, ValueError):
+            raise APIError(400, "seq must be the chunk's number, from 0")
+        recording = manager.get(recording_id)
+        if recording is None:
+            raise KeyError(recording_id)
+        # The whole recording is held to the same limit as a single /jobs upload
+        chunk = self._read_body(MAX_AUDIO_BYTES - recording.size)
+        received = manager.append(recording_id, seq, chunk)
+        return self._send_json(202, {'recording_id': recording_id, 'received_bytes': received})
+
+    def _job_events(self, job):
+        """Server-sent events: status changes and new output text until the job finishes"""
+        self._start_stream('text/event-stream')
+        sent_text = 0
+        last_state = None
+        while True:
+            finished = job.finished
+            state = (job.status, job.queue_position)
+            new_text = job.partial_text[sent_text:]
+            if state != last_state or new_text:
+                event = {'status': job.status, 'queue_position': job.queue_position}
+                if new_text:
+                    event['text'] = new_text
+                    sent_text += len(new_text)
+                self.wfile.write(f"event: status\ndata: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                last_state = state
+            if finished:
+                self.wfile.write(f"event: done\ndata: {json.dumps(job_payload(job), default=str)}\n\n".encode('utf-8'))
+                return 200
+            job.wait(EVENT_POLL_SECONDS)
+
+
+class PooledHTTPServer(ThreadingHTTPServer):
+    """HTTP server that handles connections on a bounded worker pool"""
+
+    def __init__(self, address, handler, processor, workers=API_WORKERS):
+        super().__init__(address, handler)
+        self.processor = processor
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api')
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+_api_thread = None
+_api_lock = threading.Lock()
+
+
+def start_api_server(port=API_PORT, workers=API_WORKERS):
+    """Serve the API on a background thread of this process (once per process)
+
+    Uses the shared processor, so requests count against the same Bedrock
+    quota as the UI. The server is rebuilt if it stops with an error.
+    """
+    global _api_thread
+    with _api_lock:
+        if _api_thread is not None or not port:
+            return
+        _api_thread = threading.Thread(target=_serve_forever, args=(port, workers), name='api-server', daemon=True)
+        _api_thread.start()
+
+
+def _serve_forever(port, workers):
+    while True:
+        server = None
+        try:
+            server = PooledHTTPServer(('0.0.0.0', port), APIHandler, get_shared_processor(), workers)
+            logger.info(f"Speech formatter API listening on port {port}")
+            server.serve_forever()
+        except Exception:
+            logger.exception(f"API server stopped; restarting in {RESTART_DELAY_SECONDS}s")
+        finally:
+            if server is not None:
+                server.server_close()
+        metrics.count('api_restart')
+        time.sleep(RESTART_DELAY_SECONDS)
+
+
+def fake_processor():
+    """SpeechProcessor wired to the load test's in-process AWS fakes"""
+    from types import SimpleNamespace
+    from load_test import build_fake_processor
+    return build_fake_processor(SimpleNamespace(
+        aws_latency=0.01, transcribe_seconds=2.0, bedrock_latency=0.2, throttle_rate=0.0, no_cache=False,
+        bedrock_rpm=BEDROCK_RPM, bedrock_tpm=BEDROCK_TPM, bedrock_concurrency=BEDROCK_MAX_CONCURRENCY
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the formatting HTTP API")
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--workers', type=int, default=API_WORKERS)
+    parser.add_argument('--fake-backends', action='store_true', help="Use in-process AWS fakes (no credentials)")
+    args = parser.parse_args()
+
+    processor = fake_processor() if args.fake_backends else get_shared_processor()
+    server = PooledHTTPServer(('0.0.0.0', args.port), APIHandler, processor, args.workers)
+    start_metrics_server()
+    print(f"Speech formatter API listening on port {args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,80 @@
+import io
+import tempfile
+import time
+from config import AUDIO_UPLOAD_FORMAT, SESSION_SPILL_DIR
+
+# soundfile format/subtype and the matching Transcribe MediaFormat
+ENCODINGS = {
+    'flac': ('FLAC', 'PCM_16', 'flac'),
+    'opus': ('OGG', 'OPUS', 'ogg'),
+}
+# File input is encoded this many frames at a time
+ENCODE_BLOCK_FRAMES = 65536
+
+
+def audio_size(audio):
+    """Length of audio bytes or of a seekable file object (left at the start)"""
+    if not hasattr(audio, 'read'):
+        return len(audio)
+    audio.seek(0, io.SEEK_END)
+    size = audio.tell()
+    audio.seek(0)
+    return size
+
+
+def encode_audio(wav, upload_format=AUDIO_UPLOAD_FORMAT):
+    """Compress WAV audio (bytes or a seekable file object) for upload
+
+    Returns (audio, media format, stats). A file object is encoded in blocks
+    into an anonymous temp file, returned at its start. Falls back to the
+    original WAV, as given, when the format is 'wav', soundfile is not
+    installed or encoding fails.
+    """
+    input_size = audio_size(wav)
+    stats = {
+        'media_format': 'wav',
+        'encoded_bytes': input_size,
+        'compression_ratio': 1.0,
+        'encode_seconds': 0.0
+    }
+    if upload_format not in ENCODINGS:
+        return wav, 'wav', stats
+
+    try:
+        # Optional dependency; libsndfile ships inside the soundfile wheel
+        import soundfile as sf
+    except ImportError:
+        return wav, 'wav', stats
+
+    file_format, subtype, media_format = ENCODINGS[upload_format]
+    started = time.time()
+    if hasattr(wav, 'read'):
+        output = tempfile.TemporaryFile(prefix='speech-encoded-', dir=SESSION_SPILL_DIR)
+    else:
+        output = io.BytesIO()
+    try:
+        with sf.SoundFile(wav if hasattr(wav, 'read') else io.BytesIO(wav)) as source:
+            with sf.SoundFile(output, 'w', source.samplerate, source.channels,
+                              format=file_format, subtype=subtype) as encoded:
+                for block in source.blocks(ENCODE_BLOCK_FRAMES, dtype='int16'):
+                    encoded.write(block)
+    except (RuntimeError, ValueError, TypeError):
+        # e.g. a sample rate Opus does not support
+        output.close()
+        if hasattr(wav, 'seek'):
+            wav.seek(0)
+        return wav, 'wav', stats
+
+    if hasattr(wav, 'read'):
+        wav.seek(0)
+        encoded = output
+    else:
+        encoded = output.getvalue()
+    encoded_bytes = audio_size(encoded)
+    stats.update({
+        'media_format': media_format,
+        'encoded_bytes': encoded_bytes,
+        'compression_ratio': input_size / encoded_bytes if encoded_bytes else 1.0,
+        'encode_seconds': time.time() - started
+    })
+    return encoded, media_format, stats
@@ -0,0 +1,178 @@
+import io
+import tempfile
+import wave
+import numpy as np
+from config import (
+    VAD_FRAME_MS, VAD_THRESHOLD_DB, VAD_MIN_LEVEL_DB, VAD_PADDING_MS, VAD_MAX_PAUSE_MS, SESSION_SPILL_DIR
+)
+
+_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+# File input is processed this many VAD frames (3 s) at a time
+BLOCK_VAD_FRAMES = 100
+
+
+def read_wav(audio_bytes):
+    """Return (samples as frames x channels array, wave params) from WAV bytes"""
+    with wave.open(io.BytesIO(audio_bytes), 'rb') as wav:
+        params = wav.getparams()
+        raw = wav.readframes(params.nframes)
+
+    if params.sampwidth not in _DTYPES:
+        raise ValueError(f"Unsupported sample width: {params.sampwidth}")
+    samples = np.frombuffer(raw, dtype=_DTYPES[params.sampwidth])
+    return samples.reshape(-1, params.nchannels), params
+
+
+def write_wav(samples, params):
+    """Encode a frames x channels array back to WAV bytes"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(params.nchannels)
+        wav.setsampwidth(params.sampwidth)
+        wav.setframerate(params.framerate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def frame_levels_db(samples, sample_rate, sampwidth, frame_ms=VAD_FRAME_MS):
+    """RMS level of each fixed-size frame in dB relative to full scale"""
+    frame_size = max(1, sample_rate * frame_ms // 1000)
+    mono = samples.astype(np.float64).mean(axis=1)
+    if sampwidth == 1:
+        mono -= 128  # 8-bit WAV is unsigned
+    full_scale = float(2 ** (8 * sampwidth - 1))
+
+    n_frames = -(-len(mono) // frame_size)
+    padded = np.zeros(n_frames * frame_size)
+    padded[:len(mono)] = mono
+    rms = np.sqrt((padded.reshape(n_frames, frame_size) ** 2).mean(axis=1))
+    return 20 * np.log10(np.maximum(rms / full_scale, 1e-10)), frame_size
+
+
+def speech_mask(levels_db, frame_ms=VAD_FRAME_MS):
+    """Mark frames as speech using a noise-floor-relative energy threshold"""
+    # The quietest frames approximate the background noise level
+    noise_floor = np.percentile(levels_db, 10)
+    threshold = max(noise_floor + VAD_THRESHOLD_DB, VAD_MIN_LEVEL_DB)
+    mask = levels_db > threshold
+
+    # Extend speech by a little padding so word onsets and tails survive
+    pad = VAD_PADDING_MS // frame_ms
+    if pad and mask.any():
+        kernel = np.ones(2 * pad + 1)
+        mask = np.convolve(mask.astype(float), kernel, mode='same') > 0
+    return mask
+
+
+def frames_to_keep(mask):
+    """Every speech frame plus up to VAD_MAX_PAUSE_MS of each internal pause"""
+    max_pause_frames = VAD_MAX_PAUSE_MS // VAD_FRAME_MS
+    speech_frames = np.flatnonzero(mask)
+    keep = mask.copy()
+    gaps = np.flatnonzero(np.diff(speech_frames) > 1)
+    for gap in gaps:
+        start = speech_frames[gap] + 1
+        keep[start:start + max_pause_frames] = True
+    keep[:speech_frames[0]] = False
+    keep[speech_frames[-1] + 1:] = False
+    return keep
+
+
+def trim_silence(audio_bytes):
+    """Trim leading/trailing silence and shorten long pauses in WAV audio
+
+    Returns (wav bytes, stats). Audio shorter than one VAD frame (e.g. a
+    recording stopped straight away) or with no detectable speech is returned
+    unchanged.
+    """
+    samples, params = read_wav(audio_bytes)
+    sample_rate = params.framerate
+    stats = {
+        'original_bytes': len(audio_bytes),
+        'processed_bytes': len(audio_bytes),
+        'bytes_removed': 0,
+        'original_seconds': len(samples) / sample_rate,
+        'seconds_removed': 0.0
+    }
+    if len(samples) < sample_rate * VAD_FRAME_MS // 1000:
+        return audio_bytes, stats
+
+    levels_db, frame_size = frame_levels_db(samples, sample_rate, params.sampwidth)
+    mask = speech_mask(levels_db)
+    if not mask.any():
+        return audio_bytes, stats
+
+    keep = frames_to_keep(mask)
+    sample_keep = np.repeat(keep, frame_size)[:len(samples)]
+    trimmed = samples[sample_keep]
+    processed = write_wav(trimmed, params)
+
+    stats['processed_bytes'] = len(processed)
+    stats['bytes_removed'] = len(audio_bytes) - len(processed)
+    stats['seconds_removed'] = (len(samples) - len(trimmed)) / sample_rate
+    return processed, stats
+
+
+def _read_blocks(wav, params, block_frames):
+    dtype = _DTYPES[params.sampwidth]
+    while True:
+        raw = wav.readframes(block_frames)
+        if not raw:
+            return
+        yield np.frombuffer(raw, dtype=dtype).reshape(-1, params.nchannels)
+
+
+def trim_silence_file(audio):
+    """trim_silence for a seekable WAV file object, without holding the recording in memory
+
+    Reads the file in blocks twice: once for the frame levels, then to copy
+    the kept frames into an anonymous temp file. Returns (file object at its
+    start, stats); the input itself when nothing is trimmed.
+    """
+    original_bytes = audio.seek(0, io.SEEK_END)
+    audio.seek(0)
+    with wave.open(audio, 'rb') as wav:
+        params = wav.getparams()
+        if params.sampwidth not in _DTYPES:
+            raise ValueError(f"Unsupported sample width: {params.sampwidth}")
+        sample_rate = params.framerate
+        frame_size = max(1, sample_rate * VAD_FRAME_MS // 1000)
+        block_frames = frame_size * BLOCK_VAD_FRAMES
+
+        # Blocks are whole VAD frames, so the levels match a single pass over all samples
+        levels, total = [], 0
+        for samples in _read_blocks(wav, params, block_frames):
+            levels.append(frame_levels_db(samples, sample_rate, params.sampwidth)[0])
+            total += len(samples)
+        stats = {
+            'original_bytes': original_bytes,
+            'processed_bytes': original_bytes,
+            'bytes_removed': 0,
+            'original_seconds': total / sample_rate,
+            'seconds_removed': 0.0
+        }
+        mask = speech_mask(np.concatenate(levels)) if total >= frame_size else None
+        if mask is None or not mask.any():
+            audio.seek(0)
+            return audio, stats
+
+        keep = frames_to_keep(mask)
+        kept = 0
+        wav.rewind()
+        trimmed = tempfile.TemporaryFile(prefix='speech-trimmed-', dir=SESSION_SPILL_DIR)
+        with wave.open(trimmed, 'wb') as out:
+            out.setnchannels(params.nchannels)
+            out.setsampwidth(params.sampwidth)
+            out.setframerate(sample_rate)
+            for i, samples in enumerate(_read_blocks(wav, params, block_frames)):
+                block_keep = keep[i * BLOCK_VAD_FRAMES:(i + 1) * BLOCK_VAD_FRAMES]
+                samples = samples[np.repeat(block_keep, frame_size)[:len(samples)]]
+                out.writeframes(samples.tobytes())
+                kept += len(samples)
+
+    audio.seek(0)
+    stats['processed_bytes'] = trimmed.seek(0, io.SEEK_END)
+    trimmed.seek(0)
+    stats['bytes_removed'] = original_bytes - stats['processed_bytes']
+    stats['seconds_removed'] = (total - kept) / sample_rate
+    return trimmed, stats
@@ -0,0 +1,177 @@
+"""Headless batch processing of audio directories or JSONL job files
+
+Examples:
+    python batch_runner.py --audio-dir voice_notes/ --output results.jsonl
+    python batch_runner.py --jobs jobs.jsonl --output results.jsonl --concurrency 8 --rate 2
+
+Each JSONL job is {"text": ...} or {"audio_path": ...} with optional "id",
+"doc_type" and "custom_prompt". Finished items are appended to the output
+file as they complete, so rerunning the same command resumes where it stopped.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from metrics import percentile
+from config import (
+    DOCUMENT_PROMPTS, JOB_POLL_INITIAL_SECONDS, JOB_POLL_MAX_SECONDS, JOB_POLL_BACKOFF, JOB_TRANSCRIBE_TIMEOUT_SECONDS
+)
+from speech_processor import get_shared_processor
+
+
+class RateLimiter:
+    """Spaces out calls to at most `rate` per second across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = time.time()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def load_jobs(args):
+    """Build the list of work items from the command line inputs"""
+    jobs = []
+    if args.audio_dir:
+        for name in sorted(os.listdir(args.audio_dir)):
+            if name.lower().endswith('.wav'):
+                jobs.append({'id': name, 'audio_path': os.path.join(args.audio_dir, name)})
+    if args.jobs:
+        base_dir = os.path.dirname(os.path.abspath(args.jobs))
+        with open(args.jobs, 'r') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                job = json.loads(line)
+                job.setdefault('id', f"line-{line_number}")
+                if 'audio_path' in job and not os.path.isabs(job['audio_path']):
+                    job['audio_path'] = os.path.join(base_dir, job['audio_path'])
+                jobs.append(job)
+    return jobs
+
+
+def load_completed(output_path):
+    """IDs already written successfully to the output file"""
+    completed = set()
+    if os.path.exists(output_path):
+        with open(output_path, 'r') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue  # Partially written line from an interrupted run
+                if result.get('status') == 'ok':
+                    completed.add(result['id'])
+    return completed
+
+
+def wait_for_transcript(processor, job_name, timeout=JOB_TRANSCRIBE_TIMEOUT_SECONDS):
+    delay = JOB_POLL_INITIAL_SECONDS
+    deadline = time.monotonic() + timeout
+    while True:
+        # None while running; a finished silent recording gives ""
+        transcript = processor.get_transcription_result(job_name)
+        if transcript is not None:
+            if not transcript.strip():
+                raise Exception("No speech detected in recording")
+            return transcript
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Transcription did not finish within {timeout}s")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * JOB_POLL_BACKOFF, JOB_POLL_MAX_SECONDS)
+
+
+def process_job(processor, job, default_doc_type):
+    """Run one item through transcription (if audio) and formatting"""
+    doc_type = job.get('doc_type', default_doc_type)
+    if doc_type not in DOCUMENT_PROMPTS:
+        raise ValueError(f"Unknown doc_type: {doc_type}")
+    kwargs = {'custom_prompt': job['custom_prompt']} if job.get('custom_prompt') else {}
+
+    result = {}
+    if 'audio_path' in job:
+        with open(job['audio_path'], 'rb') as f:
+            audio_bytes = f.read()
+        audio_bytes, _ = processor.preprocess_audio(audio_bytes)
+        text = wait_for_transcript(processor, processor.transcribe_audio(audio_bytes))
+        result['transcript'] = text
+    else:
+        text = job['text']
+
+    result['formatted_text'] = processor.format_with_bedrock(text, doc_type, **kwargs)
+    return result
+
+
+def run(args):
+    jobs = load_jobs(args)
+    completed = load_completed(args.output)
+    pending = [job for job in jobs if job['id'] not in completed]
+    print(f"{len(jobs)} items, {len(jobs) - len(pending)} already done, {len(pending)} to process")
+    if not pending:
+        return 0
+
+    processor = get_shared_processor()
+    limiter = RateLimiter(args.rate)
+    latencies = []
+    failures = 0
+
+    def run_one(job):
+        limiter.wait()
+        started = time.time()
+        try:
+            result = {'id': job['id'], 'status': 'ok', **process_job(processor, job, args.doc_type)}
+        except Exception as e:
+            result = {'id': job['id'], 'status': 'error', 'error': str(e)}
+        result['latency_seconds'] = round(time.time() - started, 3)
+        return result
+
+    started = time.time()
+    with open(args.output, 'a') as out, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(run_one, job) for job in pending]
+        for future in as_completed(futures):
+            result = future.result()
+            # Flushed per item so an interrupted run can resume from here
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            latencies.append(result['latency_seconds'])
+            if result['status'] != 'ok':
+                failures += 1
+            print(f"[{len(latencies)}/{len(pending)}] {result['id']}: {result['status']} "
+                  f"({result['latency_seconds']:.2f}s)")
+
+    elapsed = time.time() - started
+    print(f"Processed {len(pending)} items in {elapsed:.1f}s "
+          f"({len(pending) / elapsed:.2f} items/s), {failures} failed")
+    print(f"Latency p50 {percentile(latencies, 50):.2f}s, p95 {percentile(latencies, 95):.2f}s, "
+          f"max {max(latencies):.2f}s")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch transcribe and format documents")
+    parser.add_argument('--audio-dir', help="Directory of .wav recordings")
+    parser.add_argument('--jobs', help="JSONL file of text/audio_path jobs")
+    parser.add_argument('--output', required=True, help="JSONL results file (appended, used to resume)")
+    parser.add_argument('--doc-type', default='Email', choices=list(DOCUMENT_PROMPTS))
+    parser.add_argument('--concurrency', type=int, default=4, help="Items processed in parallel")
+    parser.add_argument('--rate', type=float, default=0, help="Max items started per second (0 = unlimited)")
+    args = parser.parse_args()
+    if not args.audio_dir and not args.jobs:
+        parser.error("one of --audio-dir or --jobs is required")
+    return run(args)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
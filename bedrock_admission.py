@@ -0,0 +1,243 @@
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+import metrics
+from config import (
+    BEDROCK_RPM, BEDROCK_TPM, BEDROCK_MAX_CONCURRENCY, BEDROCK_QUEUE_TIMEOUT_SECONDS,
+    BEDROCK_RETRY_ATTEMPTS, BEDROCK_RETRY_BASE_SECONDS, BEDROCK_RETRY_MAX_SECONDS, BEDROCK_TRANSIENT_RETRY_ATTEMPTS
+)
+
+# Error codes (lowercased; ConverseStream reports them in camel case) worth retrying
+THROTTLING_CODES = {'throttlingexception', 'toomanyrequestsexception', 'serviceunavailableexception'}
+# Server-side failures botocore's standard mode would retry (with any other 5xx)
+TRANSIENT_CODES = {'internalserverexception', 'modelnotreadyexception', 'modeltimeoutexception'}
+CHARS_PER_TOKEN = 4
+# Waiters re-check the queue at least this often, so callbacks and timeouts stay responsive
+POSITION_POLL_SECONDS = 0.5
+# Throttling cuts the admitted rate; each success wins a little back
+THROTTLE_BACKOFF_FACTOR = 0.7
+RATE_RECOVERY_STEP = 0.02
+MIN_RATE_SCALE = 0.1
+BUSY_MESSAGE = "The AI service is busy right now. Please try again in a minute."
+
+
+class BedrockBusyError(Exception):
+    """Raised when Bedrock capacity stays exhausted after queueing and retries"""
+
+
+def is_throttling(error):
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code', '').lower() in THROTTLING_CODES
+
+
+def is_transient(error):
+    """A server error, timeout or dropped connection that a fresh attempt may get past"""
+    if isinstance(error, (BotoConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return status >= 500 or error.response.get('Error', {}).get('Code', '').lower() in TRANSIENT_CODES
+    return False
+
+
+def estimate_tokens(messages, system=None, max_tokens=0):
+    """Rough token count Bedrock reserves for a request: input text plus max output"""
+    blocks = [block for message in messages for block in message['content']] + list(system or [])
+    chars = sum(len(block.get('text', '')) for block in blocks)
+    return chars // CHARS_PER_TOKEN + max_tokens
+
+
+class Slot:
+    """One admitted request; release it when the call (or its stream) finishes"""
+
+    def __init__(self, controller, tokens):
+        self.controller = controller
+        self.tokens = tokens
+        self.usage = {}
+        self.released = False
+
+    def release(self, throttled=False):
+        if not self.released:
+            self.released = True
+            self.controller._release(self, throttled)
+
+
+class AdmissionController:
+    """Process-wide FIFO gate in front of Bedrock sized from the account quotas
+
+    Requests are admitted in arrival order once a concurrency slot is free and
+    the requests-per-minute and tokens-per-minute buckets can cover them.
+    Throttling responses shrink the refill rate, which then recovers on success.
+    """
+
+    def __init__(self, rpm=BEDROCK_RPM, tpm=BEDROCK_TPM, max_concurrency=BEDROCK_MAX_CONCURRENCY):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.condition = threading.Condition()
+        self.waiting = deque()
+        self.active = 0
+        self.requests_available = float(rpm)
+        self.tokens_available = float(tpm)
+        self.rate_scale = 1.0
+        self.refilled_at = time.monotonic()
+        self.changes = 0
+        self.admitted = 0
+        self.throttled = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.refilled_at
+        self.refilled_at = now
+        self.requests_available = min(self.rpm, self.requests_available + elapsed * self.rpm / 60 * self.rate_scale)
+        self.tokens_available = min(self.tpm, self.tokens_available + elapsed * self.tpm / 60 * self.rate_scale)
+
+    def _seconds_until_ready(self, tokens):
+        """Time until the buckets cover a request, or None while all slots are busy"""
+        if self.active >= self.max_concurrency:
+            return None
+        wait = 0.0
+        if self.requests_available < 1:
+            wait = max(wait, (1 - self.requests_available) / (self.rpm / 60 * self.rate_scale))
+        if self.tokens_available < tokens:
+            wait = max(wait, (tokens - self.tokens_available) / (self.tpm / 60 * self.rate_scale))
+        return wait
+
+    def _notify(self):
+        self.changes += 1
+        self.condition.notify_all()
+
+    def acquire(self, tokens, on_position=None):
+        """Wait for this request's turn and capacity; returns a Slot
+
+        on_position(n) is called with the 1-based queue position whenever it
+        changes, and with 0 once admitted. It may raise to abandon the wait.
+        """
+        # A request bigger than the whole bucket still has to run eventually
+        tokens = min(tokens, self.tpm)
+        ticket = object()
+        started = time.monotonic()
+        reported = 0
+        with self.condition:
+            self.waiting.append(ticket)
+            first_position = len(self.waiting)
+        try:
+            while True:
+                with self.condition:
+                    position = self.waiting.index(ticket) + 1
+                    wait = POSITION_POLL_SECONDS
+                    if position == 1:
+                        self._refill()
+                        ready_in = self._seconds_until_ready(tokens)
+                        if ready_in == 0:
+                            self.waiting.popleft()
+                            self.requests_available -= 1
+                            self.tokens_available -= tokens
+                            self.active += 1
+                            self.admitted += 1
+                            self._notify()
+                            break
+                        if ready_in is not None:
+                            wait = min(wait, ready_in)
+                    seen = self.changes
+
+                # Callbacks run outside the lock so a slow one cannot stall other sessions
+                if on_position and position != reported:
+                    on_position(position)
+                    reported = position
+                if time.monotonic() - started > BEDROCK_QUEUE_TIMEOUT_SECONDS:
+                    raise BedrockBusyError(BUSY_MESSAGE)
+
+                with self.condition:
+                    if self.changes == seen:
+                        self.condition.wait(wait)
+        except BaseException:
+            with self.condition:
+                if ticket in self.waiting:
+                    self.waiting.remove(ticket)
+                    self._notify()
+            raise
+
+        metrics.record('bedrock_admission_wait', time.monotonic() - started, queue_position=first_position)
+        if on_position and reported:
+            on_position(0)
+        return Slot(self, tokens)
+
+    def _release(self, slot, throttled):
+        with self.condition:
+            self.active -= 1
+            if throttled:
+                self.throttled += 1
+                self.rate_scale = max(MIN_RATE_SCALE, self.rate_scale * THROTTLE_BACKOFF_FACTOR)
+            else:
+                self.rate_scale = min(1.0, self.rate_scale + RATE_RECOVERY_STEP)
+            if slot.usage:
+                # Return what the estimate over-reserved (or charge what it missed)
+                used = slot.usage.get('inputTokens', 0) + slot.usage.get('outputTokens', 0)
+                self.tokens_available = min(self.tpm, self.tokens_available + slot.tokens - used)
+            self._notify()
+
+    @contextmanager
+    def admit(self, tokens, on_position=None):
+        """Hold a slot for the duration of a block; fill slot.usage to settle tokens"""
+        slot = self.acquire(tokens, on_position)
+        try:
+            yield slot
+        except ClientError as e:
+            slot.release(throttled=is_throttling(e))
+            raise
+        finally:
+            slot.release()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'active': self.active,
+                'queued': len(self.waiting),
+                'rate_scale': round(self.rate_scale, 2),
+                'admitted': self.admitted,
+                'throttled': self.throttled
+            }
+
+
+def call_with_backoff(attempt):
+    """Call attempt(), retrying throttling and transient errors with full-jitter exponential backoff
+
+    The Bedrock client makes a single attempt per call, so this is where all
+    retries happen: throttling up to BEDROCK_RETRY_ATTEMPTS times, server and
+    connection errors up to BEDROCK_TRANSIENT_RETRY_ATTEMPTS times. attempt
+    must release its slot before raising, so the backoff sleep does not hold
+    capacity other requests could use.
+    """
+    transient_failures = 0
+    for retry in range(BEDROCK_RETRY_ATTEMPTS):
+        try:
+            return attempt()
+        except Exception as e:
+            if is_throttling(e):
+                if retry == BEDROCK_RETRY_ATTEMPTS - 1:
+                    raise BedrockBusyError(BUSY_MESSAGE) from e
+            elif is_transient(e):
+                transient_failures += 1
+                if transient_failures >= BEDROCK_TRANSIENT_RETRY_ATTEMPTS or retry == BEDROCK_RETRY_ATTEMPTS - 1:
+                    raise
+            else:
+                raise
+            delay = random.uniform(0, min(BEDROCK_RETRY_MAX_SECONDS, BEDROCK_RETRY_BASE_SECONDS * 2 ** retry))
+            metrics.record('bedrock_retry_wait', delay, attempt=retry + 1)
+            time.sleep(delay)
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """Return the process-wide admission controller shared by all sessions"""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController()
+        return _controller
@@ -0,0 +1,260 @@
+"""Offline micro-benchmarks with stubbed AWS backends
+
+Examples:
+    python benchmarks.py                              # run and write benchmark_results.json
+    python benchmarks.py --save-baseline              # record the current numbers as the baseline
+    python benchmarks.py --baseline benchmark_baseline.json --threshold 0.25
+
+With --baseline the run exits non-zero when any benchmark's median is more
+than --threshold slower than the baseline, so it can gate a deploy.
+"""
+import os
+
+# No AWS calls, metric logging or metrics port during benchmarks
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+os.environ.setdefault('METRICS_EMF_ENABLED', 'false')
+os.environ.setdefault('METRICS_PORT', '0')
+
+import argparse
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+from botocore.stub import Stubber
+from bedrock_admission import AdmissionController
+from document_export import RENDERERS, markdown_to_html, build_mailto, render_export
+from prompt_builder import compile_prompt
+from speech_processor import (
+    SpeechProcessor, StreamCleaner, clean_response, extract_transcript_stream, parse_transcript
+)
+
+DEFAULT_OUTPUT = 'benchmark_results.json'
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+
+def timed(func, iterations, warmup=3):
+    """Run func repeatedly and return timing statistics in milliseconds"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'iterations': iterations,
+        'median_ms': statistics.median(samples),
+        'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'min_ms': samples[0]
+    }
+
+
+# Synthetic inputs sized like long real dictations
+
+def large_response(paragraphs=400):
+    lines = ["Here's the email:", "Subject: Quarterly planning follow-up", ""]
+    for i in range(paragraphs):
+        lines.append(f"Paragraph {i} covers the [booking page](https://example.com/book/{i}) and next steps.")
+        lines.append("")
+    lines.append("Thanks,")
+    lines.append("Sam")
+    return '\n'.join(lines)
+
+
+def large_transcript_json(words=20000):
+    items = [
+        {
+            'start_time': f"{i * 0.4:.2f}",
+            'end_time': f"{i * 0.4 + 0.3:.2f}",
+            'alternatives': [{'confidence': '0.98', 'content': f"word{i}"}],
+            'type': 'pronunciation'
+        }
+        for i in range(words)
+    ]
+    transcript = ' '.join(item['alternatives'][0]['content'] for item in items)
+    return json.dumps({
+        'jobName': 'benchmark',
+        'accountId': '000000000000',
+        'results': {'transcripts': [{'transcript': transcript}], 'items': items},
+        'status': 'COMPLETED'
+    }).encode('utf-8')
+
+
+def converse_response(text):
+    return {
+        'output': {'message': {'role': 'assistant', 'content': [{'text': text}]}},
+        'stopReason': 'end_turn',
+        'usage': {'inputTokens': 500, 'outputTokens': 400, 'totalTokens': 900},
+        'metrics': {'latencyMs': 1}
+    }
+
+
+def stubbed_processor():
+    """A SpeechProcessor with its own admission controller and no Bedrock quota
+
+    The process-wide controller would carry quota use from one benchmark to
+    the next, making results depend on run order.
+    """
+    processor = SpeechProcessor()
+    processor.admission = AdmissionController(rpm=10 ** 9, tpm=10 ** 12, max_concurrency=10 ** 6)
+    return processor
+
+
+# Benchmarks
+
+def bench_processor_construction():
+    return timed(SpeechProcessor, iterations=20)
+
+
+def bench_prompt_assembly():
+    custom_prompt = "Sign off with Thanks Sam. Never use emojis.\n\nText to format: {text}"
+
+    def cold():
+        compile_prompt.cache_clear()
+        compile_prompt("Email", custom_prompt, None).messages("hello")
+
+    def warm():
+        compile_prompt("Email", custom_prompt, None).messages("hello")
+
+    return {'cold': timed(cold, iterations=2000), 'warm': timed(warm, iterations=2000)}
+
+
+def bench_postprocess_large_response():
+    response = large_response()
+    return timed(lambda: clean_response(response), iterations=200)
+
+
+def bench_stream_cleanup_large_response():
+    response = large_response()
+    deltas = [response[i:i + 12] for i in range(0, len(response), 12)]
+
+    def run():
+        cleaner = StreamCleaner()
+        for delta in deltas:
+            cleaner.feed(delta)
+        cleaner.close()
+
+    return timed(run, iterations=100)
+
+
+def bench_transcript_parse():
+    document = large_transcript_json()
+    return timed(lambda: parse_transcript(document), iterations=20)
+
+
+def bench_transcript_extract_stream():
+    document = large_transcript_json()
+    return timed(lambda: extract_transcript_stream(io.BytesIO(document)), iterations=20)
+
+
+def bench_format_with_bedrock_stubbed():
+    processor = stubbed_processor()
+    response = converse_response(large_response(40))
+    stubber = Stubber(processor.bedrock)
+    stubber.activate()
+
+    def run():
+        stubber.add_response('converse', response)
+        processor.format_cache.entries.clear()  # Measure the uncached path
+        processor.format_with_bedrock("Hi team, quick note about planning.", "Email")
+
+    return timed(run, iterations=100)
+
+
+def bench_markdown_to_html():
+    text = clean_response(large_response())
+    return timed(lambda: markdown_to_html(text), iterations=200)
+
+
+def bench_build_mailto():
+    text = clean_response(large_response(20))
+    return timed(lambda: build_mailto(text), iterations=200)
+
+
+def bench_export_rerun():
+    """All export formats for unchanged output: building them against a memoised rerun"""
+    text = clean_response(large_response(20))
+    build = timed(lambda: [render(text) for render in RENDERERS.values()], iterations=100)
+    rerun = timed(lambda: [render_export(text, name) for name in RENDERERS], iterations=200)
+    return {'build': build, 'rerun': rerun, 'speedup': build['median_ms'] / rerun['median_ms']}
+
+
+BENCHMARKS = {
+    'processor_construction': bench_processor_construction,
+    'prompt_assembly': bench_prompt_assembly,
+    'postprocess_large_response': bench_postprocess_large_response,
+    'stream_cleanup_large_response': bench_stream_cleanup_large_response,
+    'transcript_parse': bench_transcript_parse,
+    'transcript_extract_stream': bench_transcript_extract_stream,
+    'format_with_bedrock_stubbed': bench_format_with_bedrock_stubbed,
+    'markdown_to_html': bench_markdown_to_html,
+    'build_mailto': bench_build_mailto,
+    'export_rerun': bench_export_rerun,
+}
+
+
+def flatten(results, prefix=''):
+    """Map 'name' / 'name.sub' to each timing dict that has a median"""
+    flat = {}
+    for name, value in results.items():
+        key = f"{prefix}{name}"
+        if isinstance(value, dict) and 'median_ms' in value:
+            flat[key] = value
+        elif isinstance(value, dict):
+            flat.update(flatten(value, f"{key}."))
+    return flat
+
+
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    current = flatten(results)
+    for name, base in flatten(baseline).items():
+        if name in current and current[name]['median_ms'] > base['median_ms'] * (1 + threshold):
+            regressions.append((name, base['median_ms'], current[name]['median_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run offline performance benchmarks")
+    parser.add_argument('--only', nargs='*', choices=list(BENCHMARKS), help="Run a subset")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Where to write results JSON")
+    parser.add_argument('--baseline', help="Baseline results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed slowdown, e.g. 0.25 = 25%%")
+    parser.add_argument('--save-baseline', action='store_true', help=f"Also write results to {DEFAULT_BASELINE}")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        results[name] = BENCHMARKS[name]()
+        print(f"{name}: {json.dumps(results[name])}")
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'benchmarks': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(DEFAULT_BASELINE, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['benchmarks']
+        regressions = find_regressions(results, baseline, args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.3f}ms -> {after:.3f}ms")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
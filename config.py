@@ -5,16 +5,154 @@ AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
 # Only use profile for local development, not in ECS
 AWS_PROFILE = os.getenv('AWS_PROFILE', None) if not os.getenv('ECS_CONTAINER_METADATA_URI') else None
 
+# Shared AWS client connection settings
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '50'))
+AWS_CONNECT_TIMEOUT = int(os.getenv('AWS_CONNECT_TIMEOUT', '5'))
+AWS_READ_TIMEOUT = int(os.getenv('AWS_READ_TIMEOUT', '60'))
+AWS_MAX_ATTEMPTS = int(os.getenv('AWS_MAX_ATTEMPTS', '5'))
+
 # AWS Transcribe settings
 TRANSCRIBE_BUCKET = os.getenv('TRANSCRIBE_BUCKET', 'speech-formatter-audio-185749752590')
 TRANSCRIBE_JOB_PREFIX = 'speech-formatter'
+# Transcribe writes job output under this prefix in TRANSCRIBE_BUCKET
+TRANSCRIPT_PREFIX = 'transcripts/'
+# 'batch' uploads to S3 and starts a job, 'streaming' sends PCM frames directly
+TRANSCRIBE_MODE = os.getenv('TRANSCRIBE_MODE', 'batch')
+# Override the streaming endpoint, e.g. for a local stand-in server
+TRANSCRIBE_STREAMING_ENDPOINT = os.getenv('TRANSCRIBE_STREAMING_ENDPOINT', None)
+STREAMING_FRAME_MS = int(os.getenv('STREAMING_FRAME_MS', '100'))
+STREAMING_SAMPLE_RATE = 16000  # higher-rate recordings are resampled to this before streaming
+# Silence trimming before upload
+AUDIO_TRIM_SILENCE = os.getenv('AUDIO_TRIM_SILENCE', 'true').lower() == 'true'
+VAD_FRAME_MS = 30
+VAD_THRESHOLD_DB = 15     # Speech must be this far above the noise floor
+VAD_MIN_LEVEL_DB = -50    # ...and at least this loud
+VAD_PADDING_MS = 210      # Kept either side of detected speech
+VAD_MAX_PAUSE_MS = 600    # Longer pauses are shortened to this
+# Audio upload encoding and transfer
+AUDIO_UPLOAD_FORMAT = os.getenv('AUDIO_UPLOAD_FORMAT', 'flac')  # 'flac', 'opus' or 'wav'
+UPLOAD_MULTIPART_THRESHOLD_MB = int(os.getenv('UPLOAD_MULTIPART_THRESHOLD_MB', '8'))
+UPLOAD_MULTIPART_CHUNK_MB = int(os.getenv('UPLOAD_MULTIPART_CHUNK_MB', '8'))
+UPLOAD_MAX_CONCURRENCY = int(os.getenv('UPLOAD_MAX_CONCURRENCY', '8'))
+# Transcripts kept in memory, keyed by audio content hash
+TRANSCRIPT_CACHE_SIZE = int(os.getenv('TRANSCRIPT_CACHE_SIZE', '512'))
+
+# Background job settings
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '16'))
+JOB_TTL_SECONDS = int(os.getenv('JOB_TTL_SECONDS', '3600'))  # Keep finished jobs for reconnects
+JOB_POLL_INITIAL_SECONDS = 0.5
+JOB_POLL_MAX_SECONDS = 5.0
+JOB_POLL_BACKOFF = 1.5
+JOB_TRANSCRIBE_TIMEOUT_SECONDS = int(os.getenv('JOB_TRANSCRIBE_TIMEOUT_SECONDS', '1800'))  # then waiting for a transcript fails
+
+# Per-session resources: large recordings spill to disk, abandoned sessions are swept
+AUDIO_SPILL_THRESHOLD_MB = float(os.getenv('AUDIO_SPILL_THRESHOLD_MB', '2'))
+SESSION_MEMORY_CAP_MB = float(os.getenv('SESSION_MEMORY_CAP_MB', '8'))  # audio and output a session keeps in memory
+SESSION_SPILL_DIR = os.getenv('SESSION_SPILL_DIR', None)  # defaults to the system temp directory
+SESSION_IDLE_SECONDS = int(os.getenv('SESSION_IDLE_SECONDS', '1800'))  # then a session's buffers are released
+SESSION_ORPHAN_SECONDS = 120  # running jobs of a session not seen for this long are cancelled
+SESSION_SWEEP_INTERVAL_SECONDS = 30
+AUDIO_PLAYER_MAX_MB = float(os.getenv('AUDIO_PLAYER_MAX_MB', '2'))  # larger recordings are not sent back for playback
+
+# Recordings uploaded in chunks while the user speaks (POST /recordings on the API)
+RECORDING_UPLOAD = os.getenv('RECORDING_UPLOAD', 'multipart')  # 'multipart' (S3 while recording) or 'spool' (local file)
+RECORDING_PART_MB = 5  # S3's minimum part size; chunks are buffered up to this
+RECORDING_TTL_SECONDS = 600  # unfinished recordings idle this long are aborted
+RECORDING_SWEEP_INTERVAL_SECONDS = 60
 
 # AWS Bedrock settings  
 BEDROCK_MODEL_ID = 'amazon.nova-lite-v1:0'
+# Mark the static system prompt as a Converse cache point
+BEDROCK_PROMPT_CACHING = os.getenv('BEDROCK_PROMPT_CACHING', 'true').lower() == 'true'
+# Stream model output into the UI as it is generated
+BEDROCK_STREAMING = os.getenv('BEDROCK_STREAMING', 'true').lower() == 'true'
+
+# Model tiers; requests are routed to one by input length and document type
+BEDROCK_MODELS = {
+    'micro': os.getenv('BEDROCK_MODEL_MICRO', 'amazon.nova-micro-v1:0'),
+    'lite': os.getenv('BEDROCK_MODEL_LITE', BEDROCK_MODEL_ID),
+    'pro': os.getenv('BEDROCK_MODEL_PRO', 'amazon.nova-pro-v1:0')
+}
+BEDROCK_ROUTING = os.getenv('BEDROCK_ROUTING', 'true').lower() == 'true'  # false = always BEDROCK_MODEL_ID
+# (doc types or None for any, max input chars or None for any length, tier); first match wins
+BEDROCK_ROUTING_RULES = [
+    (None, 600, 'micro'),
+    (('Meeting Minutes', 'Briefing Doc'), None, 'pro'),
+    (None, None, 'lite')
+]
+# Race a backup request when a call runs past this percentile of recent latency
+BEDROCK_HEDGING = os.getenv('BEDROCK_HEDGING', 'false').lower() == 'true'
+BEDROCK_HEDGE_PERCENTILE = 95
+BEDROCK_HEDGE_MIN_SAMPLES = 20  # per model, before any hedging
+BEDROCK_HEDGE_MIN_SECONDS = 1.0
+
+# Process-wide admission control, sized from the account's Bedrock quotas for the model
+BEDROCK_RPM = int(os.getenv('BEDROCK_RPM', '100'))
+BEDROCK_TPM = int(os.getenv('BEDROCK_TPM', '200000'))
+BEDROCK_MAX_CONCURRENCY = int(os.getenv('BEDROCK_MAX_CONCURRENCY', '16'))
+BEDROCK_QUEUE_TIMEOUT_SECONDS = int(os.getenv('BEDROCK_QUEUE_TIMEOUT_SECONDS', '120'))
+# Throttled calls are retried with jittered exponential backoff
+BEDROCK_RETRY_ATTEMPTS = int(os.getenv('BEDROCK_RETRY_ATTEMPTS', '6'))
+BEDROCK_RETRY_BASE_SECONDS = 0.5
+BEDROCK_RETRY_MAX_SECONDS = 20.0
+BEDROCK_TRANSIENT_RETRY_ATTEMPTS = 3  # attempts for 5xx and connection errors, as botocore's standard mode
+
+# Long transcripts are condensed to notes in parallel chunks (map), then formatted from the notes in one call (reduce)
+FORMAT_CHUNK_CHARS = int(os.getenv('FORMAT_CHUNK_CHARS', '6000'))
+FORMAT_CHUNK_CONCURRENCY = int(os.getenv('FORMAT_CHUNK_CONCURRENCY', '4'))
+# Combined size of every chunk's notes; keeps the final call's input and output within its 2000 max tokens
+FORMAT_NOTES_TOKENS = int(os.getenv('FORMAT_NOTES_TOKENS', '1200'))
+FORMAT_CHUNK_MIN_TOKENS = 150  # per chunk, however many chunks there are
+CHUNK_PROMPT = """
+    This is part {part} of {total} of a longer dictation that will become a {doc_type}.
+    Condense this part into short notes of at most {words} words, one line per point.
+    Keep every fact, name, date, number, decision and action item; drop filler,
+    repetition, small talk and false starts.
+    Do not add a greeting, closing, headings or any information that is not in the text.
+    
+    Text: {text}
+    """
 
 # Template storage
 TEMPLATE_BUCKET = os.getenv('TEMPLATE_BUCKET', 'speech-formatter-templates-185749752590')
 
+# Per-user settings records and content-addressed template blobs
+SETTINGS_BACKEND = os.getenv('SETTINGS_BACKEND', 'disk')  # 'disk' (SETTINGS_DIR) or 's3' (TEMPLATE_BUCKET)
+SETTINGS_DIR = os.getenv('SETTINGS_DIR', '.settings')
+SETTINGS_CACHE_SIZE = int(os.getenv('SETTINGS_CACHE_SIZE', '1024'))  # user records kept in memory
+SETTINGS_CACHE_TTL_SECONDS = int(os.getenv('SETTINGS_CACHE_TTL_SECONDS', '60'))  # bounds staleness across containers
+TEMPLATE_CACHE_SIZE = int(os.getenv('TEMPLATE_CACHE_SIZE', '64'))  # template blobs kept in memory
+# ARN of the ALB whose signed OIDC claims identify users; empty: everyone shares one settings record
+TRUSTED_ALB_ARN = os.getenv('TRUSTED_ALB_ARN', '')
+
+# Email templates: the most relevant snippets are added to each prompt as examples
+TEMPLATE_SNIPPET_CHARS = 600
+TEMPLATE_TOP_K = int(os.getenv('TEMPLATE_TOP_K', '3'))
+TEMPLATE_TOKEN_BUDGET = int(os.getenv('TEMPLATE_TOKEN_BUDGET', '400'))
+TEMPLATE_INDEX_CACHE_SIZE = 64
+
+# Formatted output cache
+FORMAT_CACHE_SIZE = int(os.getenv('FORMAT_CACHE_SIZE', '256'))
+FORMAT_CACHE_TTL_SECONDS = int(os.getenv('FORMAT_CACHE_TTL_SECONDS', '3600'))
+FORMAT_CACHE_BACKEND = os.getenv('FORMAT_CACHE_BACKEND', 'memory')  # 'memory', 'disk' or 's3' (TEMPLATE_BUCKET)
+FORMAT_CACHE_DIR = os.getenv('FORMAT_CACHE_DIR', '.format_cache')
+
+# Metrics export
+METRICS_EMF_ENABLED = os.getenv('METRICS_EMF_ENABLED', 'true').lower() == 'true'  # CloudWatch EMF logs
+METRICS_NAMESPACE = os.getenv('METRICS_NAMESPACE', 'SpeechFormatter')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9101'))  # Prometheus /metrics, 0 to disable
+METRICS_PROM_FILE = os.getenv('METRICS_PROM_FILE', None)  # Optional Prometheus text file
+
+# HTTP API (api_server.py), served from a thread of the UI process
+API_PORT = int(os.getenv('API_PORT', '8502'))  # 0 to disable
+API_WORKERS = int(os.getenv('API_WORKERS', '32'))  # Concurrent requests, including open event streams
+API_MAX_TEXT_CHARS = int(os.getenv('API_MAX_TEXT_CHARS', '100000'))
+API_MAX_AUDIO_MB = int(os.getenv('API_MAX_AUDIO_MB', '50'))
+
+# Startup: modules and AWS clients are warmed before the UI starts serving
+STARTUP_PREWARM = os.getenv('STARTUP_PREWARM', 'true').lower() == 'true'
+STARTUP_BUDGET_SECONDS = float(os.getenv('STARTUP_BUDGET_SECONDS', '3.0'))  # enforced by `python startup.py --check`
+
 # Document formatting prompts
 EMAIL_TONES = {
     "Professional": "professional and formal",
@@ -0,0 +1,180 @@
+import hashlib
+import io
+import json
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+# Longer mailto URLs are truncated by mail clients
+MAILTO_MAX_LENGTH = 2000
+# Exports kept per (text hash, format); a few per open session
+EXPORT_CACHE_SIZE = 256
+
+MARKDOWN_LINK = re.compile(r'\[([^\]]+)\]\(([^)]+)\)')
+MARKDOWN_EMPHASIS = re.compile(r'\*{1,2}([^*\n]+)\*{1,2}')
+MARKDOWN_HEADING = re.compile(r'^#{1,6}\s*', re.MULTILINE)
+PARAGRAPH_BREAKS = re.compile(r'\n\n+')
+# **bold** runs, split out for DOCX
+BOLD_RUN = re.compile(r'\*\*([^*\n]+)\*\*')
+
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+
+def markdown_to_html(text):
+    """Convert formatted markdown text to a standalone HTML document"""
+    html_content = text
+    # Convert markdown links [text](url) to HTML links
+    html_content = MARKDOWN_LINK.sub(r'<a href="\2">\1</a>', html_content)
+    # Convert line breaks to HTML
+    html_content = html_content.replace('\n\n', '</p><p>').replace('\n', '<br>')
+    # Wrap in basic HTML structure
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>Email</title>
+</head>
+<body>
+    <p>{html_content}</p>
+</body>
+</html>"""
+
+
+def split_subject(text):
+    """Return (subject, body) using a "Subject:" line in the first few lines"""
+    lines = text.split('\n')
+    for i, line in enumerate(lines[:3]):  # Check first 3 lines
+        if 'subject:' in line.lower():
+            subject = line.split(':', 1)[1].strip()
+            # Clean up subject - remove markdown formatting
+            subject = subject.replace('**', '').replace('*', '')
+            # Remove this line and join the rest as body
+            body_lines = lines[:i] + lines[i+1:]
+            return subject, '\n'.join(body_lines).strip()
+
+    # No subject found, use whole text as body
+    return "", text
+
+
+def build_mailto(text):
+    """Build the mailto payload for an email
+
+    Returns a dict with 'mailto_url'. When that URL is too long for mail
+    clients it also has 'clipboard_text' and a short 'placeholder_mailto'.
+    """
+    subject, body_text = split_subject(text)
+
+    # Convert markdown links to plain text with URLs
+    body_text = MARKDOWN_LINK.sub(r'\1: \2', body_text)
+
+    # Create mailto URL with subject and body
+    payload = {'mailto_url': f"mailto:?subject={quote(subject)}&body={quote(body_text)}"}
+
+    # Check URL length and provide fallback for long emails
+    if len(payload['mailto_url']) > MAILTO_MAX_LENGTH:
+        payload['clipboard_text'] = PARAGRAPH_BREAKS.sub('\r\r', body_text)  # Convert line breaks to carriage returns
+        payload['placeholder_mailto'] = f"mailto:?subject={quote(subject)}&body={quote('Email copied to clipboard, paste it here')}"
+    return payload
+
+
+def clipboard_button_html(payload):
+    """HTML/JS button that opens the placeholder mailto and copies the email"""
+    copy_text_js = json.dumps(payload['clipboard_text'])
+    return f"""
+                <html>
+                <body>
+                <button onclick="openEmailAndCopy()" style="background-color:#ff4b4b;color:white;border:none;padding:0.5rem 1rem;border-radius:0.25rem;cursor:pointer;">
+                    📧 Open Outlook
+                </button>
+
+                <script>
+                function openEmailAndCopy() {{
+                    window.open('{payload['placeholder_mailto']}', '_blank');
+                    navigator.clipboard.writeText({copy_text_js}).catch(() => {{
+                        alert('Email opened, but clipboard copy failed.');
+                    }});
+                }}
+                </script>
+                </body>
+                </html>
+                """
+
+
+def markdown_to_text(text):
+    """Plain text version of formatted markdown (links become "text: url")"""
+    text = MARKDOWN_LINK.sub(r'\1: \2', text)
+    text = MARKDOWN_HEADING.sub('', text)
+    return MARKDOWN_EMPHASIS.sub(r'\1', text)
+
+
+def _docx_paragraph(paragraph):
+    lines = MARKDOWN_HEADING.sub('', MARKDOWN_LINK.sub(r'\1: \2', paragraph)).split('\n')
+    runs = []
+    for i, line in enumerate(lines):
+        if i:
+            runs.append('<w:r><w:br/></w:r>')
+        # Odd pieces are the **bold** spans
+        for j, piece in enumerate(BOLD_RUN.split(line)):
+            piece = piece.replace('*', '')
+            if piece:
+                props = '<w:rPr><w:b/></w:rPr>' if j % 2 else ''
+                runs.append(f'<w:r>{props}<w:t xml:space="preserve">{escape(piece)}</w:t></w:r>')
+    return f"<w:p>{''.join(runs)}</w:p>"
+
+
+def markdown_to_docx(text):
+    """Word document bytes for formatted markdown: one paragraph per block, bold kept"""
+    body = ''.join(_docx_paragraph(p) for p in PARAGRAPH_BREAKS.split(text.strip()))
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body>{body}</w:body></w:document>'
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+        docx.writestr('_rels/.rels', DOCX_RELS)
+        docx.writestr('word/document.xml', document)
+    return buffer.getvalue()
+
+
+RENDERERS = {
+    'html': markdown_to_html,
+    'mailto': build_mailto,
+    'docx': markdown_to_docx,
+    'text': markdown_to_text,
+}
+
+_exports = OrderedDict()
+_exports_lock = threading.Lock()
+
+
+def render_export(text, export_format):
+    """Export of formatted text in one format, built on first request and memoised by text hash
+
+    Reruns with unchanged output only pay for hashing the text.
+    """
+    key = (hashlib.sha256(text.encode('utf-8')).hexdigest(), export_format)
+    with _exports_lock:
+        if key in _exports:
+            _exports.move_to_end(key)
+            return _exports[key]
+    rendered = RENDERERS[export_format](text)
+    with _exports_lock:
+        _exports[key] = rendered
+        while len(_exports) > EXPORT_CACHE_SIZE:
+            _exports.popitem(last=False)
+    return rendered
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    TEMPLATE_BUCKET, FORMAT_CACHE_SIZE, FORMAT_CACHE_TTL_SECONDS,
+    FORMAT_CACHE_BACKEND, FORMAT_CACHE_DIR
+)
+
+S3_CACHE_PREFIX = 'format-cache/'
+
+
+def normalise_text(text):
+    """Collapse whitespace so trivially different inputs share a cache entry"""
+    return ' '.join(text.split())
+
+
+def make_cache_key(text, doc_type, template, guardrails, model_id, template_hash=None):
+    """Hash everything that determines the formatted output"""
+    parts = [normalise_text(text), doc_type, template, guardrails, model_id]
+    if template_hash:
+        # Only added when set, so keys for requests without a template are unchanged
+        parts.append(template_hash)
+    payload = json.dumps(parts)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class FormatCache:
+    """In-memory LRU + TTL cache with an optional disk or S3 second tier"""
+
+    def __init__(self, max_entries=FORMAT_CACHE_SIZE, ttl=FORMAT_CACHE_TTL_SECONDS,
+                 backend=FORMAT_CACHE_BACKEND, s3_client=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self.s3 = s3_client
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'memory_hits': 0,
+            'backend_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'saved_seconds': 0.0
+        }
+
+    def get(self, key):
+        """Return the cached text for key, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry['stored_at'] < self.ttl:
+                self.entries.move_to_end(key)
+                self._record_hit('memory_hits', entry)
+                return entry['text']
+            if entry:
+                del self.entries[key]
+
+        entry = self._backend_get(key)
+        if entry and time.time() - entry['stored_at'] < self.ttl:
+            with self.lock:
+                self._insert(key, entry)
+                self._record_hit('backend_hits', entry)
+            return entry['text']
+
+        with self.lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, key, text, latency):
+        """Store formatted text along with the Bedrock latency it cost"""
+        entry = {'text': text, 'latency': latency, 'stored_at': time.time()}
+        with self.lock:
+            self._insert(key, entry)
+        self._backend_put(key, entry)
+
+    def stats(self):
+        """Counters plus hit rate, for diagnostics"""
+        with self.lock:
+            stats = dict(self.counters)
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+            stats['entries'] = len(self.entries)
+            stats['backend'] = self.backend
+            return stats
+
+    def _record_hit(self, counter, entry):
+        self.counters['hits'] += 1
+        self.counters[counter] += 1
+        self.counters['saved_seconds'] += entry['latency']
+
+    def _insert(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def _backend_get(self, key):
+        try:
+            if self.backend == 'disk':
+                path = os.path.join(FORMAT_CACHE_DIR, f"{key}.json")
+                if os.path.exists(path):
+                    with open(path, 'r') as f:
+                        return json.load(f)
+            elif self.backend == 's3' and self.s3:
+                response = self.s3.get_object(Bucket=TEMPLATE_BUCKET, Key=f"{S3_CACHE_PREFIX}{key}.json")
+                return json.loads(response['Body'].read())
+        except Exception:
+            # Missing or unreadable entries are treated as a miss
+            pass
+        return None
+
+    def _backend_put(self, key, entry):
+        try:
+            if self.backend == 'disk':
+                os.makedirs(FORMAT_CACHE_DIR, exist_ok=True)
+                # A temp file per writer, so concurrent puts of one key each replace the entry whole
+                with tempfile.NamedTemporaryFile('w', dir=FORMAT_CACHE_DIR, prefix=f"{key}.",
+                                                 suffix='.tmp', delete=False) as f:
+                    json.dump(entry, f)
+                try:
+                    os.replace(f.name, os.path.join(FORMAT_CACHE_DIR, f"{key}.json"))
+                except OSError:
+                    os.unlink(f.name)
+                    raise
+            elif self.backend == 's3' and self.s3:
+                self.s3.put_object(
+                    Bucket=TEMPLATE_BUCKET,
+                    Key=f"{S3_CACHE_PREFIX}{key}.json",
+                    Body=json.dumps(entry).encode('utf-8')
+                )
+        except Exception:
+            # The second tier is best effort; the memory tier still holds the entry
+            pass
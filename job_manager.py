@@ -0,0 +1,207 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from metrics import span
+from config import (
+    BEDROCK_STREAMING, JOB_WORKERS, JOB_TTL_SECONDS,
+    JOB_POLL_INITIAL_SECONDS, JOB_POLL_MAX_SECONDS, JOB_POLL_BACKOFF, JOB_TRANSCRIBE_TIMEOUT_SECONDS
+)
+
+# Job states
+QUEUED = 'queued'
+TRANSCRIBING = 'transcribing'
+FORMATTING = 'formatting'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a pipeline when its job has been cancelled"""
+
+
+class Job:
+    """State of one transcribe -> format pipeline run"""
+
+    def __init__(self, job_id, doc_type, kwargs):
+        self.id = job_id
+        self.doc_type = doc_type
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.transcription_job = None
+        self.transcript = None
+        self.audio_stats = {}
+        self.partial_text = ""
+        self.queue_position = 0  # place in the Bedrock admission queue while waiting
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def wait(self, timeout=None):
+        """Block until the job finishes or timeout passes; True if finished"""
+        return self.done_event.wait(timeout)
+
+    def _set_status(self, status):
+        self.status = status
+        self.updated_at = time.time()
+
+    def _check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def _on_queue(self, position):
+        # Called while waiting for Bedrock capacity; cancelling leaves the queue
+        self.queue_position = position
+        self._check_cancelled()
+
+
+class JobManager:
+    """Process-wide pool that runs pipelines independently of UI reruns"""
+
+    def __init__(self, max_workers=JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='speech-job')
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit_audio(self, processor, audio_bytes, doc_type, **kwargs):
+        """Start a transcribe -> format pipeline and return its job ID
+
+        audio_bytes may also be a readable file object, which the job closes
+        once the audio has been uploaded.
+        """
+        job = Job(uuid.uuid4().hex, doc_type, kwargs)
+        with self.lock:
+            self._expire_jobs()
+            self.jobs[job.id] = job
+        self.executor.submit(self._run_audio, job, processor, audio_bytes)
+        return job.id
+
+    def submit_transcription(self, processor, transcription_job, doc_type, **kwargs):
+        """Format the result of a transcription job that is already running (e.g. a streamed recording)"""
+        job = Job(uuid.uuid4().hex, doc_type, kwargs)
+        job.transcription_job = transcription_job
+        with self.lock:
+            self._expire_jobs()
+            self.jobs[job.id] = job
+        self.executor.submit(self._run_audio, job, processor, None)
+        return job.id
+
+    def get(self, job_id):
+        """Look up a job by ID, or None if unknown or expired"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Request cancellation; the pipeline stops at its next checkpoint"""
+        job = self.get(job_id)
+        if job and not job.finished:
+            job.cancel_event.set()
+
+    def stats(self):
+        """Count jobs by state"""
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def _expire_jobs(self):
+        cutoff = time.time() - JOB_TTL_SECONDS
+        for job_id in [j.id for j in self.jobs.values() if j.finished and j.updated_at < cutoff]:
+            del self.jobs[job_id]
+
+    def _run_audio(self, job, processor, audio_bytes):
+        with span('pipeline_total', doc_type=job.doc_type) as sp:
+            self._run_pipeline(job, processor, audio_bytes)
+            sp['status'] = job.status
+
+    def _run_pipeline(self, job, processor, audio_bytes):
+        try:
+            job._check_cancelled()
+            job._set_status(TRANSCRIBING)
+            if job.transcription_job is None:
+                audio, trim_stats = processor.preprocess_audio(audio_bytes)
+                job.audio_stats = trim_stats or {}
+                try:
+                    # Named by audio hash, so repeat submissions reuse earlier work
+                    job.transcription_job = processor.transcribe_audio(audio, stats=job.audio_stats)
+                finally:
+                    if audio is not audio_bytes:
+                        # Trimmed copy of a spilled recording
+                        self._close_audio(audio)
+                # Uploaded; release the file handle while the transcript is awaited
+                self._close_audio(audio_bytes)
+            job.transcript = self._wait_for_transcript(job, processor)
+
+            job._check_cancelled()
+            job._set_status(FORMATTING)
+            job.result = self._format(job, processor, job.transcript)
+            job._set_status(COMPLETED)
+        except JobCancelled:
+            if job.transcription_job:
+                processor.cancel_transcription(job.transcription_job)
+            job._set_status(CANCELLED)
+        except Exception as e:
+            job.error = str(e)
+            job._set_status(FAILED)
+        finally:
+            self._close_audio(audio_bytes)
+            job.done_event.set()
+
+    @staticmethod
+    def _close_audio(audio):
+        if hasattr(audio, 'close'):
+            audio.close()
+
+    def _wait_for_transcript(self, job, processor, timeout=JOB_TRANSCRIBE_TIMEOUT_SECONDS):
+        # Poll with exponential backoff; cancellation wakes the wait early
+        delay = JOB_POLL_INITIAL_SECONDS
+        deadline = time.monotonic() + timeout
+        while True:
+            # None while running; a finished silent recording gives ""
+            transcript = processor.get_transcription_result(job.transcription_job)
+            if transcript is not None:
+                if not transcript.strip():
+                    raise Exception("No speech detected in recording")
+                return transcript
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Transcription did not finish within {timeout}s")
+            if job.cancel_event.wait(min(delay, remaining)):
+                raise JobCancelled()
+            delay = min(delay * JOB_POLL_BACKOFF, JOB_POLL_MAX_SECONDS)
+
+    def _format(self, job, processor, text):
+        if not BEDROCK_STREAMING:
+            return processor.format_with_bedrock(text, job.doc_type, on_queue=job._on_queue, **job.kwargs)
+
+        # Expose partial output so subscribers can render it while it arrives
+        result = {}
+        for chunk in processor.format_with_bedrock_stream(text, job.doc_type, on_queue=job._on_queue,
+                                                          result=result, **job.kwargs):
+            job._check_cancelled()
+            job.partial_text += chunk
+        return result['text']
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Return the process-wide job manager, creating it on first use"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
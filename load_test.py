@@ -0,0 +1,322 @@
+"""Concurrent load generator that replays request traces
+
+Examples:
+    python load_test.py --trace jobs.jsonl --concurrency 50 --rate 5 --duration 60
+    python load_test.py --synthetic 200 --concurrency 20 --bedrock-latency 2.0 --throttle-rate 0.05
+    python load_test.py --trace jobs.jsonl --target http://localhost:8502 --concurrency 20
+
+Trace lines use the batch_runner job format ({"text"|"audio_path", "doc_type",
+"custom_prompt"}). Locally the full SpeechProcessor pipeline runs against
+in-process fake AWS backends with injectable latency and throttling; with
+--target, text items are POSTed to a running container's /format endpoint.
+Queue depth and memory are only reported locally: with --target they would
+describe this load generator, not the container under test.
+"""
+import os
+
+# Fake backends only; keep metric logs out of the report
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'loadtest')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'loadtest')
+os.environ.setdefault('METRICS_EMF_ENABLED', 'false')
+os.environ.setdefault('METRICS_PORT', '0')
+
+import argparse
+import hashlib
+import io
+import json
+import random
+import resource
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from botocore.exceptions import ClientError
+from batch_runner import load_jobs, process_job
+from bedrock_admission import AdmissionController
+from metrics import percentile
+from speech_processor import SpeechProcessor
+from config import BEDROCK_RPM, BEDROCK_TPM, BEDROCK_MAX_CONCURRENCY
+
+
+def _client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class FakeLatency:
+    """Sleeps for a jittered latency and sometimes raises a throttling error"""
+
+    def __init__(self, mean_seconds, throttle_rate=0.0):
+        self.mean_seconds = mean_seconds
+        self.throttle_rate = throttle_rate
+
+    def __call__(self, operation):
+        time.sleep(random.uniform(0.5, 1.5) * self.mean_seconds)
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            raise _client_error('ThrottlingException', operation)
+
+
+class FakeS3:
+    def __init__(self, latency):
+        self.latency = latency
+        self.objects = {}
+        self.uploads = {}
+
+    def upload_fileobj(self, fileobj, bucket, key, Config=None):
+        self.latency('PutObject')
+        self.objects[(bucket, key)] = fileobj.read()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.latency('PutObject')
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.latency('GetObject')
+        if (Bucket, Key) not in self.objects:
+            raise _client_error('NoSuchKey', 'GetObject')
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.latency('CreateMultipartUpload')
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self.latency('UploadPart')
+        if UploadId not in self.uploads:
+            raise _client_error('NoSuchUpload', 'UploadPart')
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self.latency('CompleteMultipartUpload')
+        parts = self.uploads.pop(UploadId, None)
+        if parts is None:
+            raise _client_error('NoSuchUpload', 'CompleteMultipartUpload')
+        self.objects[(Bucket, Key)] = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self.latency('AbortMultipartUpload')
+        self.uploads.pop(UploadId, None)
+
+
+class FakeTranscribe:
+    """Batch jobs that complete after a simulated processing time"""
+
+    exceptions = SimpleNamespace(
+        BadRequestException=type('BadRequestException', (Exception,), {}),
+        ConflictException=type('ConflictException', (Exception,), {})
+    )
+
+    def __init__(self, latency, job_seconds, s3):
+        self.latency = latency
+        self.job_seconds = job_seconds
+        self.s3 = s3
+        self.jobs = {}
+
+    def start_transcription_job(self, TranscriptionJobName, OutputBucketName, OutputKey, **kwargs):
+        self.latency('StartTranscriptionJob')
+        if TranscriptionJobName in self.jobs:
+            raise self.exceptions.ConflictException()
+        self.jobs[TranscriptionJobName] = {
+            'done_at': time.time() + random.uniform(0.5, 1.5) * self.job_seconds,
+            'output': (OutputBucketName, OutputKey)
+        }
+
+    def get_transcription_job(self, TranscriptionJobName):
+        self.latency('GetTranscriptionJob')
+        if TranscriptionJobName not in self.jobs:
+            raise self.exceptions.BadRequestException()
+        job = self.jobs[TranscriptionJobName]
+        done = time.time() >= job['done_at']
+        bucket, key = job['output']
+        if done and (bucket, key) not in self.s3.objects:
+            # Transcribe writes the output document when the job finishes
+            self.s3.objects[(bucket, key)] = json.dumps({'results': {
+                'transcripts': [{'transcript': f"Load test transcript for {TranscriptionJobName}"}],
+                'items': []
+            }}).encode('utf-8')
+        return {'TranscriptionJob': {
+            'TranscriptionJobStatus': 'COMPLETED' if done else 'IN_PROGRESS',
+            'Transcript': {'TranscriptFileUri': f"https://s3.amazonaws.com/{bucket}/{key}"}
+        }}
+
+    def delete_transcription_job(self, TranscriptionJobName):
+        self.jobs.pop(TranscriptionJobName, None)
+
+
+class FakeBedrock:
+    """Converse/ConverseStream stand-in echoing the input text"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def converse(self, messages, **kwargs):
+        self.latency('Converse')
+        text = messages[0]['content'][-1]['text']
+        return {'output': {'message': {'role': 'assistant', 'content': [{'text': text}]}},
+                'usage': {'inputTokens': len(text) // 4, 'outputTokens': len(text) // 4}}
+
+    def converse_stream(self, messages, **kwargs):
+        self.latency('ConverseStream')
+        text = messages[0]['content'][-1]['text']
+        events = [{'contentBlockDelta': {'delta': {'text': text[i:i + 40]}}} for i in range(0, len(text), 40)]
+        return {'stream': events}
+
+
+def build_fake_processor(args):
+    """A SpeechProcessor whose AWS clients are in-process fakes"""
+    processor = SpeechProcessor()
+    aws_latency = FakeLatency(args.aws_latency)
+    processor.s3 = FakeS3(aws_latency)
+    processor.transcribe = FakeTranscribe(aws_latency, args.transcribe_seconds, processor.s3)
+    processor.bedrock = FakeBedrock(FakeLatency(args.bedrock_latency, args.throttle_rate))
+    processor.format_cache.s3 = processor.s3
+    # Its own quota buckets, so earlier runs in this process do not slow this one down
+    processor.admission = AdmissionController(args.bedrock_rpm, args.bedrock_tpm, args.bedrock_concurrency)
+    if args.no_cache:
+        processor.format_cache.max_entries = 0
+    return processor
+
+
+def synthetic_jobs(count):
+    words = "please confirm the meeting next week and send the updated budget figures to the team".split()
+    return [
+        {'id': f"synthetic-{i}", 'text': ' '.join(random.choices(words, k=random.randint(20, 400)))}
+        for i in range(count)
+    ]
+
+
+def make_http_runner(target):
+    import requests
+    session = requests.Session()
+
+    def run(job):
+        if 'text' not in job:
+            raise ValueError("HTTP target replays text items only")
+        response = session.post(f"{target.rstrip('/')}/format", json={
+            'text': job['text'],
+            'doc_type': job.get('doc_type', 'Email'),
+            'custom_prompt': job.get('custom_prompt')
+        }, timeout=300)
+        response.raise_for_status()
+    return run
+
+
+def run(args):
+    jobs = load_jobs(args) if args.trace else synthetic_jobs(args.synthetic)
+    if not jobs:
+        print("No requests to replay")
+        return 1
+
+    if args.target:
+        run_one = make_http_runner(args.target)
+    else:
+        processor = build_fake_processor(args)
+
+        def run_one(job):
+            process_job(processor, job, 'Email')
+
+    lock = threading.Lock()
+    state = {'submitted': 0, 'started': 0, 'max_queue_depth': 0}
+    latencies = []
+    errors = {}
+
+    def execute(job, submitted_at):
+        with lock:
+            state['started'] += 1
+        try:
+            run_one(job)
+            outcome = None
+        except Exception as e:
+            outcome = type(e).__name__
+            if isinstance(e, ClientError):
+                outcome = e.response['Error']['Code']
+        with lock:
+            if outcome:
+                errors[outcome] = errors.get(outcome, 0) + 1
+            else:
+                latencies.append(time.time() - submitted_at)
+
+    # Closed loop (no --rate): a new request starts only when a worker frees up
+    slots = threading.Semaphore(args.concurrency) if not args.rate else None
+
+    def execute_and_release(job, submitted_at):
+        try:
+            execute(job, submitted_at)
+        finally:
+            if slots:
+                slots.release()
+
+    def more_requests(sent):
+        if args.duration:
+            return time.time() - started < args.duration
+        return sent < len(jobs)
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        sent = 0
+        while more_requests(sent):
+            if slots:
+                slots.acquire()
+            job = jobs[sent % len(jobs)]
+            sent += 1
+            with lock:
+                state['submitted'] += 1
+                state['max_queue_depth'] = max(state['max_queue_depth'], state['submitted'] - state['started'])
+            executor.submit(execute_and_release, job, time.time())
+            if args.rate:
+                # Open loop: Poisson arrivals regardless of how fast requests finish
+                time.sleep(random.expovariate(args.rate))
+    elapsed = time.time() - started
+
+    completed = len(latencies)
+    report = {
+        'target': args.target or 'local-fakes',
+        'requests': state['submitted'],
+        'completed': completed,
+        'errors': errors,
+        'elapsed_seconds': round(elapsed, 2),
+        'throughput_rps': round(completed / elapsed, 3) if elapsed else 0,
+        'latency_p50_seconds': percentile(latencies, 50),
+        'latency_p99_seconds': percentile(latencies, 99)
+    }
+    if not args.target:
+        # The pipeline ran in this process, so its queue and memory are the ones under test
+        report['max_queue_depth'] = state['max_queue_depth']
+        # ru_maxrss is in kilobytes on Linux
+        report['memory_high_water_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay request traces at a given concurrency and arrival rate")
+    parser.add_argument('--trace', dest='jobs', help="JSONL trace in batch_runner job format")
+    parser.add_argument('--synthetic', type=int, default=100, help="Generate N text requests when no trace is given")
+    parser.add_argument('--target', help="Base URL of a running HTTP API instead of local fakes")
+    parser.add_argument('--concurrency', type=int, default=20, help="Requests in flight at once")
+    parser.add_argument('--rate', type=float, default=0, help="Mean arrivals per second (0 = send as fast as workers free up)")
+    parser.add_argument('--duration', type=float, default=0, help="Keep replaying the trace for this many seconds")
+    parser.add_argument('--bedrock-latency', type=float, default=1.5, help="Mean fake Bedrock latency in seconds")
+    parser.add_argument('--aws-latency', type=float, default=0.05, help="Mean fake S3/Transcribe API latency")
+    parser.add_argument('--transcribe-seconds', type=float, default=5.0, help="Mean fake transcription job duration")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of Bedrock calls that throttle")
+    parser.add_argument('--bedrock-rpm', type=int, default=BEDROCK_RPM, help="Admission control requests/minute")
+    parser.add_argument('--bedrock-tpm', type=int, default=BEDROCK_TPM, help="Admission control tokens/minute")
+    parser.add_argument('--bedrock-concurrency', type=int, default=BEDROCK_MAX_CONCURRENCY,
+                        help="Bedrock calls in flight at once")
+    parser.add_argument('--no-cache', action='store_true', help="Disable the formatted-output cache")
+    parser.add_argument('--output', help="Also write the report JSON here")
+    args = parser.parse_args()
+    args.trace = args.jobs
+    args.audio_dir = None
+    return run(args)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_EMF_ENABLED, METRICS_NAMESPACE, METRICS_PORT, METRICS_PROM_FILE
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RECENT_SAMPLES = 1000
+PROM_FILE_INTERVAL_SECONDS = 10
+
+logger = logging.getLogger('speech_formatter.metrics')
+if not logger.handlers:
+    # One raw JSON object per line so CloudWatch can parse EMF records
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class MetricsRegistry:
+    """Per-stage latency histograms, totals of numeric span attributes and event counters"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.totals = {}
+        self.counters = {}
+        self.file_lock = threading.Lock()
+        self.file_written_at = 0
+
+    def increment(self, event, labels, value=1):
+        key = (event, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, stage, seconds, values=None):
+        with self.lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = {
+                    'count': 0,
+                    'sum': 0.0,
+                    'buckets': [0] * len(BUCKETS),
+                    'recent': deque(maxlen=RECENT_SAMPLES)
+                }
+            entry['count'] += 1
+            entry['sum'] += seconds
+            entry['recent'].append(seconds)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry['buckets'][i] += 1
+            for field, value in (values or {}).items():
+                key = (stage, field)
+                self.totals[key] = self.totals.get(key, 0) + value
+
+    def summary(self):
+        """Count and p50/p95/p99 seconds per stage over recent samples"""
+        with self.lock:
+            return {
+                stage: {
+                    'count': entry['count'],
+                    'p50': percentile(list(entry['recent']), 50),
+                    'p95': percentile(list(entry['recent']), 95),
+                    'p99': percentile(list(entry['recent']), 99)
+                }
+                for stage, entry in self.stages.items()
+            }
+
+    def render_prometheus(self):
+        """Prometheus text exposition of all stages"""
+        lines = [
+            '# HELP speech_formatter_stage_seconds Time spent in each pipeline stage',
+            '# TYPE speech_formatter_stage_seconds histogram'
+        ]
+        with self.lock:
+            for stage, entry in sorted(self.stages.items()):
+                for bound, count in zip(BUCKETS, entry['buckets']):
+                    lines.append(f'speech_formatter_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'speech_formatter_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+                lines.append(f'speech_formatter_stage_seconds_sum{{stage="{stage}"}} {entry["sum"]}')
+                lines.append(f'speech_formatter_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+
+            lines.append('# HELP speech_formatter_stage_value_total Sizes and token counts per stage')
+            lines.append('# TYPE speech_formatter_stage_value_total counter')
+            for (stage, field), total in sorted(self.totals.items()):
+                lines.append(f'speech_formatter_stage_value_total{{stage="{stage}",field="{field}"}} {total}')
+
+            lines.append('# HELP speech_formatter_events_total Events without a duration, e.g. routing decisions')
+            lines.append('# TYPE speech_formatter_events_total counter')
+            for (event, labels), total in sorted(self.counters.items()):
+                label_text = ''.join(f',{name}="{value}"' for name, value in labels)
+                lines.append(f'speech_formatter_events_total{{event="{event}"{label_text}}} {total}')
+        return '\n'.join(lines) + '\n'
+
+    def maybe_write_file(self):
+        if not METRICS_PROM_FILE:
+            return
+        # One writer at a time; spans finishing meanwhile skip rather than wait on the disk
+        if not self.file_lock.acquire(blocking=False):
+            return
+        try:
+            if time.time() - self.file_written_at < PROM_FILE_INTERVAL_SECONDS:
+                return
+            self.file_written_at = time.time()
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(METRICS_PROM_FILE)),
+                                            prefix=f"{os.path.basename(METRICS_PROM_FILE)}.", suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(self.render_prometheus())
+                # Atomic so a scraper never reads a half-written file
+                os.replace(tmp_path, METRICS_PROM_FILE)
+            except OSError:
+                os.unlink(tmp_path)
+                raise
+        finally:
+            self.file_lock.release()
+
+
+registry = MetricsRegistry()
+
+
+def emit_emf(stage, seconds, attrs):
+    """Log one CloudWatch Embedded Metric Format record"""
+    numeric = {k: v for k, v in attrs.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['Stage']],
+                'Metrics': [{'Name': 'Duration', 'Unit': 'Milliseconds'}] + [
+                    {'Name': field, 'Unit': 'Bytes' if field.endswith('_bytes') else 'Count'}
+                    for field in numeric
+                ]
+            }]
+        },
+        'Stage': stage,
+        'Duration': round(seconds * 1000, 3),
+        **attrs
+    }
+    logger.info(json.dumps(record, default=str))
+
+
+def emit_emf_count(event, value, labels):
+    """Log a CloudWatch EMF count, with the labels as dimensions"""
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['Event'] + sorted(labels)],
+                'Metrics': [{'Name': 'Count', 'Unit': 'Count'}]
+            }]
+        },
+        'Event': event,
+        'Count': value,
+        **labels
+    }
+    logger.info(json.dumps(record, default=str))
+
+
+def _export(func, *args):
+    """Run an exporter; a metrics failure is logged, never raised into the measured call"""
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("Metrics export failed")
+
+
+def count(event, value=1, **labels):
+    """Count an event that has no duration (kept out of the stage latency histograms)"""
+    labels = {name: str(label) for name, label in labels.items()}
+    registry.increment(event, labels, value)
+    if METRICS_EMF_ENABLED:
+        _export(emit_emf_count, event, value, labels)
+    _export(registry.maybe_write_file)
+
+
+def record(stage, seconds, **attrs):
+    """Record a stage duration measured elsewhere (e.g. from AWS timestamps)"""
+    numeric = {k: v for k, v in attrs.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+    registry.observe(stage, seconds, numeric)
+    if METRICS_EMF_ENABLED:
+        _export(emit_emf, stage, seconds, attrs)
+    _export(registry.maybe_write_file)
+
+
+@contextmanager
+def span(stage, **attrs):
+    """Time a block; add sizes or token counts to the yielded dict"""
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs['error'] = type(e).__name__
+        raise
+    finally:
+        record(stage, time.perf_counter() - started, **attrs)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the application log
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics on a background thread (once per process)"""
+    global _server
+    with _server_lock:
+        if _server is not None or not port:
+            return
+        try:
+            _server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+        except OSError:
+            # Port already taken, e.g. by another worker in the same container
+            return
+        threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
@@ -0,0 +1,237 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import metrics
+from metrics import percentile
+from config import (
+    BEDROCK_MODEL_ID, BEDROCK_MODELS, BEDROCK_ROUTING, BEDROCK_ROUTING_RULES,
+    BEDROCK_HEDGING, BEDROCK_HEDGE_PERCENTILE, BEDROCK_HEDGE_MIN_SAMPLES, BEDROCK_HEDGE_MIN_SECONDS
+)
+
+LATENCY_SAMPLES = 200
+HEDGE_WORKERS = 32
+
+
+class StreamFeed:
+    """Reads one event stream on a background thread so two can be raced
+
+    open_events(opened) must return an iterator of stream events and call
+    opened(response) once the stream exists, so cancel() can close it.
+    """
+
+    def __init__(self, open_events, events):
+        self.events = events
+        self.response = None
+        self.stopped = threading.Event()
+        threading.Thread(target=self._run, args=(open_events,), name='bedrock-stream', daemon=True).start()
+
+    def _opened(self, response):
+        self.response = response
+        if self.stopped.is_set():
+            self.cancel()
+
+    def _run(self, open_events):
+        iterator = open_events(self._opened)
+        try:
+            for event in iterator:
+                if self.stopped.is_set():
+                    return
+                self.events.put((self, event))
+            self.events.put((self, None))
+        except Exception as e:
+            if not self.stopped.is_set():
+                self.events.put((self, e))
+        finally:
+            # Releases the losing stream's admission slot straight away
+            iterator.close()
+
+    def cancel(self):
+        self.stopped.set()
+        if self.response is not None:
+            try:
+                # Drops the HTTP connection so a stalled stream stops using capacity
+                self.response['stream'].close()
+            except Exception:
+                pass
+
+
+class ModelRouter:
+    """Picks a model per request and races a backup when a call is unusually slow"""
+
+    def __init__(self, rules=BEDROCK_ROUTING_RULES, models=BEDROCK_MODELS):
+        self.rules = rules
+        self.models = models
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.routes = {}
+        self.hedges = {'sent': 0, 'backup_won': 0}
+        self.executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='bedrock-hedge')
+
+    def select(self, text, doc_type):
+        """Return (tier, model ID) from the first routing rule matching the request"""
+        if BEDROCK_ROUTING:
+            for doc_types, max_chars, tier in self.rules:
+                if doc_types is not None and doc_type not in doc_types:
+                    continue
+                if max_chars is not None and len(text) > max_chars:
+                    continue
+                return tier, self.models[tier]
+        return 'default', BEDROCK_MODEL_ID
+
+    def route(self, text, doc_type):
+        """Select the model for a request and record the decision"""
+        tier, model_id = self.select(text, doc_type)
+        with self.lock:
+            self.routes[tier] = self.routes.get(tier, 0) + 1
+        metrics.count('model_route', model=model_id, tier=tier)
+        return model_id
+
+    def observe(self, key, seconds):
+        """Add a latency sample for a kind of call, e.g. (model ID, max tokens)"""
+        with self.lock:
+            samples = self.latencies.get(key)
+            if samples is None:
+                samples = self.latencies[key] = deque(maxlen=LATENCY_SAMPLES)
+            samples.append(seconds)
+
+    def deadline(self, key):
+        """Seconds after which a call of this kind gets a backup, or None"""
+        if not BEDROCK_HEDGING:
+            return None
+        with self.lock:
+            samples = list(self.latencies.get(key, ()))
+        if len(samples) < BEDROCK_HEDGE_MIN_SAMPLES:
+            return None
+        return max(BEDROCK_HEDGE_MIN_SECONDS, percentile(samples, BEDROCK_HEDGE_PERCENTILE))
+
+    def _record_hedge(self, key, backup_won):
+        with self.lock:
+            self.hedges['sent'] += 1
+            self.hedges['backup_won'] += int(backup_won)
+        metrics.count('bedrock_hedge', model=key[0], winner='backup' if backup_won else 'primary')
+
+    def call(self, key, func, can_hedge=None):
+        """Return func(), racing a second func() if the first passes the deadline
+
+        A losing call that is already running cannot be aborted; its result
+        is discarded when it finishes.
+        """
+        deadline = self.deadline(key)
+        started = time.time()
+        if deadline is None:
+            result = func()
+            self.observe(key, time.time() - started)
+            return result
+
+        primary = self.executor.submit(func)
+        done, _ = wait([primary], timeout=deadline)
+        if done or (can_hedge is not None and not can_hedge()):
+            result = primary.result()
+            self.observe(key, time.time() - started)
+            return result
+
+        backup = self.executor.submit(func)
+        pending = {primary, backup}
+        winner = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = done.pop()
+            if winner.exception() is None:
+                break
+        for future in pending:
+            future.cancel()
+        self._record_hedge(key, winner is backup)
+        result = winner.result()
+        self.observe(key, time.time() - started)
+        return result
+
+    def stream(self, key, open_events, can_hedge=None):
+        """Yield events from open_events(), racing a backup if the first event is late
+
+        The first stream to produce an event wins; the other is closed.
+        """
+        deadline = self.deadline(key)
+        started = time.time()
+        if deadline is None:
+            # No race needed; read the stream on the caller's thread
+            iterator = open_events(lambda response: None)
+            try:
+                for event in iterator:
+                    if started is not None:
+                        self.observe(key, time.time() - started)
+                        started = None
+                    yield event
+            finally:
+                iterator.close()
+            return
+
+        events = queue.Queue()
+        feeds = [StreamFeed(open_events, events)]
+        failed = set()
+        winner = None
+        try:
+            while True:
+                timeout = None
+                if winner is None and deadline is not None and len(feeds) == 1:
+                    timeout = max(0, started + deadline - time.time())
+                try:
+                    feed, item = events.get(timeout=timeout)
+                except queue.Empty:
+                    if can_hedge is None or can_hedge():
+                        feeds.append(StreamFeed(open_events, events))
+                    else:
+                        deadline = None
+                    continue
+
+                if winner is None:
+                    if isinstance(item, Exception) and len(feeds) - len(failed) > 1:
+                        failed.add(feed)
+                        continue
+                    winner = feed
+                    if not isinstance(item, Exception):
+                        self.observe(key, time.time() - started)
+                    if len(feeds) > 1:
+                        self._record_hedge(key, winner is not feeds[0])
+                    for other in feeds:
+                        if other is not winner:
+                            other.cancel()
+                elif feed is not winner:
+                    continue
+
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for feed in feeds:
+                feed.cancel()
+
+    def stats(self):
+        with self.lock:
+            sent = self.hedges['sent']
+            return {
+                'routes': dict(self.routes),
+                'hedges_sent': sent,
+                'backup_win_rate': round(self.hedges['backup_won'] / sent, 3) if sent else None,
+                'hedge_deadlines': {
+                    f"{model}:{kind}": round(max(BEDROCK_HEDGE_MIN_SECONDS,
+                                                 percentile(list(samples), BEDROCK_HEDGE_PERCENTILE)), 3)
+                    for (model, kind), samples in self.latencies.items()
+                }
+            }
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router():
+    """Return the process-wide router, whose latency history all sessions share"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
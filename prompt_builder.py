@@ -0,0 +1,65 @@
+from functools import lru_cache
+from config import DOCUMENT_PROMPTS, EMAIL_TONES, BEDROCK_PROMPT_CACHING
+
+# Instructions appended to every prompt
+PROMPT_GUARDRAILS = [
+    "IMPORTANT: Never use slang or informal contractions like 'wanna', 'gonna', 'coulda', 'shoulda', 'would've', etc. Use proper English words instead.",
+    "Do not duplicate greetings - use only one greeting at the start.",
+    "Only include booking links when the input text specifically mentions booking a call, meeting, or appointment."
+]
+
+# Stands in for {text} in the static instructions; the text itself goes in the user message
+TEXT_REFERENCE = "[the text in the user message]"
+
+
+class CompiledPrompt:
+    """Static instructions for one document type, ready to send via Converse
+
+    Everything that does not depend on the input text lives in the system
+    prompt, followed by a cache point so Bedrock can reuse the prefix across
+    requests. Only the text to format changes per call.
+    """
+
+    def __init__(self, system_text):
+        self.system_text = system_text
+        self.system = [{"text": system_text}]
+        if BEDROCK_PROMPT_CACHING:
+            self.system.append({"cachePoint": {"type": "default"}})
+
+    def messages(self, text, examples=None):
+        """Converse messages for the text to format
+
+        examples is an optional text block (e.g. email template excerpts) sent
+        ahead of the text, outside the cached system prompt.
+        """
+        content = [{"text": examples}] if examples else []
+        return [{"role": "user", "content": content + [{"text": text}]}]
+
+
+def resolve_template(doc_type, custom_prompt=None):
+    """Return the prompt template (with {text} placeholder) for a document type"""
+    # Use custom prompt for emails if provided
+    if doc_type == "Email" and custom_prompt is not None:
+        user_prompt = custom_prompt
+        # Auto-append {text} placeholder if not present
+        if '{text}' not in user_prompt:
+            user_prompt += "\n\nText to format: {text}"
+
+        # Add instruction for direct output
+        user_prompt += "\n\nProvide only the formatted email, no explanations or meta-text."
+        return user_prompt
+    return DOCUMENT_PROMPTS[doc_type]
+
+
+@lru_cache(maxsize=256)
+def compile_prompt(doc_type, custom_prompt=None, tone=None):
+    """Build (once per settings combination) the static prompt for a document type"""
+    system_text = resolve_template(doc_type, custom_prompt).replace('{text}', TEXT_REFERENCE)
+
+    if tone in EMAIL_TONES:
+        system_text += f"\n\nUse a {EMAIL_TONES[tone]} tone."
+
+    # Add hardcoded guardrails to ALL prompts
+    for guardrail in PROMPT_GUARDRAILS:
+        system_text += "\n\n" + guardrail
+    return CompiledPrompt(system_text)
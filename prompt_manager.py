@@ -1,8 +1,24 @@
 import json
 import os
 import base64
+import hashlib
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from config import (
+    TEMPLATE_BUCKET, SETTINGS_BACKEND, SETTINGS_DIR, SETTINGS_CACHE_SIZE,
+    SETTINGS_CACHE_TTL_SECONDS, TEMPLATE_CACHE_SIZE
+)
 
+# Global settings file used before per-user records; migrated to DEFAULT_USER
 SETTINGS_FILE = "email_settings.json"
+# Sessions without an identity share this record
+DEFAULT_USER = "default"
+S3_USERS_PREFIX = 'settings/users/'
+S3_TEMPLATES_PREFIX = 'settings/templates/'
+S3_MISSING_CODES = ('NoSuchKey', 'NotFound', '404')
 
 DEFAULT_EMAIL_PROMPT = "Customise your email response with the tone, your personal greeting and sign off and any other information the model will use to get your emails right."
 
@@ -20,35 +36,205 @@ Use the custom email prompt to add personalised details such as:
 • Never use emojis
 • Keep the tone informal but professional"""
 
-def load_email_settings():
-    """Load email settings from file"""
-    if os.path.exists(SETTINGS_FILE):
-        try:
-            with open(SETTINGS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            pass
-    
+
+def default_settings():
     return {
         "custom_prompt": DEFAULT_EMAIL_PROMPT,
-        "template_file": None,
+        "template_hash": None,
         "template_filename": None
     }
 
-def save_email_settings(settings):
-    """Save email settings to file"""
-    with open(SETTINGS_FILE, 'w') as f:
-        json.dump(settings, f, indent=2)
+
+def _is_missing(error):
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in S3_MISSING_CODES
+    return isinstance(error, FileNotFoundError)
+
+
+def _atomic_write(path, data):
+    """Write bytes via a temp file in the same directory, so readers never see half a file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class SettingsStore:
+    """Per-user settings records with template files stored once by content hash
+
+    Records hold only small metadata (prompt, template hash and filename).
+    Template bytes are read from the blob store on demand and cached, and
+    are never rewritten since their key is their SHA-256.
+    """
+
+    def __init__(self, backend=SETTINGS_BACKEND, s3_client=None, root=SETTINGS_DIR):
+        self.backend = backend
+        self.s3 = s3_client
+        self.root = root
+        self.records = OrderedDict()
+        self.templates = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _user_key(self, user_id):
+        # Identities can contain any characters; hash them into safe file names
+        return hashlib.sha256(user_id.encode('utf-8')).hexdigest()[:32]
+
+    def _s3_key(self, kind, name):
+        return f"{S3_USERS_PREFIX if kind == 'users' else S3_TEMPLATES_PREFIX}{name}"
+
+    def _read(self, kind, name):
+        try:
+            if self.backend == 's3':
+                return self.s3.get_object(Bucket=TEMPLATE_BUCKET, Key=self._s3_key(kind, name))['Body'].read()
+            with open(os.path.join(self.root, kind, name), 'rb') as f:
+                return f.read()
+        except (OSError, ClientError) as e:
+            if _is_missing(e):
+                return None
+            raise
+
+    def _write(self, kind, name, data):
+        if self.backend == 's3':
+            # A single PUT replaces the object atomically
+            self.s3.put_object(Bucket=TEMPLATE_BUCKET, Key=self._s3_key(kind, name), Body=data)
+        else:
+            _atomic_write(os.path.join(self.root, kind, name), data)
+
+    def _exists(self, kind, name):
+        if self.backend == 's3':
+            try:
+                self.s3.head_object(Bucket=TEMPLATE_BUCKET, Key=self._s3_key(kind, name))
+                return True
+            except ClientError as e:
+                if _is_missing(e):
+                    return False
+                raise
+        return os.path.exists(os.path.join(self.root, kind, name))
+
+    def load(self, user_id):
+        """Return a copy of a user's settings (defaults if they have none)"""
+        with self.lock:
+            entry = self.records.get(user_id)
+            if entry and time.time() - entry['loaded_at'] < SETTINGS_CACHE_TTL_SECONDS:
+                self.records.move_to_end(user_id)
+                return dict(entry['settings'])
+
+        data = self._read('users', f"{self._user_key(user_id)}.json")
+        try:
+            stored = json.loads(data) if data is not None else None
+        except ValueError:
+            stored = {}  # Unreadable record; start again from the defaults
+        if stored is not None:
+            settings = {**default_settings(), **stored}
+        elif user_id == DEFAULT_USER and os.path.exists(SETTINGS_FILE):
+            settings = self._migrate_legacy()
+        else:
+            settings = default_settings()
+        self._cache_record(user_id, settings)
+        return dict(settings)
+
+    def save(self, user_id, settings):
+        """Replace a user's settings record"""
+        record = {k: settings.get(k) for k in default_settings()}
+        record['updated_at'] = time.time()
+        self._write('users', f"{self._user_key(user_id)}.json", json.dumps(record, indent=2).encode('utf-8'))
+        self._cache_record(user_id, record)
+
+    def put_template(self, content):
+        """Store template bytes once and return their content hash"""
+        template_hash = hashlib.sha256(content).hexdigest()
+        with self.lock:
+            known = template_hash in self.templates
+        if not known and not self._exists('templates', template_hash):
+            self._write('templates', template_hash, content)
+        self._cache_template(template_hash, content)
+        return template_hash
+
+    def get_template(self, template_hash):
+        """Template bytes for a hash, loaded on first use; None if missing"""
+        with self.lock:
+            if template_hash in self.templates:
+                self.templates.move_to_end(template_hash)
+                return self.templates[template_hash]
+        content = self._read('templates', template_hash)
+        if content is not None:
+            self._cache_template(template_hash, content)
+        return content
+
+    def _cache_record(self, user_id, settings):
+        with self.lock:
+            self.records[user_id] = {'settings': dict(settings), 'loaded_at': time.time()}
+            self.records.move_to_end(user_id)
+            while len(self.records) > SETTINGS_CACHE_SIZE:
+                self.records.popitem(last=False)
+
+    def _cache_template(self, template_hash, content):
+        with self.lock:
+            self.templates[template_hash] = content
+            self.templates.move_to_end(template_hash)
+            while len(self.templates) > TEMPLATE_CACHE_SIZE:
+                self.templates.popitem(last=False)
+
+    def _migrate_legacy(self):
+        """Move the old global settings file (with its inline base64 template) into DEFAULT_USER"""
+        try:
+            with open(SETTINGS_FILE, 'r') as f:
+                legacy = json.load(f)
+        except (OSError, ValueError):
+            return default_settings()
+        settings = default_settings()
+        settings['custom_prompt'] = legacy.get('custom_prompt') or DEFAULT_EMAIL_PROMPT
+        if legacy.get('template_file'):
+            settings['template_hash'] = self.put_template(base64.b64decode(legacy['template_file']))
+            settings['template_filename'] = legacy.get('template_filename')
+        self.save(DEFAULT_USER, settings)
+        return settings
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_settings_store():
+    """Return the process-wide settings store shared by all sessions"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            s3_client = None
+            if SETTINGS_BACKEND == 's3':
+                from speech_processor import get_shared_processor
+                s3_client = get_shared_processor().s3
+            _store = SettingsStore(s3_client=s3_client)
+        return _store
+
+
+def load_email_settings(user_id=DEFAULT_USER):
+    """Load a user's email settings (metadata only, not template contents)"""
+    return get_settings_store().load(user_id)
+
+
+def save_email_settings(settings, user_id=DEFAULT_USER):
+    """Save a user's email settings"""
+    get_settings_store().save(user_id, settings)
+
 
 def save_template_file(file_content, filename):
-    """Save template file as base64 encoded string"""
+    """Store an uploaded template; returns the settings fields that reference it"""
     return {
-        "content": base64.b64encode(file_content).decode('utf-8'),
-        "filename": filename
+        "template_hash": get_settings_store().put_template(file_content),
+        "template_filename": filename
     }
 
-def load_template_file(template_data):
-    """Load template file from base64 encoded string"""
-    if template_data:
-        return base64.b64decode(template_data["content"].encode('utf-8'))
+
+def load_template_file(settings):
+    """Template bytes referenced by a settings record, or None"""
+    if settings and settings.get("template_hash"):
+        return get_settings_store().get_template(settings["template_hash"])
     return None
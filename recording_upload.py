@@ -0,0 +1,279 @@
+"""Recordings uploaded in chunks while the user is still speaking
+
+Server side only, exposed through the HTTP API (POST /recordings) for
+callers inside the VPC. No client in this repo sends chunks: the Streamlit
+UI's recorder (streamlit_mic_recorder) hands over the whole recording when
+it stops, so UI users still wait for the upload after recording.
+"""
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from job_manager import get_job_manager
+from speech_processor import TRANSFER_CONFIG
+from config import (
+    TRANSCRIBE_BUCKET, TRANSCRIBE_MODE, RECORDING_UPLOAD, RECORDING_PART_MB, RECORDING_TTL_SECONDS,
+    RECORDING_SWEEP_INTERVAL_SECONDS
+)
+
+MB = 1024 * 1024
+PART_UPLOAD_WORKERS = 8
+# Formats browsers record in (MediaRecorder) plus the ones the UI uploads
+MEDIA_FORMATS = ('webm', 'ogg', 'wav', 'flac', 'mp4', 'm4a', 'mp3')
+
+logger = logging.getLogger('speech_formatter.recordings')
+
+
+class RecordingError(Exception):
+    """A chunk or request that does not fit the recording's state"""
+
+
+class ChunkOrderError(RecordingError):
+    """A chunk arrived before the ones preceding it"""
+
+
+class MultipartSink:
+    """Sends chunks to an S3 multipart upload as they arrive
+
+    Chunks are buffered up to RECORDING_PART_MB (S3's minimum part size) and
+    each full part is uploaded in the background, so when recording stops
+    only the last partial part is left to send.
+    """
+
+    def __init__(self, s3, key, executor, part_size=RECORDING_PART_MB * MB):
+        self.s3 = s3
+        self.key = key
+        self.executor = executor
+        self.part_size = part_size
+        self.pending = bytearray()
+        self.parts = []
+        self.upload_id = s3.create_multipart_upload(Bucket=TRANSCRIBE_BUCKET, Key=key)['UploadId']
+
+    def write(self, chunk):
+        self.pending += chunk
+        if len(self.pending) >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self):
+        number = len(self.parts) + 1
+        body = bytes(self.pending)
+        self.pending.clear()
+        self.parts.append((number, self.executor.submit(
+            self.s3.upload_part, Bucket=TRANSCRIBE_BUCKET, Key=self.key,
+            UploadId=self.upload_id, PartNumber=number, Body=body
+        )))
+
+    def complete(self):
+        """Upload the final part and assemble the object"""
+        if self.pending or not self.parts:
+            self._upload_part()
+        parts = [{'PartNumber': number, 'ETag': future.result()['ETag']} for number, future in self.parts]
+        self.s3.complete_multipart_upload(
+            Bucket=TRANSCRIBE_BUCKET, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': parts}
+        )
+
+    def abort(self):
+        for _, future in self.parts:
+            future.cancel()
+        try:
+            # Stops S3 keeping (and billing for) the uploaded parts
+            self.s3.abort_multipart_upload(Bucket=TRANSCRIBE_BUCKET, Key=self.key, UploadId=self.upload_id)
+        except Exception:
+            pass
+
+
+class SpoolSink:
+    """Appends chunks to an anonymous temp file that is uploaded when recording stops"""
+
+    def __init__(self, s3, key):
+        self.s3 = s3
+        self.key = key
+        self.file = tempfile.TemporaryFile(prefix='speech-recording-')
+
+    def write(self, chunk):
+        self.file.write(chunk)
+
+    def complete(self):
+        self.file.seek(0)
+        try:
+            self.s3.upload_fileobj(self.file, TRANSCRIBE_BUCKET, self.key, Config=TRANSFER_CONFIG)
+        finally:
+            self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+class Recording:
+    """One recording being received chunk by chunk"""
+
+    def __init__(self, recording_id, processor, media_format, sink):
+        self.id = recording_id
+        self.processor = processor
+        self.media_format = media_format
+        self.sink = sink
+        self.next_seq = 0
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.started_at = time.time()
+        self.updated_at = self.started_at
+        # Set under lock once the recording is finished or aborted; later chunks are refused
+        self.closed = False
+        self.lock = threading.Lock()
+
+
+class RecordingManager:
+    """Process-wide registry of recordings uploaded while the user is still speaking
+
+    In 'multipart' mode chunks go to S3 during recording. In 'spool' mode (and
+    always for streaming transcription, which sends audio directly) they are
+    kept in a local file until the recording stops.
+    """
+
+    def __init__(self, mode=RECORDING_UPLOAD):
+        self.mode = 'spool' if TRANSCRIBE_MODE == 'streaming' else mode
+        self.recordings = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=PART_UPLOAD_WORKERS, thread_name_prefix='recording-part')
+        self.sweeper = None
+
+    def start_sweeper(self, interval=RECORDING_SWEEP_INTERVAL_SECONDS):
+        if self.sweeper is None:
+            self.sweeper = threading.Thread(target=self._sweep_forever, args=(interval,),
+                                            name='recording-sweeper', daemon=True)
+            self.sweeper.start()
+
+    def _sweep_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Recording sweep failed")
+
+    def sweep(self):
+        """Abort recordings that have had no chunks for RECORDING_TTL_SECONDS"""
+        with self.lock:
+            expired = self._expire_recordings()
+        for recording in expired:
+            self._close(recording)
+
+    def start(self, processor, media_format):
+        """Open a recording and return its ID"""
+        if media_format not in MEDIA_FORMATS:
+            raise RecordingError(f"format must be one of {list(MEDIA_FORMATS)}")
+        if TRANSCRIBE_MODE == 'streaming' and media_format != 'wav':
+            raise RecordingError("Streaming transcription only accepts wav recordings")
+        recording_id = uuid.uuid4().hex
+        key = f"audio/recording-{recording_id}.{media_format}"
+        if self.mode == 'multipart':
+            sink = MultipartSink(processor.s3, key, self.executor)
+        else:
+            sink = SpoolSink(processor.s3, key)
+        with self.lock:
+            self.recordings[recording_id] = Recording(recording_id, processor, media_format, sink)
+        return recording_id
+
+    def get(self, recording_id):
+        with self.lock:
+            return self.recordings.get(recording_id)
+
+    def append(self, recording_id, seq, chunk):
+        """Add chunk number seq (from 0); a resent chunk is ignored. Returns bytes received so far."""
+        recording = self._require(recording_id)
+        with recording.lock:
+            if recording.closed:
+                raise RecordingError("Recording is already finished")
+            if seq < recording.next_seq:
+                return recording.size
+            if seq > recording.next_seq:
+                raise ChunkOrderError(f"Expected chunk {recording.next_seq}, got {seq}")
+            recording.sink.write(chunk)
+            recording.digest.update(chunk)
+            recording.size += len(chunk)
+            recording.next_seq += 1
+            recording.updated_at = time.time()
+            return recording.size
+
+    def finish(self, recording_id, doc_type, **kwargs):
+        """Close the upload, start transcription straight away and return the formatting job's ID"""
+        recording = self._require(recording_id)
+        with self.lock:
+            self.recordings.pop(recording_id, None)
+
+        job_manager = get_job_manager()
+        started = time.time()
+        with recording.lock:
+            # Chunks still arriving for this recording are refused from here on
+            if recording.closed:
+                raise RecordingError("Recording is already finished")
+            recording.closed = True
+            if not recording.size:
+                recording.sink.abort()
+                raise RecordingError("Recording is empty")
+            if isinstance(recording.sink, SpoolSink) and recording.media_format == 'wav':
+                # Same path as a finished WAV: silence trimming, compression, either transcription mode
+                recording.sink.file.seek(0)
+                job_id = job_manager.submit_audio(recording.processor, recording.sink.file, doc_type, **kwargs)
+            else:
+                try:
+                    recording.sink.complete()
+                except Exception:
+                    recording.sink.abort()
+                    raise
+                transcription_job = recording.processor.transcribe_uploaded(
+                    recording.sink.key, recording.media_format, recording.digest.hexdigest()
+                )
+                job_id = job_manager.submit_transcription(recording.processor, transcription_job, doc_type, **kwargs)
+        # Time from the user stopping to transcription starting
+        metrics.record('recording_finish', time.time() - started, mode=self.mode,
+                       upload_bytes=recording.size, chunks=recording.next_seq)
+        return job_id
+
+    def abort(self, recording_id):
+        with self.lock:
+            recording = self.recordings.pop(recording_id, None)
+        if recording:
+            self._close(recording)
+
+    def _close(self, recording):
+        with recording.lock:
+            if recording.closed:
+                return
+            recording.closed = True
+        recording.sink.abort()
+
+    def _require(self, recording_id):
+        recording = self.get(recording_id)
+        if recording is None:
+            raise KeyError(recording_id)
+        return recording
+
+    def _expire_recordings(self):
+        cutoff = time.time() - RECORDING_TTL_SECONDS
+        expired = [r for r in self.recordings.values() if r.updated_at < cutoff]
+        for recording in expired:
+            del self.recordings[recording.id]
+        return expired
+
+    def stats(self):
+        with self.lock:
+            return {'mode': self.mode, 'active': len(self.recordings)}
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_recording_manager():
+    """Return the process-wide recording manager, starting its sweeper on first use"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = RecordingManager()
+            _manager.start_sweeper()
+        return _manager
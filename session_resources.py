@@ -0,0 +1,237 @@
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+import weakref
+from job_manager import get_job_manager
+from config import (
+    AUDIO_SPILL_THRESHOLD_MB, SESSION_MEMORY_CAP_MB, SESSION_SPILL_DIR, SESSION_IDLE_SECONDS,
+    SESSION_ORPHAN_SECONDS, SESSION_SWEEP_INTERVAL_SECONDS
+)
+
+MB = 1024 * 1024
+COPY_CHUNK_BYTES = 1024 * 1024
+
+logger = logging.getLogger('speech_formatter.sessions')
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class AudioBuffer:
+    """A recording held in memory, or in a temp file once it is large
+
+    open() returns a fresh read-only file object each time without copying the
+    audio, so a running job can keep reading after the buffer is released. The
+    temp file is deleted on close() or when the buffer is garbage collected.
+    """
+
+    def __init__(self, data=b""):
+        self.size = len(data)
+        self.data = data
+        self.path = None
+        self._finalizer = None
+
+    @property
+    def in_memory(self):
+        return self.data is not None
+
+    def _create_file(self):
+        fd, self.path = tempfile.mkstemp(prefix='speech-audio-', suffix='.bin', dir=SESSION_SPILL_DIR)
+        self._finalizer = weakref.finalize(self, _remove, self.path)
+        return os.fdopen(fd, 'wb')
+
+    def spill(self):
+        """Move the audio to a temp file and drop the in-memory copy"""
+        if self.data is None:
+            return
+        with self._create_file() as f:
+            f.write(self.data)
+        self.data = None
+
+    @classmethod
+    def from_stream(cls, stream, length, spill_threshold=AUDIO_SPILL_THRESHOLD_MB * MB):
+        """Read length bytes from a stream, straight to a temp file above the threshold"""
+        if length <= spill_threshold:
+            return cls(stream.read(length))
+        buffer = cls()
+        buffer.data = None
+        with buffer._create_file() as f:
+            remaining = length
+            while remaining:
+                chunk = stream.read(min(COPY_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+        buffer.size = length - remaining
+        return buffer
+
+    def open(self):
+        if self.data is not None:
+            # BytesIO shares the bytes object until written to
+            return io.BytesIO(self.data)
+        return open(self.path, 'rb')
+
+    def close(self):
+        self.data = None
+        if self._finalizer:
+            # Open readers keep the file's contents until they close it
+            self._finalizer()
+
+
+class SessionResources:
+    """Large per-session state kept outside st.session_state"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.audio = None
+        self.job_ids = set()
+        self.held_bytes = 0  # other session state, e.g. formatted output
+        self.last_seen = time.time()
+
+    @property
+    def memory_bytes(self):
+        audio = self.audio.size if self.audio and self.audio.in_memory else 0
+        return audio + self.held_bytes
+
+
+class SessionRegistry:
+    """Process-wide view of session buffers, with a sweeper for abandoned sessions
+
+    Sessions check in on every script run. One not seen for
+    SESSION_ORPHAN_SECONDS has its unfinished jobs cancelled (the UI reruns every
+    few seconds while a job runs), and after SESSION_IDLE_SECONDS its buffers are
+    released.
+    """
+
+    def __init__(self, memory_cap=SESSION_MEMORY_CAP_MB * MB, spill_threshold=AUDIO_SPILL_THRESHOLD_MB * MB):
+        self.memory_cap = memory_cap
+        self.spill_threshold = spill_threshold
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.counters = {'spilled': 0, 'evicted_sessions': 0, 'cancelled_jobs': 0}
+        self.sweeper = None
+
+    def start_sweeper(self, interval=SESSION_SWEEP_INTERVAL_SECONDS):
+        if self.sweeper is None:
+            self.sweeper = threading.Thread(target=self._sweep_forever, args=(interval,),
+                                            name='session-sweeper', daemon=True)
+            self.sweeper.start()
+
+    def _sweep_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Session sweep failed")
+
+    def _resources(self, session_id):
+        resources = self.sessions.get(session_id)
+        if resources is None:
+            resources = self.sessions[session_id] = SessionResources(session_id)
+        return resources
+
+    def touch(self, session_id, held_bytes=0):
+        """Record that a session is alive and return its resources"""
+        with self.lock:
+            resources = self._resources(session_id)
+            resources.last_seen = time.time()
+            resources.held_bytes = held_bytes
+            self._enforce_cap(resources)
+            return resources
+
+    def _enforce_cap(self, resources):
+        audio = resources.audio
+        if audio and audio.in_memory and resources.memory_bytes > self.memory_cap:
+            audio.spill()
+            self.counters['spilled'] += 1
+
+    def store_audio(self, session_id, data):
+        """Replace a session's recording; spilled to disk when large or over the session cap"""
+        buffer = AudioBuffer(data)
+        with self.lock:
+            resources = self._resources(session_id)
+            if resources.audio:
+                resources.audio.close()
+            resources.audio = buffer
+            if buffer.size > self.spill_threshold:
+                buffer.spill()
+                self.counters['spilled'] += 1
+            else:
+                self._enforce_cap(resources)
+        return buffer
+
+    def clear_audio(self, session_id):
+        with self.lock:
+            resources = self.sessions.get(session_id)
+            if resources and resources.audio:
+                resources.audio.close()
+                resources.audio = None
+
+    def attach_job(self, session_id, job_id):
+        """Make a session the owner of a job (e.g. after a reconnect), so only its absence cancels it"""
+        with self.lock:
+            for resources in self.sessions.values():
+                resources.job_ids.discard(job_id)
+            self._resources(session_id).job_ids.add(job_id)
+
+    def sweep(self, now=None):
+        """Cancel orphaned jobs and release abandoned sessions; returns sessions released"""
+        now = now or time.time()
+        orphaned = []
+        expired = []
+        with self.lock:
+            for session_id, resources in list(self.sessions.items()):
+                idle = now - resources.last_seen
+                if idle > SESSION_ORPHAN_SECONDS and resources.job_ids:
+                    orphaned.extend(resources.job_ids)
+                    resources.job_ids = set()
+                if idle > SESSION_IDLE_SECONDS:
+                    expired.append(self.sessions.pop(session_id))
+
+        job_manager = get_job_manager()
+        for job_id in orphaned:
+            job = job_manager.get(job_id)
+            if job and not job.finished:
+                # The pipeline also cancels its Transcribe job
+                job_manager.cancel(job_id)
+                with self.lock:
+                    self.counters['cancelled_jobs'] += 1
+        for resources in expired:
+            if resources.audio:
+                resources.audio.close()
+        with self.lock:
+            self.counters['evicted_sessions'] += len(expired)
+        return len(expired)
+
+    def stats(self):
+        with self.lock:
+            buffers = [r.audio for r in self.sessions.values() if r.audio]
+            return {
+                'sessions': len(self.sessions),
+                'memory_bytes': sum(r.memory_bytes for r in self.sessions.values()),
+                'spilled_bytes': sum(b.size for b in buffers if not b.in_memory),
+                **self.counters
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_session_registry():
+    """Return the process-wide session registry, starting its sweeper on first use"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = SessionRegistry()
+            _registry.start_sweeper()
+        return _registry
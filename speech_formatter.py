@@ -1,11 +1,16 @@
 import streamlit as st
-import boto3
 from datetime import datetime
-import json
-import uuid
-from speech_processor import SpeechProcessor
-from config import AWS_REGION
+import threading
+from job_manager import get_job_manager, COMPLETED, FAILED, CANCELLED, FORMATTING
+from config import BEDROCK_STREAMING, AUDIO_PLAYER_MAX_MB
+from metrics import span, start_metrics_server, registry as metrics_registry
+from document_export import DOCX_MIME, clipboard_button_html, render_export
+from session_resources import get_session_registry
 from prompt_manager import load_email_settings, save_email_settings, EXAMPLE_EMAIL_PROMPT, save_template_file
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.web.server.websocket_headers import _get_websocket_headers
+from user_identity import user_id_from_headers
+# Drawn on every run; startup.py imports it before the server listens
 from streamlit_mic_recorder import mic_recorder
 
 # Configure Streamlit for load balancer path
@@ -16,18 +21,31 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Prometheus /metrics endpoint (started once per process)
+start_metrics_server()
+
 # Initialize session state
 if 'processor' not in st.session_state:
-    st.session_state.processor = SpeechProcessor()
+    # One processor and connection pool shared by every session; boto3 loads with it
+    from speech_processor import get_shared_processor
+    st.session_state.processor = get_shared_processor()
 if 'transcription_job' not in st.session_state:
-    st.session_state.transcription_job = None
+    # Re-attach to a job started before the tab reconnected
+    st.session_state.transcription_job = st.experimental_get_query_params().get('job', [None])[0]
 if 'formatted_text' not in st.session_state:
     st.session_state.formatted_text = ""
+if 'user_id' not in st.session_state:
+    # Identity from the load balancer's signed claims; anonymous sessions share one record
+    st.session_state.user_id = user_id_from_headers(_get_websocket_headers())
 if 'email_settings' not in st.session_state:
-    st.session_state.email_settings = load_email_settings()
+    st.session_state.email_settings = load_email_settings(st.session_state.user_id)
 if 'recorder_key' not in st.session_state:
     st.session_state.recorder_key = 0
 
+# Recordings live in the session registry (spilled to disk when large), not in session state
+session_id = get_script_run_ctx().session_id
+session_resources = get_session_registry().touch(session_id, held_bytes=len(st.session_state.formatted_text))
+
 # Sidebar configuration
 with st.sidebar:
     st.header("Configuration")
@@ -45,7 +63,7 @@ with st.sidebar:
     
     if st.button("💾 Save Email Settings"):
         st.session_state.email_settings["custom_prompt"] = custom_prompt
-        save_email_settings(st.session_state.email_settings)
+        save_email_settings(st.session_state.email_settings, st.session_state.user_id)
         st.success("Email settings saved!")
     
     # Template upload section
@@ -59,27 +77,39 @@ with st.sidebar:
         with col_replace:
             replace_template = st.file_uploader("Replace template:", type=['txt', 'docx', 'pdf'], key="replace")
             if replace_template:
-                template_data = save_template_file(replace_template.read(), replace_template.name)
-                st.session_state.email_settings["template_file"] = template_data["content"]
-                st.session_state.email_settings["template_filename"] = template_data["filename"]
-                save_email_settings(st.session_state.email_settings)
+                template_data = save_template_file(replace_template.getvalue(), replace_template.name)
+                # The uploader keeps its file across reruns; only save a change once
+                if template_data["template_hash"] != st.session_state.email_settings.get("template_hash"):
+                    st.session_state.email_settings.update(template_data)
+                    save_email_settings(st.session_state.email_settings, st.session_state.user_id)
                 st.success("Template replaced!")
         
         with col_delete:
             if st.button("🗑️ Delete Template"):
-                st.session_state.email_settings["template_file"] = None
+                st.session_state.email_settings["template_hash"] = None
                 st.session_state.email_settings["template_filename"] = None
-                save_email_settings(st.session_state.email_settings)
+                save_email_settings(st.session_state.email_settings, st.session_state.user_id)
                 st.success("Template deleted!")
     else:
         # Upload new template
         uploaded_template = st.file_uploader("Upload email template:", type=['txt', 'docx', 'pdf'])
         if uploaded_template:
-            template_data = save_template_file(uploaded_template.read(), uploaded_template.name)
-            st.session_state.email_settings["template_file"] = template_data["content"]
-            st.session_state.email_settings["template_filename"] = template_data["filename"]
-            save_email_settings(st.session_state.email_settings)
+            template_data = save_template_file(uploaded_template.getvalue(), uploaded_template.name)
+            st.session_state.email_settings.update(template_data)
+            save_email_settings(st.session_state.email_settings, st.session_state.user_id)
             st.success("Template uploaded!")
+    
+    # Process-wide health information
+    with st.expander("Diagnostics"):
+        st.json({
+            "connection_pools": st.session_state.processor.pool_stats(),
+            "format_cache": st.session_state.processor.format_cache.stats(),
+            "bedrock_admission": st.session_state.processor.admission.stats(),
+            "model_routing": st.session_state.processor.router.stats(),
+            "jobs": get_job_manager().stats(),
+            "sessions": get_session_registry().stats(),
+            "stage_latency_seconds": metrics_registry.summary()
+        })
 
 # Main content
 st.title("🎤 Speech-to-Document Formatter")
@@ -88,6 +118,39 @@ st.markdown("Convert speech to professionally formatted documents using AI")
 # Create two-column layout
 left_col, right_col = st.columns([1, 1])
 
+with right_col:
+    st.subheader("Output")
+    # Filled while a streamed response is arriving
+    stream_placeholder = st.empty()
+
+def format_document(text, doc_type, **kwargs):
+    """Format text, streaming partial output into the Output column"""
+    script_ctx = get_script_run_ctx()
+    
+    def show_queue_position(position):
+        # Bedrock calls may wait on worker threads; let them draw on this session's page
+        add_script_run_ctx(threading.current_thread(), script_ctx)
+        if position:
+            stream_placeholder.info(f"Waiting for AI capacity: position {position} in the queue")
+        else:
+            stream_placeholder.empty()
+    
+    with span('ui_format_text', doc_type=doc_type, input_chars=len(text)):
+        if not BEDROCK_STREAMING:
+            return st.session_state.processor.format_with_bedrock(
+                text, doc_type, on_queue=show_queue_position, **kwargs
+            )
+        
+        formatted = ""
+        result = {}
+        for chunk in st.session_state.processor.format_with_bedrock_stream(
+            text, doc_type, on_queue=show_queue_position, result=result, **kwargs
+        ):
+            formatted += chunk
+            stream_placeholder.markdown(formatted + "▌")
+        stream_placeholder.empty()
+        return result['text']
+
 # LEFT COLUMN - All inputs and controls
 with left_col:
     # Document type selection
@@ -115,15 +178,26 @@ with left_col:
         stop_prompt="⏹️ Stop Recording",
         key=f'recorder_{st.session_state.recorder_key}'
     )
-    
     if audio:
-        st.audio(audio["bytes"])
+        # Take the recording out of the widget state; a fresh recorder drops Streamlit's copy
+        get_session_registry().store_audio(session_id, audio["bytes"])
+        st.session_state.recorder_key += 1
+        st.rerun()
+    
+    recording = session_resources.audio
+    if recording:
+        # The player resends the audio on every rerun, so spilled or large recordings are not played back
+        if recording.in_memory and recording.size <= AUDIO_PLAYER_MAX_MB * 1024 * 1024:
+            with recording.open() as f:
+                st.audio(f)
+        else:
+            st.caption(f"🎧 Recording saved ({recording.size / (1024 * 1024):.1f} MB), too large to play back here")
         
         # Show clear button after processing is complete
         if st.session_state.transcription_job is None and st.session_state.formatted_text:
             if st.button("🗑️ Clear Recording"):
                 st.session_state.formatted_text = ""
-                st.session_state.recorder_key += 1  # Reset recorder component
+                get_session_registry().clear_audio(session_id)
                 st.rerun()
         
         # Buttons side by side (only when no job running and no completed output)
@@ -133,11 +207,17 @@ with left_col:
             with col_transcribe:
                 if st.button("🔄 Transcribe & Format", type="primary"):
                     try:
-                        job_name = f"speech-job-{uuid.uuid4().hex[:8]}"
-                        st.session_state.transcription_job = st.session_state.processor.transcribe_audio(
-                            audio["bytes"], job_name
+                        kwargs = {
+                            'custom_prompt': st.session_state.email_settings["custom_prompt"],
+                            'template_hash': st.session_state.email_settings.get("template_hash")
+                        }
+                        job_id = get_job_manager().submit_audio(
+                            st.session_state.processor, recording.open(), doc_type, **kwargs
                         )
-                        # Success message will show after page refreshes and cancel button appears
+                        st.session_state.transcription_job = job_id
+                        # Keep the job ID in the URL so a reconnecting tab can re-attach
+                        st.experimental_set_query_params(job=job_id)
+                        st.rerun()
                     except Exception as e:
                         st.error(f"Error starting transcription: {str(e)}")
             
@@ -145,49 +225,60 @@ with left_col:
                 if st.button("🗑️ Clear Recording"):
                     st.session_state.transcription_job = None
                     st.session_state.formatted_text = ""
-                    st.session_state.recorder_key += 1  # Reset recorder component
+                    get_session_registry().clear_audio(session_id)
                     st.rerun()
 
-    # Status check for transcription
+    # Status check for transcription job
     if st.session_state.transcription_job:
+        job_manager = get_job_manager()
+        job = job_manager.get(st.session_state.transcription_job)
+        # This session now owns the job; it is cancelled if the session is abandoned
+        get_session_registry().attach_job(session_id, st.session_state.transcription_job)
+        
         # Cancel button at the top (only during active processing)
-        if st.button("❌ Cancel Processing"):
+        if job and not job.finished and st.button("❌ Cancel Processing"):
+            job_manager.cancel(job.id)
             st.session_state.transcription_job = None
+            st.experimental_set_query_params()
             st.success("Processing cancelled!")
             st.rerun()
         
-        # Show transcription started message
-        st.success("Transcription started!")
-        
-        # Auto-check status
-        with st.spinner("Checking transcription status..."):
-            try:
-                transcript = st.session_state.processor.get_transcription_result(
-                    st.session_state.transcription_job
-                )
-                
-                if transcript:
-                    st.success("Transcription complete!")
-                    
-                    with st.spinner("Formatting document..."):
-                        kwargs = {'custom_prompt': st.session_state.email_settings["custom_prompt"]}
-                        formatted = st.session_state.processor.format_with_bedrock(
-                            transcript, doc_type, **kwargs
-                        )
-                        st.session_state.formatted_text = formatted
-                    
-                    # Clear the job so cancel button disappears
-                    st.session_state.transcription_job = None
-                    st.success("Document formatted successfully!")
-                    st.rerun()  # Refresh to show clear button instead
-                else:
-                    import time
-                    time.sleep(2)
-                    st.rerun()
-                    
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
-                st.session_state.transcription_job = None
+        if job is None:
+            st.error("Processing job expired, please try again.")
+            st.session_state.transcription_job = None
+            st.experimental_set_query_params()
+        elif job.status == COMPLETED:
+            st.session_state.formatted_text = job.result
+            # Clear the job so cancel button disappears
+            st.session_state.transcription_job = None
+            st.experimental_set_query_params()
+            st.success("Document formatted successfully!")
+            st.rerun()  # Refresh to show clear button instead
+        elif job.status in (FAILED, CANCELLED):
+            if job.status == FAILED:
+                st.error(f"Error: {job.error}")
+            st.session_state.transcription_job = None
+            st.experimental_set_query_params()
+        else:
+            st.success("Transcription started!")
+            if job.audio_stats.get('seconds_removed'):
+                st.caption(f"Trimmed {job.audio_stats['seconds_removed']:.1f}s of silence "
+                           f"({job.audio_stats['bytes_removed'] // 1024} KB) before upload")
+            if 'upload_seconds' in job.audio_stats:
+                st.caption(f"Uploaded as {job.audio_stats['media_format'].upper()} "
+                           f"({job.audio_stats['compression_ratio']:.1f}x smaller) "
+                           f"in {job.audio_stats['upload_seconds']:.1f}s")
+            if job.status == FORMATTING:
+                st.success("Transcription complete!")
+                if job.queue_position:
+                    st.info(f"Waiting for AI capacity: position {job.queue_position} in the queue")
+                if job.partial_text:
+                    stream_placeholder.markdown(job.partial_text + "▌")
+            
+            # The pipeline runs in the job manager; only wait for state changes here
+            with st.spinner("Formatting document..." if job.status == FORMATTING else "Checking transcription status..."):
+                job.wait(timeout=0.5 if job.status == FORMATTING else 2)
+            st.rerun()
 
     # Text input section
     st.subheader("Text Input")
@@ -196,10 +287,11 @@ with left_col:
     if raw_text and st.button("✨ Format Text"):
         with st.spinner("Formatting with AI..."):
             try:
-                kwargs = {'custom_prompt': st.session_state.email_settings["custom_prompt"]}
-                formatted = st.session_state.processor.format_with_bedrock(
-                    raw_text, doc_type, **kwargs
-                )
+                kwargs = {
+                    'custom_prompt': st.session_state.email_settings["custom_prompt"],
+                    'template_hash': st.session_state.email_settings.get("template_hash")
+                }
+                formatted = format_document(raw_text, doc_type, **kwargs)
                 st.session_state.formatted_text = formatted
                 st.success("Text formatted successfully!")
             except Exception as e:
@@ -207,102 +299,49 @@ with left_col:
 
 # RIGHT COLUMN - Output only
 with right_col:
-    st.subheader("Output")
-    
     if st.session_state.formatted_text:
         # Display as markdown to render links
         st.markdown("**Formatted Document:**")
         st.markdown(st.session_state.formatted_text)
         
-        # Convert markdown to HTML for download
-        import re
-        html_content = st.session_state.formatted_text
-        # Convert markdown links [text](url) to HTML links
-        html_content = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', r'<a href="\2">\1</a>', html_content)
-        # Convert line breaks to HTML
-        html_content = html_content.replace('\n\n', '</p><p>').replace('\n', '<br>')
-        # Wrap in basic HTML structure
-        html_content = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <title>Email</title>
-</head>
-<body>
-    <p>{html_content}</p>
-</body>
-</html>"""
+        # Exports are built when first shown and memoised by text, so polling reruns skip them
+        formatted = st.session_state.formatted_text
+        file_stem = f"{doc_type.lower().replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         
         # Show different buttons based on document type
         if doc_type == "Email":
-            # Parse subject and body for mailto
-            import re
-            from urllib.parse import quote
+            mailto = render_export(formatted, 'mailto')
             
-            text = st.session_state.formatted_text
-            subject = ""
-            
-            # Extract subject - look for "Subject:" anywhere in first few lines
-            lines = text.split('\n')
-            for i, line in enumerate(lines[:3]):  # Check first 3 lines
-                if 'subject:' in line.lower():
-                    subject = line.split(':', 1)[1].strip()
-                    # Clean up subject - remove markdown formatting
-                    subject = subject.replace('**', '').replace('*', '')
-                    # Remove this line and join the rest as body
-                    body_lines = lines[:i] + lines[i+1:]
-                    body_text = '\n'.join(body_lines).strip()
-                    break
-            else:
-                # No subject found, use whole text as body
-                body_text = text
-            
-            # Convert markdown links to plain text with URLs
-            body_text = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', r'\1: \2', body_text)
-            
-            # Create mailto URL with subject and body
-            mailto_url = f"mailto:?subject={quote(subject)}&body={quote(body_text)}"
-            
-            # Check URL length and provide fallback for long emails
-            if len(mailto_url) > 2000:
+            if 'clipboard_text' in mailto:
                 # For long emails: use JavaScript to copy to clipboard
-                clipboard_text = re.sub(r'\n\n+', '\r\r', body_text)  # Convert line breaks to carriage returns
-                placeholder_mailto = f"mailto:?subject={quote(subject)}&body={quote('Email copied to clipboard, paste it here')}"
-                
-                # Use streamlit components for clipboard functionality
                 import streamlit.components.v1 as components
-                import json
-                copy_text_js = json.dumps(clipboard_text)
-                
-                button_js = f"""
-                <html>
-                <body>
-                <button onclick="openEmailAndCopy()" style="background-color:#ff4b4b;color:white;border:none;padding:0.5rem 1rem;border-radius:0.25rem;cursor:pointer;">
-                    📧 Open Outlook
-                </button>
-                
-                <script>
-                function openEmailAndCopy() {{
-                    window.open('{placeholder_mailto}', '_blank');
-                    navigator.clipboard.writeText({copy_text_js}).catch(() => {{
-                        alert('Email opened, but clipboard copy failed.');
-                    }});
-                }}
-                </script>
-                </body>
-                </html>
-                """
-                components.html(button_js, height=50)
+                components.html(clipboard_button_html(mailto), height=50)
             else:
-                st.markdown(f'<a href="{mailto_url}" target="_blank"><button style="background-color:#ff4b4b;color:white;border:none;padding:0.5rem 1rem;border-radius:0.25rem;cursor:pointer;">📧 Open in Outlook</button></a>', 
+                st.markdown(f'<a href="{mailto["mailto_url"]}" target="_blank"><button style="background-color:#ff4b4b;color:white;border:none;padding:0.5rem 1rem;border-radius:0.25rem;cursor:pointer;">📧 Open in Outlook</button></a>', 
                             unsafe_allow_html=True)
         else:
             # Download button for other document types
             st.download_button(
                 label="📄 Download Document",
-                data=html_content,
-                file_name=f"{doc_type.lower().replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html",
+                data=render_export(formatted, 'html'),
+                file_name=f"{file_stem}.html",
                 mime="text/html"
             )
+        
+        col_docx, col_text = st.columns(2)
+        with col_docx:
+            st.download_button(
+                label="📝 Download Word",
+                data=render_export(formatted, 'docx'),
+                file_name=f"{file_stem}.docx",
+                mime=DOCX_MIME
+            )
+        with col_text:
+            st.download_button(
+                label="🗒️ Download Text",
+                data=render_export(formatted, 'text'),
+                file_name=f"{file_stem}.txt",
+                mime="text/plain"
+            )
     else:
         st.info("Formatted document will appear here")
@@ -1,7 +1,55 @@
 import boto3
+import codecs
+import hashlib
+import io
 import json
+import re
+import threading
 import time
-from config import AWS_REGION, AWS_PROFILE, TRANSCRIBE_BUCKET, BEDROCK_MODEL_ID, DOCUMENT_PROMPTS
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from audio_encoder import audio_size, encode_audio
+from bedrock_admission import call_with_backoff, estimate_tokens, get_admission_controller, is_throttling
+from format_cache import FormatCache, make_cache_key
+import metrics
+from metrics import span
+from model_router import get_model_router
+from prompt_builder import PROMPT_GUARDRAILS, compile_prompt
+from prompt_manager import get_settings_store
+from config import (
+    AWS_REGION, AWS_PROFILE, TRANSCRIBE_BUCKET, CHUNK_PROMPT, TRANSCRIBE_JOB_PREFIX, TRANSCRIBE_MODE, TRANSCRIPT_PREFIX, AUDIO_TRIM_SILENCE, BEDROCK_MODEL_ID,
+    AWS_MAX_POOL_CONNECTIONS, AWS_CONNECT_TIMEOUT, AWS_READ_TIMEOUT, AWS_MAX_ATTEMPTS,
+    TRANSCRIPT_CACHE_SIZE, UPLOAD_MULTIPART_THRESHOLD_MB, UPLOAD_MULTIPART_CHUNK_MB, UPLOAD_MAX_CONCURRENCY,
+    FORMAT_CHUNK_CHARS, FORMAT_CHUNK_CONCURRENCY, FORMAT_NOTES_TOKENS, FORMAT_CHUNK_MIN_TOKENS
+)
+
+# Connection settings shared by all clients
+CLIENT_CONFIG = Config(
+    region_name=AWS_REGION,
+    max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    connect_timeout=AWS_CONNECT_TIMEOUT,
+    read_timeout=AWS_READ_TIMEOUT,
+    retries={'max_attempts': AWS_MAX_ATTEMPTS, 'mode': 'adaptive'}
+)
+
+# Throttling, 5xx and connection errors are retried by call_with_backoff, which backs off without holding a slot
+BEDROCK_CLIENT_CONFIG = CLIENT_CONFIG.merge(Config(retries={'total_max_attempts': 1, 'mode': 'standard'}))
+
+MB = 1024 * 1024
+WORDS_PER_TOKEN = 0.75  # rough English average, for word limits in prompts
+
+# Multipart settings for audio uploads
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=UPLOAD_MULTIPART_THRESHOLD_MB * MB,
+    multipart_chunksize=UPLOAD_MULTIPART_CHUNK_MB * MB,
+    max_concurrency=UPLOAD_MAX_CONCURRENCY,
+    use_threads=True
+)
 
 class SpeechProcessor:
     def __init__(self):
@@ -15,120 +63,692 @@ class SpeechProcessor:
         else:
             session = boto3.Session()
             
-        self.transcribe = session.client('transcribe', region_name=AWS_REGION)
-        self.bedrock = session.client('bedrock-runtime', region_name=AWS_REGION)
-        self.s3 = session.client('s3', region_name=AWS_REGION)
-    
-    def transcribe_audio(self, audio_file, job_name):
-        """Upload audio to S3 and start transcription job"""
-        # Upload to S3
-        s3_key = f"audio/{job_name}.wav"
-        
-        # Handle both file objects and bytes
-        if hasattr(audio_file, 'read'):
-            # File-like object
-            self.s3.upload_fileobj(audio_file, TRANSCRIBE_BUCKET, s3_key)
-        else:
-            # Raw bytes
-            import io
-            audio_buffer = io.BytesIO(audio_file)
-            self.s3.upload_fileobj(audio_buffer, TRANSCRIBE_BUCKET, s3_key)
+        self.transcribe = session.client('transcribe', config=CLIENT_CONFIG)
+        self.bedrock = session.client('bedrock-runtime', config=BEDROCK_CLIENT_CONFIG)
+        self.s3 = session.client('s3', config=CLIENT_CONFIG)
+        # Finished transcripts and running jobs (with subscriber counts) by job name
+        self.transcripts = OrderedDict()
+        self.inflight = {}
+        self.transcript_lock = threading.Lock()
+        # Formatted output shared by every session using this processor
+        self.format_cache = FormatCache(s3_client=self.s3)
+        # Bedrock quota is per account, so all processors queue in one place
+        self.admission = get_admission_controller()
+        self.router = get_model_router()
+    
+    def preprocess_audio(self, audio_bytes):
+        """Trim silence from WAV audio; returns (audio bytes, stats or None)
         
-        # Start transcription
-        job_uri = f"s3://{TRANSCRIBE_BUCKET}/{s3_key}"
+        A file object (e.g. a spilled recording) is never read into memory:
+        it is trimmed block by block into a temp file, or passed through.
+        """
+        if not AUDIO_TRIM_SILENCE:
+            return audio_bytes, None
+        # numpy is only loaded once audio needs trimming (startup.py prewarms it)
+        from audio_preprocessor import trim_silence, trim_silence_file
+        trim = trim_silence_file if hasattr(audio_bytes, 'read') else trim_silence
+        with span('audio_preprocess', input_bytes=audio_size(audio_bytes)) as sp:
+            try:
+                audio_bytes, stats = trim(audio_bytes)
+            except (wave.Error, ValueError, EOFError, IndexError):
+                # Not a WAV we can parse (or too short to analyse); upload it unchanged
+                if hasattr(audio_bytes, 'seek'):
+                    audio_bytes.seek(0)
+                stats = None
+            sp['output_bytes'] = audio_size(audio_bytes)
+        return audio_bytes, stats
+    
+    def transcribe_audio(self, audio_file, job_name=None, stats=None):
+        """Upload audio to S3 and start transcription job
         
-        self.transcribe.start_transcription_job(
-            TranscriptionJobName=job_name,
-            Media={'MediaFileUri': job_uri},
-            MediaFormat='wav',
-            LanguageCode='en-US'
-        )
+        Without an explicit job_name the job is named after a hash of the audio,
+        so identical recordings reuse a cached transcript or attach to the job
+        already running for them. Upload details are added to stats if given.
+        """
+        if job_name is None:
+            job_name = f"{TRANSCRIBE_JOB_PREFIX}-{audio_sha256(audio_file)[:48]}"
+        if not self._claim_job(job_name):
+            return job_name
+        
+        try:
+            if TRANSCRIBE_MODE == 'streaming':
+                audio_bytes = audio_file.read() if hasattr(audio_file, 'read') else audio_file
+                self._transcribe_streaming(audio_bytes, job_name)
+            else:
+                self._start_batch_job(audio_file, job_name, stats)
+        except Exception:
+            with self.transcript_lock:
+                self.inflight.pop(job_name, None)
+            raise
+        
+        return job_name
+    
+    def transcribe_uploaded(self, s3_key, media_format, audio_hash):
+        """Start transcribing audio already in TRANSCRIBE_BUCKET (e.g. a streamed recording)
         
+        Named by audio hash like transcribe_audio, so a repeat reuses earlier work.
+        """
+        job_name = f"{TRANSCRIBE_JOB_PREFIX}-{audio_hash[:48]}"
+        if not self._claim_job(job_name):
+            return job_name
+        try:
+            if not self._job_exists(job_name):
+                self._start_transcription(job_name, s3_key, media_format)
+        except Exception:
+            with self.transcript_lock:
+                self.inflight.pop(job_name, None)
+            raise
         return job_name
     
+    def _claim_job(self, job_name):
+        """Count a subscriber for a job; False if its transcript is cached or it is already running"""
+        with self.transcript_lock:
+            if job_name in self.transcripts:
+                return False
+            if job_name in self.inflight:
+                self.inflight[job_name] += 1
+                return False
+            self.inflight[job_name] = 1
+            return True
+    
+    def _job_exists(self, job_name):
+        """True if a batch job with this name exists and has not failed (a failed one is deleted)"""
+        try:
+            response = self.transcribe.get_transcription_job(TranscriptionJobName=job_name)
+            if response['TranscriptionJob']['TranscriptionJobStatus'] != 'FAILED':
+                return True
+            self.transcribe.delete_transcription_job(TranscriptionJobName=job_name)
+        except self.transcribe.exceptions.BadRequestException:
+            # No job with this name yet
+            pass
+        return False
+    
+    def _start_batch_job(self, audio, job_name, stats=None):
+        """Upload audio (bytes or a file object) to S3 and start a batch job unless one already exists"""
+        if self._job_exists(job_name):
+            # Same audio was submitted before; poll that job instead
+            return
+        
+        # Compress before upload; Transcribe reads FLAC and Ogg/Opus directly
+        with span('audio_encode', input_bytes=audio_size(audio)) as sp:
+            upload, media_format, encode_stats = encode_audio(audio)
+            sp['output_bytes'] = encode_stats['encoded_bytes']
+        
+        # Upload to S3, in parallel parts for large files
+        s3_key = f"audio/{job_name}.{media_format}"
+        started = time.time()
+        with span('s3_upload', upload_bytes=encode_stats['encoded_bytes']):
+            # File objects (e.g. spilled recordings) are streamed from where they are
+            body = upload if hasattr(upload, 'read') else io.BytesIO(upload)
+            try:
+                self.s3.upload_fileobj(body, TRANSCRIBE_BUCKET, s3_key, Config=TRANSFER_CONFIG)
+            finally:
+                if upload is not audio and hasattr(upload, 'close'):
+                    # Encoded temp file of a spilled recording
+                    upload.close()
+        
+        if stats is not None:
+            stats.update(encode_stats)
+            stats['upload_seconds'] = time.time() - started
+        
+        self._start_transcription(job_name, s3_key, media_format)
+    
+    def _start_transcription(self, job_name, s3_key, media_format):
+        job_uri = f"s3://{TRANSCRIBE_BUCKET}/{s3_key}"
+        try:
+            with span('transcribe_start'):
+                self.transcribe.start_transcription_job(
+                    TranscriptionJobName=job_name,
+                    Media={'MediaFileUri': job_uri},
+                    MediaFormat=media_format,
+                    LanguageCode='en-US',
+                    OutputBucketName=TRANSCRIBE_BUCKET,
+                    OutputKey=transcript_key(job_name)
+                )
+        except self.transcribe.exceptions.ConflictException:
+            # Another task started the same job first
+            pass
+    
+    def _transcribe_streaming(self, audio_bytes, job_name):
+        """Transcribe audio over a streaming connection without S3"""
+        from streaming_transcriber import transcribe_stream
+        
+        with span('transcribe_streaming', input_bytes=len(audio_bytes)) as sp:
+            transcript = transcribe_stream(audio_bytes)
+            sp['transcript_chars'] = len(transcript)
+        if not transcript:
+            raise Exception("No speech detected in recording")
+        self._store_transcript(job_name, transcript)
+    
+    def _store_transcript(self, job_name, transcript):
+        with self.transcript_lock:
+            self.transcripts[job_name] = transcript
+            self.transcripts.move_to_end(job_name)
+            while len(self.transcripts) > TRANSCRIPT_CACHE_SIZE:
+                self.transcripts.popitem(last=False)
+            self.inflight.pop(job_name, None)
+    
     def get_transcription_result(self, job_name):
         """Get transcription result when job is complete"""
-        response = self.transcribe.get_transcription_job(
-            TranscriptionJobName=job_name
-        )
+        with self.transcript_lock:
+            transcript = self.transcripts.get(job_name)
+            if transcript is not None:
+                return transcript
+            if TRANSCRIBE_MODE == 'streaming' and job_name in self.inflight:
+                return None  # Another session is still streaming this audio
+        
+        with span('transcribe_poll'):
+            response = self.transcribe.get_transcription_job(
+                TranscriptionJobName=job_name
+            )
         
         status = response['TranscriptionJob']['TranscriptionJobStatus']
         
         if status == 'COMPLETED':
+            record_transcribe_timings(response['TranscriptionJob'])
             transcript_uri = response['TranscriptionJob']['Transcript']['TranscriptFileUri']
-            # Download and parse transcript
-            import requests
-            transcript_response = requests.get(transcript_uri)
-            transcript_data = transcript_response.json()
-            return transcript_data['results']['transcripts'][0]['transcript']
+            with span('transcript_download') as sp:
+                if f"/{TRANSCRIBE_BUCKET}/{TRANSCRIPT_PREFIX}" in transcript_uri:
+                    # Written to our bucket; read through the pooled S3 client
+                    transcript_object = self.s3.get_object(
+                        Bucket=TRANSCRIBE_BUCKET, Key=transcript_key(job_name)
+                    )
+                    transcript = extract_transcript_stream(transcript_object['Body'], sp)
+                else:
+                    # Jobs started before output went to our bucket use a pre-signed URI
+                    import requests
+                    transcript_response = requests.get(transcript_uri)
+                    transcript = parse_transcript(transcript_response.content)
+                    sp['download_bytes'] = len(transcript_response.content)
+                sp['transcript_chars'] = len(transcript)
+            self._store_transcript(job_name, transcript)
+            return transcript
         elif status == 'FAILED':
+            with self.transcript_lock:
+                self.inflight.pop(job_name, None)
             raise Exception("Transcription failed")
         else:
             return None  # Still in progress
     
-    def format_with_bedrock(self, text, doc_type, **kwargs):
-        """Use Bedrock to format text according to document type"""
+    def pool_stats(self):
+        """Report HTTP connection pool usage for each AWS client"""
+        stats = {}
+        for name, client in (('transcribe', self.transcribe), ('bedrock', self.bedrock), ('s3', self.s3)):
+            client_stats = {
+                'max_pool_connections': client.meta.config.max_pool_connections,
+                'pools': 0,
+                'connections_opened': 0,
+                'requests': 0,
+                'idle_connections': 0
+            }
+            try:
+                # botocore keeps one urllib3 pool per endpoint host
+                pools = client._endpoint.http_session._manager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    client_stats['pools'] += 1
+                    client_stats['connections_opened'] += pool.num_connections
+                    client_stats['requests'] += pool.num_requests
+                    client_stats['idle_connections'] += pool.pool.qsize() if pool.pool else 0
+            except AttributeError:
+                # Internals changed in this botocore version; report config only
+                pass
+            stats[name] = client_stats
+        return stats
+    
+    def cancel_transcription(self, job_name):
+        """Stop tracking a transcription job and delete it from Transcribe"""
+        with self.transcript_lock:
+            if job_name in self.transcripts:
+                return  # Finished transcripts stay reusable
+            subscribers = self.inflight.get(job_name, 0)
+            if subscribers > 1:
+                # Other sessions are still waiting on this job
+                self.inflight[job_name] = subscribers - 1
+                return
+            self.inflight.pop(job_name, None)
         
-        # Use custom prompt for emails if provided
-        if doc_type == "Email" and 'custom_prompt' in kwargs:
-            user_prompt = kwargs['custom_prompt']
-            # Auto-append {text} placeholder if not present
-            if '{text}' not in user_prompt:
-                user_prompt += "\n\nText to format: {text}"
-            
-            # Add instruction for direct output
-            user_prompt += "\n\nProvide only the formatted email, no explanations or meta-text."
-            prompt = user_prompt.format(text=text)
-        else:
-            prompt = DOCUMENT_PROMPTS[doc_type].format(text=text)
+        if TRANSCRIBE_MODE == 'streaming':
+            return
+        try:
+            self.transcribe.delete_transcription_job(TranscriptionJobName=job_name)
+        except Exception:
+            # Job may already be gone; nothing else to clean up
+            pass
+    
+    def _compile_prompt(self, doc_type, **kwargs):
+        return compile_prompt(doc_type, kwargs.get('custom_prompt'), kwargs.get('tone'))
+    
+    def _cache_key(self, text, doc_type, **kwargs):
+        prompt = self._compile_prompt(doc_type, **kwargs)
+        _, model_id = self.router.select(text, doc_type)
+        return make_cache_key(text, doc_type, prompt.system_text, PROMPT_GUARDRAILS, model_id,
+                              self._template_hash(doc_type, **kwargs))
+    
+    def _template_hash(self, doc_type, **kwargs):
+        # Templates only apply to emails
+        return kwargs.get('template_hash') if doc_type == "Email" else None
+    
+    def _template_examples(self, text, doc_type, **kwargs):
+        """Excerpts of the user's email template most relevant to the text, as a prompt block"""
+        template_hash = self._template_hash(doc_type, **kwargs)
+        if not template_hash:
+            return None
+        from template_index import examples_block, get_template_index
+        with span('template_retrieval') as sp:
+            store = get_settings_store()
+            index = get_template_index(template_hash, lambda: store.get_template(template_hash))
+            snippets = index.query(text)
+            sp['snippets'] = len(snippets)
+            sp['chars'] = sum(len(snippet) for snippet in snippets)
+        return examples_block(snippets) if snippets else None
+    
+    def _can_hedge(self):
+        # A backup request only helps while Bedrock has spare capacity
+        return not self.admission.waiting
+    
+    def _converse(self, messages, system=None, max_tokens=2000, on_queue=None, model_id=BEDROCK_MODEL_ID):
+        """Run a single non-streaming Converse call and return the response text"""
+        request = {
+            'modelId': model_id,
+            'messages': messages,
+            'inferenceConfig': {'maxTokens': max_tokens}
+        }
+        if system:
+            request['system'] = system
+        tokens = estimate_tokens(messages, system, max_tokens)
         
-        # Add hardcoded slang prevention to ALL prompts
-        prompt += "\n\nIMPORTANT: Never use slang or informal contractions like 'wanna', 'gonna', 'coulda', 'shoulda', 'would've', etc. Use proper English words instead."
-        prompt += "\n\nDo not duplicate greetings - use only one greeting at the start."
-        prompt += "\n\nOnly include booking links when the input text specifically mentions booking a call, meeting, or appointment."
+        def attempt():
+            with self.admission.admit(tokens, on_queue) as slot:
+                with span('bedrock_inference', model=model_id) as sp:
+                    response = self.bedrock.converse(**request)
+                    slot.usage = response.get('usage', {})
+                    text = response['output']['message']['content'][0]['text']
+                    sp['output_chars'] = len(text)
+                    sp.update(usage_attrs(slot.usage))
+            return text
         
-        body = json.dumps({
-            
-            
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [{"text": prompt}]
-                }
-            ],
-            "inferenceConfig": {
-                "max_new_tokens": 2000
-            }
-        })
+        return self.router.call((model_id, max_tokens), lambda: call_with_backoff(attempt), self._can_hedge)
+    
+    def _stream_events(self, request, on_queue=None, opened=None):
+        """Yield ConverseStream events, holding an admission slot until the stream ends
         
-        response = self.bedrock.invoke_model(
-            body=body,
-            modelId=BEDROCK_MODEL_ID,
-            accept='application/json',
-            contentType='application/json'
-        )
+        opened(response) is called once the stream exists, so it can be closed early.
+        """
+        tokens = estimate_tokens(request['messages'], request.get('system'), request['inferenceConfig']['maxTokens'])
         
-        response_body = json.loads(response.get('body').read())
-        response_text = response_body['output']['message']['content'][0]['text']
-        
-        # Clean up response - remove AI meta-text
-        lines_to_remove = [
-            "AI-Formatted Document:",
-            "Here's the reformatted text",
-            "Here is the reformatted text", 
-            "Reformatted email:",
-            "Formatted email:",
-            "Here's the email:",
-            "Here is the email:"
+        def attempt():
+            slot = self.admission.acquire(tokens, on_queue)
+            try:
+                return slot, self.bedrock.converse_stream(**request)
+            except ClientError as e:
+                slot.release(throttled=is_throttling(e))
+                raise
+            except Exception:
+                slot.release()
+                raise
+        
+        slot, response = call_with_backoff(attempt)
+        if opened:
+            opened(response)
+        try:
+            for event in response['stream']:
+                if 'metadata' in event:
+                    slot.usage.update(event['metadata'].get('usage', {}))
+                yield event
+        except ClientError as e:
+            # Throttled mid-stream: partial output is already shown, so fail rather than retry
+            slot.release(throttled=is_throttling(e))
+            raise
+        finally:
+            slot.release()
+    
+    def condense_long_text(self, text, doc_type, on_queue=None, model_id=BEDROCK_MODEL_ID):
+        """Condense long transcripts to notes chunk by chunk in parallel (map step)
+        
+        Text under FORMAT_CHUNK_CHARS is returned unchanged. Each chunk's notes
+        are capped at its share of FORMAT_NOTES_TOKENS, so the parallel calls
+        stay short and the normal formatting call (the reduce step) gets an
+        input it can turn into a complete document without hitting maxTokens.
+        """
+        if len(text) <= FORMAT_CHUNK_CHARS:
+            return text
+        
+        chunks = split_transcript(text, FORMAT_CHUNK_CHARS)
+        max_tokens = max(FORMAT_CHUNK_MIN_TOKENS, FORMAT_NOTES_TOKENS // len(chunks))
+        prompts = [
+            CHUNK_PROMPT.format(part=i + 1, total=len(chunks), doc_type=doc_type,
+                                words=int(max_tokens * WORDS_PER_TOKEN), text=chunk)
+            for i, chunk in enumerate(chunks)
         ]
+        with span('format_map', chunks=len(chunks), input_chars=len(text)) as sp:
+            with ThreadPoolExecutor(max_workers=FORMAT_CHUNK_CONCURRENCY) as executor:
+                parts = list(executor.map(
+                    lambda prompt: self._converse([{"role": "user", "content": [{"text": prompt}]}],
+                                                  max_tokens=max_tokens, on_queue=on_queue, model_id=model_id),
+                    prompts
+                ))
+            notes = '\n\n'.join(clean_response(part) for part in parts)
+            sp['output_chars'] = len(notes)
+        return notes
+    
+    def format_with_bedrock(self, text, doc_type, on_queue=None, **kwargs):
+        """Use Bedrock to format text according to document type
+        
+        on_queue(position) reports the place in the Bedrock admission queue
+        while waiting for capacity (0 once admitted).
+        """
+        cache_key = self._cache_key(text, doc_type, **kwargs)
+        cached = self.format_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        started = time.time()
+        prompt = self._compile_prompt(doc_type, **kwargs)
+        model_id = self.router.route(text, doc_type)
+        examples = self._template_examples(text, doc_type, **kwargs)
+        text = self.condense_long_text(text, doc_type, on_queue, model_id)
+        
+        response_text = self._converse(prompt.messages(text, examples), prompt.system, on_queue=on_queue, model_id=model_id)
+        with span('postprocess', input_chars=len(response_text)):
+            formatted = clean_response(response_text)
+        self.format_cache.put(cache_key, formatted, time.time() - started)
+        return formatted
+    
+    def format_with_bedrock_stream(self, text, doc_type, on_queue=None, result=None, **kwargs):
+        """Stream formatted text from Bedrock as cleaned chunks
+        
+        The final text, identical to what format_with_bedrock returns, is put
+        in result['text'] if result is given. It can differ from the joined
+        chunks when meta-text arrives late in a line (see StreamCleaner).
+        """
+        cache_key = self._cache_key(text, doc_type, **kwargs)
+        cached = self.format_cache.get(cache_key)
+        if cached is not None:
+            if result is not None:
+                result['text'] = cached
+            yield cached
+            return
         
-        lines = response_text.split('\n')
-        cleaned_lines = []
+        started = time.time()
+        prompt = self._compile_prompt(doc_type, **kwargs)
+        model_id = self.router.route(text, doc_type)
+        examples = self._template_examples(text, doc_type, **kwargs)
+        text = self.condense_long_text(text, doc_type, on_queue, model_id)
+        
+        request = {
+            'modelId': model_id,
+            'system': prompt.system,
+            'messages': prompt.messages(text, examples),
+            'inferenceConfig': {'maxTokens': 2000}
+        }
+        events = self.router.stream(
+            (model_id, 'first_event'),
+            lambda opened: self._stream_events(request, on_queue, opened),
+            self._can_hedge
+        )
         
-        for line in lines:
-            line = line.strip()
-            # Skip empty lines and meta-text
-            if line and not any(meta in line for meta in lines_to_remove):
-                cleaned_lines.append(line)
+        cleaner = StreamCleaner()
+        first_text = True
+        usage = {}
+        try:
+            for delta in iter_stream_text(events, usage):
+                chunk = cleaner.feed(delta)
+                if chunk:
+                    if first_text:
+                        metrics.record('bedrock_first_text', time.time() - started, model=model_id)
+                        first_text = False
+                    yield chunk
+        finally:
+            # Stops the Bedrock stream if the caller gives up early
+            events.close()
         
-        return '\n\n'.join(cleaned_lines)
+        chunk = cleaner.close()
+        if chunk:
+            yield chunk
+        
+        formatted = cleaner.text
+        if result is not None:
+            result['text'] = formatted
+        metrics.record('bedrock_stream', time.time() - started, model=model_id,
+                       output_chars=len(formatted), **usage_attrs(usage))
+        
+        # Only complete responses are cached, cleaned the same way as format_with_bedrock
+        self.format_cache.put(cache_key, formatted, time.time() - started)
+
+def audio_sha256(audio, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of audio bytes, or of a file object read in chunks (then rewound)"""
+    if not hasattr(audio, 'read'):
+        return hashlib.sha256(audio).hexdigest()
+    digest = hashlib.sha256()
+    audio.seek(0)
+    for chunk in iter(lambda: audio.read(chunk_size), b''):
+        digest.update(chunk)
+    audio.seek(0)
+    return digest.hexdigest()
+
+
+def parse_transcript(transcript_json):
+    """Extract the transcript text from a Transcribe output JSON document"""
+    transcript_data = json.loads(transcript_json)
+    return transcript_data['results']['transcripts'][0]['transcript']
+
+
+def transcript_key(job_name):
+    """S3 key that a job's transcript JSON is written to"""
+    return f"{TRANSCRIPT_PREFIX}{job_name}.json"
+
+
+# Start of the transcript string in Transcribe output JSON
+TRANSCRIPT_FIELD = re.compile(r'"transcripts"\s*:\s*\[\s*\{\s*"transcript"\s*:\s*"')
+
+
+def extract_transcript_stream(body, stats=None, chunk_size=64 * 1024):
+    """Read only as much of a transcript JSON stream as needed for the text
+    
+    Transcribe writes results.transcripts before the much larger word-level
+    items, so reading stops as soon as the transcript string is complete.
+    Falls back to a full parse if the field is not found that way.
+    """
+    buffer = ""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    bytes_read = 0
+    match = None
+    try:
+        while True:
+            chunk = body.read(chunk_size)
+            bytes_read += len(chunk)
+            buffer += decoder.decode(chunk, final=not chunk)
+            if match is None:
+                match = TRANSCRIPT_FIELD.search(buffer)
+            if match is not None:
+                try:
+                    transcript, _ = json.decoder.scanstring(buffer, match.end())
+                    return transcript
+                except json.JSONDecodeError:
+                    if not chunk:
+                        raise
+                    # String continues in the next chunk
+            if not chunk:
+                return parse_transcript(buffer)
+    finally:
+        if stats is not None:
+            stats['download_bytes'] = bytes_read
+        body.close()
+
+
+def usage_attrs(usage):
+    """Map Bedrock token usage to metric attribute names"""
+    names = {
+        'inputTokens': 'input_tokens',
+        'outputTokens': 'output_tokens',
+        'cacheReadInputTokens': 'cache_read_tokens',
+        'cacheWriteInputTokens': 'cache_write_tokens'
+    }
+    return {names[k]: v for k, v in usage.items() if k in names}
+
+
+def record_transcribe_timings(job):
+    """Record queueing and processing time reported by a finished Transcribe job"""
+    created, started, completed = job.get('CreationTime'), job.get('StartTime'), job.get('CompletionTime')
+    if created and started:
+        metrics.record('transcribe_queue', (started - created).total_seconds())
+    if started and completed:
+        metrics.record('transcription', (completed - started).total_seconds())
+
+
+_shared_processor = None
+_shared_processor_lock = threading.Lock()
+
+
+def get_shared_processor():
+    """Return the process-wide SpeechProcessor shared by all sessions"""
+    global _shared_processor
+    with _shared_processor_lock:
+        if _shared_processor is None:
+            _shared_processor = SpeechProcessor()
+        return _shared_processor
+
+
+# Paragraph/speaker breaks and sentence ends
+SEGMENT_BOUNDARY = re.compile(r'\n+|(?<=[.!?])\s+')
+
+
+def split_transcript(text, max_chars):
+    """Split text into chunks of at most max_chars on sentence or line boundaries"""
+    chunks = []
+    current = ""
+    for segment in SEGMENT_BOUNDARY.split(text):
+        segment = segment.strip()
+        if not segment:
+            continue
+        # A single run-on segment longer than a chunk is split on words
+        while len(segment) > max_chars:
+            cut = segment.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(segment[:cut])
+            segment = segment[cut:].strip()
+        if current and len(current) + 1 + len(segment) > max_chars:
+            chunks.append(current)
+            current = segment
+        else:
+            current = f"{current} {segment}" if current else segment
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# AI meta-text lines stripped from model responses
+META_TEXT_LINES = [
+    "AI-Formatted Document:",
+    "Here's the reformatted text",
+    "Here is the reformatted text", 
+    "Reformatted email:",
+    "Formatted email:",
+    "Here's the email:",
+    "Here is the email:"
+]
+
+META_TEXT_MAX_LEN = max(len(meta) for meta in META_TEXT_LINES)
+
+
+def is_meta_line(line):
+    """True if a stripped line is empty or AI meta-text"""
+    return not line or any(meta in line for meta in META_TEXT_LINES)
+
+
+def clean_response(response_text):
+    """Remove AI meta-text and blank lines from a model response"""
+    cleaned_lines = []
+    
+    for line in response_text.split('\n'):
+        line = line.strip()
+        # Skip empty lines and meta-text
+        if not is_meta_line(line):
+            cleaned_lines.append(line)
+    
+    return '\n\n'.join(cleaned_lines)
+
+
+def iter_stream_text(event_stream, usage=None):
+    """Yield text deltas from a Bedrock ConverseStream event stream
+    
+    Token usage from the closing metadata event is copied into usage if given.
+    """
+    for event in event_stream:
+        if usage is not None and 'metadata' in event:
+            usage.update(event['metadata'].get('usage', {}))
+        delta = event.get('contentBlockDelta', {}).get('delta', {})
+        if delta.get('text'):
+            yield delta['text']
+
+
+class StreamCleaner:
+    """Incremental version of clean_response for streamed text
+    
+    Complete lines are filtered like clean_response. A partial line is
+    released early once it is longer than any meta-text marker and does not
+    contain one, so the first words reach the screen before the newline;
+    trailing whitespace is held back until more text follows. A marker that
+    only appears later in an early-released line cannot be taken back, so
+    `text` is clean_response over the whole stream and is what gets cached.
+    """
+    
+    def __init__(self):
+        self.pending = ""
+        self.line_started = False  # current line already partly emitted
+        self.emitted = False
+        self.deltas = []
+    
+    @property
+    def text(self):
+        """The whole response cleaned exactly like clean_response"""
+        return clean_response(''.join(self.deltas))
+    
+    def _separator(self):
+        return "\n\n" if self.emitted else ""
+    
+    def _finish_line(self, line):
+        if self.line_started:
+            self.line_started = False
+            return line.rstrip()
+        line = line.strip()
+        if is_meta_line(line):
+            return ""
+        output = self._separator() + line
+        self.emitted = True
+        return output
+    
+    def feed(self, delta):
+        """Add a text delta and return whatever is safe to display"""
+        self.deltas.append(delta)
+        self.pending += delta
+        output = ""
+        
+        while '\n' in self.pending:
+            line, self.pending = self.pending.split('\n', 1)
+            output += self._finish_line(line)
+        
+        if self.line_started:
+            released = self.pending.rstrip()
+            output += released
+            self.pending = self.pending[len(released):]
+        else:
+            partial = self.pending.lstrip()
+            if len(partial) > META_TEXT_MAX_LEN and not is_meta_line(partial):
+                released = partial.rstrip()
+                output += self._separator() + released
+                self.emitted = True
+                self.line_started = True
+                self.pending = partial[len(released):]
+        
+        return output
+    
+    def close(self):
+        """Flush the final line at end of stream"""
+        output = self._finish_line(self.pending)
+        self.pending = ""
+        return output
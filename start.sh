@@ -0,0 +1,4 @@
+#!/bin/sh
+# Streamlit UI with the HTTP API on a thread of the same process, so both share one Bedrock quota.
+# startup.py warms modules and AWS clients before Streamlit listens, so the health check waits for it.
+exec python startup.py run speech_formatter.py --server.port=8501 --server.address=0.0.0.0 --server.baseUrlPath=/speech-formatter
@@ -0,0 +1,141 @@
+"""Container start: warm imports and AWS clients, then launch the UI
+
+Examples:
+    python startup.py run speech_formatter.py --server.port=8501    # prewarm, then `streamlit run`
+    python startup.py --check                                       # profile a cold start against the budget
+    python startup.py --report                                      # profile it without failing (docker build)
+
+Streamlit runs the script in this process, so the modules, the shared
+processor (clients, credentials, endpoints) and compiled prompts built here
+are reused by the first session. The HTTP API is served from a thread of the
+same process, sharing that processor and its Bedrock quota with the UI. The server only starts listening, and so
+the health check only passes, once the prewarm has finished.
+"""
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from config import STARTUP_PREWARM, STARTUP_BUDGET_SECONDS
+
+# Imported by the UI on its first run, heaviest first
+APP_MODULES = [
+    'streamlit',
+    'speech_processor',
+    'numpy',
+    'audio_preprocessor',
+    'template_index',
+    'job_manager',
+    'prompt_manager',
+    'document_export',
+    'streamlit_mic_recorder',
+]
+
+_profile = None
+_prewarm_lock = threading.Lock()
+
+
+def _step(steps, name, func):
+    started = time.perf_counter()
+    func()
+    steps[name] = round(time.perf_counter() - started, 4)
+
+
+def _warm_processor():
+    from speech_processor import get_shared_processor
+    # Builds the clients: loads service models, resolves credentials and endpoints
+    processor = get_shared_processor()
+    for client in (processor.transcribe, processor.bedrock, processor.s3):
+        client.meta.endpoint_url
+
+
+def _warm_prompts():
+    from prompt_builder import compile_prompt
+    from config import DOCUMENT_PROMPTS
+    for doc_type in DOCUMENT_PROMPTS:
+        compile_prompt(doc_type)
+
+
+def _warm_singletons():
+    from job_manager import get_job_manager
+    from prompt_manager import get_settings_store
+    get_job_manager()
+    get_settings_store()
+
+
+def prewarm(modules=APP_MODULES):
+    """Import the app's modules and build its shared objects once; returns step timings"""
+    global _profile
+    with _prewarm_lock:
+        if _profile is not None:
+            return _profile
+        steps = {}
+        started = time.perf_counter()
+        for module in modules:
+            _step(steps, f"import {module}", lambda: importlib.import_module(module))
+        _step(steps, 'aws_clients', _warm_processor)
+        _step(steps, 'prompts', _warm_prompts)
+        _step(steps, 'singletons', _warm_singletons)
+        steps['total'] = round(time.perf_counter() - started, 4)
+
+        import metrics
+        metrics.record('startup_prewarm', steps['total'])
+        _profile = steps
+        return steps
+
+
+def measure_cold_start(modules=APP_MODULES):
+    """Prewarm in a fresh interpreter and return its step timings"""
+    code = f"import json, startup; print(json.dumps(startup.prewarm({modules!r})))"
+    # No instance metadata lookups in build environments without AWS credentials
+    env = {**os.environ, 'AWS_EC2_METADATA_DISABLED': 'true', 'METRICS_EMF_ENABLED': 'false'}
+    output = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def check(budget=STARTUP_BUDGET_SECONDS, modules=APP_MODULES, enforce=True):
+    """Print a cold start profile; returns 1 if it is over budget and enforce is set"""
+    steps = measure_cold_start(modules)
+    for name, seconds in sorted(steps.items(), key=lambda item: -item[1]):
+        print(f"{seconds * 1000:9.1f} ms  {name}")
+    if steps['total'] > budget:
+        print(f"Startup took {steps['total']:.2f}s, over the {budget:.2f}s budget")
+        return 1 if enforce else 0
+    print(f"Startup within the {budget:.2f}s budget")
+    return 0
+
+
+def run_streamlit(args):
+    """Prewarm, start the API, then hand over to the streamlit CLI in this process"""
+    if STARTUP_PREWARM:
+        steps = prewarm()
+        print(f"Prewarmed in {steps['total']:.2f}s")
+    from api_server import start_api_server
+    start_api_server()
+    from streamlit.web import cli
+    sys.argv = ['streamlit', 'run'] + args
+    return cli.main()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prewarm and launch the app, or check its startup time")
+    parser.add_argument('--check', action='store_true', help="Profile a cold start and fail if over budget")
+    parser.add_argument('--report', action='store_true', help="Profile a cold start without failing")
+    parser.add_argument('--budget', type=float, default=STARTUP_BUDGET_SECONDS)
+    args, rest = parser.parse_known_args()
+
+    if args.check or args.report:
+        return check(args.budget, enforce=args.check)
+    if rest[:1] == ['run']:
+        return run_streamlit(rest[1:])
+    parser.error("expected `run <script> [streamlit options]`, --check or --report")
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,95 @@
+import asyncio
+import numpy as np
+from audio_preprocessor import read_wav
+from config import AWS_REGION, TRANSCRIBE_STREAMING_ENDPOINT, STREAMING_FRAME_MS, STREAMING_SAMPLE_RATE
+
+
+def to_mono_float(samples, sampwidth):
+    """Average channels of a frames x channels array into floats in [-1, 1)"""
+    mono = samples.astype(np.float64).mean(axis=1)
+    if sampwidth == 1:
+        mono -= 128  # 8-bit WAV is unsigned
+    return mono / float(2 ** (8 * sampwidth - 1))
+
+
+def resample(mono, sample_rate, target_rate):
+    """Downsample by linear interpolation after a moving-average low-pass filter"""
+    ratio = sample_rate / target_rate
+    width = int(np.ceil(ratio))
+    if width > 1:
+        # Averages away content above the new Nyquist rate so it does not alias
+        mono = np.convolve(mono, np.ones(width) / width, mode='same')
+    n_out = int(len(mono) / ratio)
+    positions = np.arange(n_out) * ratio
+    return np.interp(positions, np.arange(len(mono)), mono)
+
+
+def read_wav_pcm(audio_bytes, max_sample_rate=STREAMING_SAMPLE_RATE):
+    """Return (pcm bytes, sample rate) as 16-bit mono from WAV bytes
+
+    Audio above max_sample_rate is resampled down to it.
+    """
+    samples, params = read_wav(audio_bytes)
+    mono = to_mono_float(samples, params.sampwidth)
+    sample_rate = params.framerate
+    if sample_rate > max_sample_rate:
+        mono = resample(mono, sample_rate, max_sample_rate)
+        sample_rate = max_sample_rate
+
+    # Transcribe streaming only accepts 16-bit little-endian mono PCM
+    pcm = np.clip(np.round(mono * 32768), -32768, 32767).astype('<i2')
+    return pcm.tobytes(), sample_rate
+
+
+def iter_frames(pcm, sample_rate, frame_ms=STREAMING_FRAME_MS):
+    """Split 16-bit mono PCM into fixed-duration frames"""
+    frame_size = sample_rate * 2 * frame_ms // 1000
+    for i in range(0, len(pcm), frame_size):
+        yield pcm[i:i + frame_size]
+
+
+def _create_client():
+    # Imported here so the batch path does not need the streaming SDK
+    from amazon_transcribe.client import TranscribeStreamingClient
+
+    if TRANSCRIBE_STREAMING_ENDPOINT:
+        # Point at a local stand-in server instead of AWS
+        from amazon_transcribe.endpoints import StaticEndpointResolver
+        return TranscribeStreamingClient(
+            region=AWS_REGION,
+            endpoint_resolver=StaticEndpointResolver(TRANSCRIBE_STREAMING_ENDPOINT)
+        )
+    return TranscribeStreamingClient(region=AWS_REGION)
+
+
+async def _stream_transcription(client, pcm, sample_rate, language_code):
+    stream = await client.start_stream_transcription(
+        language_code=language_code,
+        media_sample_rate_hz=sample_rate,
+        media_encoding='pcm'
+    )
+
+    async def send_audio():
+        for frame in iter_frames(pcm, sample_rate):
+            await stream.input_stream.send_audio_event(audio_chunk=frame)
+        await stream.input_stream.end_stream()
+
+    segments = []
+
+    async def collect_results():
+        async for event in stream.output_stream:
+            for result in event.transcript.results:
+                # Partial results are superseded by a final one
+                if not result.is_partial and result.alternatives:
+                    segments.append(result.alternatives[0].transcript)
+
+    await asyncio.gather(send_audio(), collect_results())
+    return ' '.join(segments)
+
+
+def transcribe_stream(audio_bytes, language_code='en-US', client=None):
+    """Send WAV audio to Transcribe streaming and return the final transcript"""
+    pcm, sample_rate = read_wav_pcm(audio_bytes)
+    if client is None:
+        client = _create_client()
+    return asyncio.run(_stream_transcription(client, pcm, sample_rate, language_code))
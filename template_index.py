@@ -0,0 +1,163 @@
+import io
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from xml.etree import ElementTree
+import numpy as np
+from config import TEMPLATE_SNIPPET_CHARS, TEMPLATE_TOP_K, TEMPLATE_TOKEN_BUDGET, TEMPLATE_INDEX_CACHE_SIZE
+
+CHARS_PER_TOKEN = 4
+WORD = re.compile(r"[a-z0-9']+")
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+DOCX_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+EXAMPLES_INTRO = (
+    "Excerpts from the user's own email template. Match their structure, tone, "
+    "greeting and sign-off, but do not copy their facts:"
+)
+
+
+def extract_docx(content):
+    """Paragraph text from a .docx (a zip of WordprocessingML)"""
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        root = ElementTree.fromstring(archive.read('word/document.xml'))
+    paragraphs = [
+        ''.join(node.text or '' if node.tag == f'{DOCX_NS}t' else '\n'
+                for node in paragraph.iter() if node.tag in (f'{DOCX_NS}t', f'{DOCX_NS}br'))
+        for paragraph in root.iter(f'{DOCX_NS}p')
+    ]
+    return '\n\n'.join(p for p in paragraphs if p.strip())
+
+
+def extract_pdf(content):
+    # Optional dependency; PDF templates are skipped without it
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return ""
+    reader = PdfReader(io.BytesIO(content))
+    return '\n\n'.join(page.extract_text() or '' for page in reader.pages)
+
+
+def extract_text(content):
+    """Plain text from template bytes, detected from the file contents"""
+    if content.startswith(b'PK'):
+        try:
+            return extract_docx(content)
+        except (zipfile.BadZipFile, KeyError, ElementTree.ParseError):
+            return ""
+    if content.startswith(b'%PDF'):
+        return extract_pdf(content)
+    return content.decode('utf-8', errors='replace')
+
+
+def split_snippets(text, max_chars=TEMPLATE_SNIPPET_CHARS):
+    """Group paragraphs into snippets of up to max_chars (long paragraphs are cut on words)"""
+    snippets = []
+    current = ""
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        paragraph = ' '.join(paragraph.split())
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                snippets.append(current)
+                current = ""
+            snippets.append(paragraph[:cut])
+            paragraph = paragraph[cut:].strip()
+        if not paragraph:
+            continue
+        if current and len(current) + 2 + len(paragraph) > max_chars:
+            snippets.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        snippets.append(current)
+    return snippets
+
+
+def tokenize(text):
+    return WORD.findall(text.lower())
+
+
+class TemplateIndex:
+    """TF-IDF vectors over a template's snippets for similarity lookups"""
+
+    def __init__(self, snippets):
+        self.snippets = snippets
+        docs = [tokenize(snippet) for snippet in snippets]
+        self.vocab = {word: i for i, word in enumerate(sorted({w for doc in docs for w in doc}))}
+        counts = np.zeros((len(snippets), len(self.vocab)), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            for word in doc:
+                counts[row, self.vocab[word]] += 1
+        document_frequency = (counts > 0).sum(axis=0)
+        self.idf = np.log((1 + len(snippets)) / (1 + document_frequency)).astype(np.float32) + 1
+        self.vectors = self._normalise(self._weigh(counts))
+
+    def _weigh(self, counts):
+        # Sublinear term frequency so one repeated word does not dominate
+        weights = counts.copy()
+        nonzero = weights > 0
+        weights[nonzero] = 1 + np.log(weights[nonzero])
+        return weights * self.idf
+
+    @staticmethod
+    def _normalise(matrix):
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def query(self, text, k=TEMPLATE_TOP_K, token_budget=TEMPLATE_TOKEN_BUDGET):
+        """Up to k most similar snippets that fit the token budget, in document order
+
+        With no word overlap at all the template's opening snippets are used.
+        """
+        if not self.snippets:
+            return []
+        counts = np.zeros(len(self.vocab), dtype=np.float32)
+        for word in tokenize(text):
+            index = self.vocab.get(word)
+            if index is not None:
+                counts[index] += 1
+        scores = self.vectors @ self._normalise(self._weigh(counts))
+        # Stable sort keeps document order among equal scores
+        ranked = np.argsort(-scores, kind='stable')
+
+        budget = token_budget * CHARS_PER_TOKEN
+        chosen = []
+        for index in ranked:
+            if len(chosen) == k:
+                break
+            if len(self.snippets[index]) <= budget:
+                chosen.append(index)
+                budget -= len(self.snippets[index])
+        return [self.snippets[index] for index in sorted(chosen)]
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_template_index(template_hash, load_content):
+    """Index for a template, extracted and built once per content hash
+
+    load_content() returns the template bytes and is only called on a miss.
+    """
+    with _indexes_lock:
+        if template_hash in _indexes:
+            _indexes.move_to_end(template_hash)
+            return _indexes[template_hash]
+    content = load_content()
+    index = TemplateIndex(split_snippets(extract_text(content)) if content else [])
+    with _indexes_lock:
+        _indexes[template_hash] = index
+        while len(_indexes) > TEMPLATE_INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def examples_block(snippets):
+    """Text block introducing the retrieved snippets in the user message"""
+    return EXAMPLES_INTRO + '\n\n' + '\n\n---\n\n'.join(snippets)
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# Offline runs: dummy credentials, no metric exports, no instance metadata lookups
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+os.environ.setdefault('AWS_EC2_METADATA_DISABLED', 'true')
+os.environ.setdefault('METRICS_EMF_ENABLED', 'false')
+os.environ.setdefault('METRICS_PORT', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,74 @@
+import io
+import json
+import threading
+import wave
+from http.client import HTTPConnection
+import pytest
+import api_server
+from api_server import APIHandler, PooledHTTPServer, fake_processor
+
+
+@pytest.fixture
+def server():
+    server = PooledHTTPServer(('127.0.0.1', 0), APIHandler, fake_processor(), workers=4)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, path, body):
+    conn = HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+    conn.request('POST', path, body=body)
+    response = conn.getresponse()
+    payload = json.loads(response.read())
+    conn.close()
+    return response.status, payload
+
+
+def silent_wav(seconds=0.5, sample_rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b'\0\0' * int(sample_rate * seconds))
+    return buffer.getvalue()
+
+
+def test_jobs_accepts_wav(server):
+    status, payload = post(server, '/jobs?doc_type=Email', silent_wav())
+    assert status == 202
+    assert payload['status_url'] == f"/jobs/{payload['job_id']}"
+
+
+@pytest.mark.parametrize('body', [b'\x1aE\xdf\xa3 webm audio', b'OggS', b'RIFF\0\0\0\0AVI '])
+def test_jobs_rejects_audio_that_is_not_wav(server, body):
+    status, payload = post(server, '/jobs?doc_type=Email', body)
+    assert status == 400
+    assert 'WAV' in payload['error']
+
+
+def test_api_thread_restarts_after_a_crash(monkeypatch):
+    served = []
+    restarted = threading.Event()
+
+    class CrashingServer:
+        def __init__(self, *args):
+            pass
+
+        def serve_forever(self):
+            served.append(True)
+            if len(served) == 1:
+                raise OSError("listener failed")
+            restarted.set()
+            threading.Event().wait()
+
+        def server_close(self):
+            pass
+
+    monkeypatch.setattr(api_server, 'PooledHTTPServer', CrashingServer)
+    monkeypatch.setattr(api_server, 'get_shared_processor', lambda: None)
+    monkeypatch.setattr(api_server, 'RESTART_DELAY_SECONDS', 0)
+    threading.Thread(target=api_server._serve_forever, args=(0, 1), daemon=True).start()
+    assert restarted.wait(5)
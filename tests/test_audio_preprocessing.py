@@ -0,0 +1,129 @@
+import io
+import tempfile
+import tracemalloc
+import wave
+import numpy as np
+import pytest
+import soundfile as sf
+from audio_encoder import encode_audio
+from audio_preprocessor import read_wav, trim_silence, trim_silence_file
+from speech_processor import SpeechProcessor
+from config import VAD_MAX_PAUSE_MS, VAD_PADDING_MS
+
+RATE = 16000
+
+
+def make_wav(samples, sample_rate=RATE):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(np.asarray(samples, dtype='<i2').tobytes())
+    return buffer.getvalue()
+
+
+def speech(seconds, amplitude=8000):
+    t = np.arange(int(RATE * seconds)) / RATE
+    return amplitude * np.sin(2 * np.pi * 300 * t)
+
+
+def silence(seconds):
+    # A little background hiss, as a real microphone gives
+    return np.random.default_rng(0).normal(0, 3, int(RATE * seconds))
+
+
+FIXTURES = {
+    'empty': make_wav([]),
+    'few_samples': make_wav(speech(0.005)),
+    'all_silence': make_wav(silence(2.0)),
+    'padded_speech': make_wav(np.concatenate([silence(2.0), speech(1.0), silence(2.0)])),
+    'long_pause': make_wav(np.concatenate([speech(1.0), silence(3.0), speech(1.0)])),
+}
+
+
+def duration(wav_bytes):
+    samples, params = read_wav(wav_bytes)
+    return len(samples) / params.framerate
+
+
+@pytest.mark.parametrize('name', ['empty', 'few_samples', 'all_silence'])
+def test_audio_without_speech_is_left_unchanged(name):
+    processed, stats = trim_silence(FIXTURES[name])
+    assert processed == FIXTURES[name]
+    assert stats['bytes_removed'] == 0
+
+
+def test_leading_and_trailing_silence_is_trimmed():
+    processed, stats = trim_silence(FIXTURES['padded_speech'])
+    # The speech plus its padding either side is kept
+    assert duration(processed) == pytest.approx(1.0 + 2 * VAD_PADDING_MS / 1000, abs=0.05)
+    assert stats['seconds_removed'] == pytest.approx(5.0 - duration(processed), abs=0.001)
+
+
+def test_long_pause_is_shortened():
+    processed, _ = trim_silence(FIXTURES['long_pause'])
+    # Padding after the first phrase and before the second, plus the capped pause
+    assert duration(processed) == pytest.approx(2.0 + (2 * VAD_PADDING_MS + VAD_MAX_PAUSE_MS) / 1000, abs=0.05)
+
+
+@pytest.mark.parametrize('name', ['empty', 'all_silence'])
+def test_preprocess_passes_unusable_audio_through(name):
+    audio, _ = SpeechProcessor.preprocess_audio(None, io.BytesIO(FIXTURES[name]))
+    assert audio.read() == FIXTURES[name]
+
+
+def test_flac_encoding_is_lossless_and_smaller():
+    wav = FIXTURES['padded_speech']
+    encoded, media_format, stats = encode_audio(wav, 'flac')
+    assert media_format == 'flac'
+    assert stats['encoded_bytes'] == len(encoded) < len(wav)
+    decoded, sample_rate = sf.read(io.BytesIO(encoded), dtype='int16')
+    samples, _ = read_wav(wav)
+    assert sample_rate == RATE
+    assert np.array_equal(decoded, samples[:, 0])
+
+
+def test_wav_upload_format_is_passed_through():
+    wav = FIXTURES['padded_speech']
+    encoded, media_format, stats = encode_audio(wav, 'wav')
+    assert (encoded, media_format, stats['compression_ratio']) == (wav, 'wav', 1.0)
+
+
+def spilled(wav_bytes):
+    f = tempfile.TemporaryFile()
+    f.write(wav_bytes)
+    f.seek(0)
+    return f
+
+
+@pytest.mark.parametrize('name', list(FIXTURES))
+def test_file_trimming_matches_in_memory_trimming(name):
+    expected, expected_stats = trim_silence(FIXTURES[name])
+    with spilled(FIXTURES[name]) as f:
+        trimmed, stats = trim_silence_file(f)
+        assert trimmed.read() == expected
+    assert stats == expected_stats
+
+
+def test_spilled_recording_is_trimmed_and_encoded_in_blocks():
+    # Ten minutes of speech between long silences, about 19 MB as WAV
+    phrase = np.concatenate([speech(5.0), silence(55.0)])
+    wav = make_wav(np.tile(phrase, 10))
+    with spilled(wav) as f:
+        del wav
+        tracemalloc.start()
+        try:
+            trimmed, trim_stats = SpeechProcessor.preprocess_audio(None, f)
+            encoded, media_format, stats = encode_audio(trimmed, 'flac')
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert hasattr(encoded, 'read') and media_format == 'flac'
+        assert peak < 4 * 1024 * 1024
+        assert trim_stats['bytes_removed'] > 0
+        decoded, _ = sf.read(encoded, dtype='int16')
+        trimmed.seek(0)
+        samples, _ = read_wav(trimmed.read())
+        assert np.array_equal(decoded, samples[:, 0])
@@ -0,0 +1,65 @@
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+import bedrock_admission
+from bedrock_admission import BedrockBusyError, call_with_backoff
+from config import BEDROCK_RETRY_ATTEMPTS, BEDROCK_TRANSIENT_RETRY_ATTEMPTS
+
+
+def client_error(code, status):
+    return ClientError({'Error': {'Code': code, 'Message': code},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, 'Converse')
+
+
+class FlakyAttempt:
+    """Raises the given errors in turn, then returns 'ok'"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(bedrock_admission.time, 'sleep', lambda seconds: None)
+
+
+@pytest.mark.parametrize('error', [
+    client_error('InternalServerException', 500),
+    client_error('ModelNotReadyException', 429),
+    client_error('SomethingNew', 502),
+    ReadTimeoutError(endpoint_url='https://bedrock-runtime'),
+    EndpointConnectionError(endpoint_url='https://bedrock-runtime'),
+])
+def test_transient_errors_are_retried(error):
+    attempt = FlakyAttempt(error, error)
+    assert call_with_backoff(attempt) == 'ok'
+    assert attempt.calls == 3
+
+
+def test_transient_retries_are_bounded():
+    error = client_error('InternalServerException', 500)
+    attempt = FlakyAttempt(*[error] * 10)
+    with pytest.raises(ClientError) as raised:
+        call_with_backoff(attempt)
+    assert raised.value is error
+    assert attempt.calls == BEDROCK_TRANSIENT_RETRY_ATTEMPTS
+
+
+def test_client_errors_are_not_retried():
+    attempt = FlakyAttempt(client_error('ValidationException', 400))
+    with pytest.raises(ClientError):
+        call_with_backoff(attempt)
+    assert attempt.calls == 1
+
+
+def test_throttling_keeps_its_own_budget():
+    attempt = FlakyAttempt(*[client_error('ThrottlingException', 429)] * 10)
+    with pytest.raises(BedrockBusyError):
+        call_with_backoff(attempt)
+    assert attempt.calls == BEDROCK_RETRY_ATTEMPTS
@@ -0,0 +1,106 @@
+import threading
+import time
+import pytest
+import speech_processor
+from bedrock_admission import AdmissionController
+from config import FORMAT_CHUNK_CHARS, FORMAT_NOTES_TOKENS
+from speech_processor import SpeechProcessor, split_transcript
+
+CHARS_PER_TOKEN = 4
+FIRST_TOKEN_SECONDS = 0.4
+SECONDS_PER_INPUT_TOKEN = 0.0001
+SECONDS_PER_OUTPUT_TOKEN = 0.02
+# Real seconds slept per simulated second, so the test measures how the code schedules calls
+TIME_SCALE = 0.02
+
+TRANSCRIPT = ' '.join(f"Point {i} was discussed and agreed by the team." for i in range(600))
+
+
+class EchoBedrock:
+    """Converse stand-in that treats every call alike
+
+    Each call echoes its input, cut off at the request's maxTokens, and sleeps
+    a scaled latency from its input and output token counts. No call type
+    gets shorter output than another, so any speedup comes from what the code
+    asks for and how it schedules the calls.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+
+    def converse(self, modelId, messages, inferenceConfig, system=None):
+        text = messages[0]['content'][-1]['text']
+        output = text[:inferenceConfig['maxTokens'] * CHARS_PER_TOKEN]
+        input_tokens = len(text) // CHARS_PER_TOKEN
+        output_tokens = len(output) // CHARS_PER_TOKEN
+        seconds = FIRST_TOKEN_SECONDS + input_tokens * SECONDS_PER_INPUT_TOKEN + output_tokens * SECONDS_PER_OUTPUT_TOKEN
+        with self.lock:
+            self.calls.append({'final': system is not None, 'input': text, 'output': output})
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            time.sleep(seconds * TIME_SCALE)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        return {'output': {'message': {'role': 'assistant', 'content': [{'text': output}]}},
+                'usage': {'inputTokens': input_tokens, 'outputTokens': output_tokens}}
+
+
+@pytest.fixture
+def processor():
+    processor = SpeechProcessor()
+    processor.bedrock = EchoBedrock()
+    # No quota waits from earlier tests in the process
+    processor.admission = AdmissionController(rpm=10 ** 9, tpm=10 ** 12, max_concurrency=10 ** 6)
+    return processor
+
+
+def format_transcript(processor, monkeypatch, chunked):
+    if not chunked:
+        monkeypatch.setattr(speech_processor, 'FORMAT_CHUNK_CHARS', len(TRANSCRIPT) + 1)
+    started = time.perf_counter()
+    formatted = processor.format_with_bedrock(TRANSCRIPT, "Meeting Minutes")
+    return formatted, time.perf_counter() - started
+
+
+def test_short_text_is_formatted_in_one_call(processor):
+    processor.format_with_bedrock("Point 1 was agreed.", "Meeting Minutes")
+    assert [c['final'] for c in processor.bedrock.calls] == [True]
+
+
+def test_single_call_truncates_long_transcripts(processor, monkeypatch):
+    formatted, _ = format_transcript(processor, monkeypatch, chunked=False)
+    assert "Point 0 " in formatted
+    assert "Point 599 " not in formatted
+
+
+def test_map_step_reduces_input_and_final_call_covers_every_part(processor, monkeypatch):
+    formatted, _ = format_transcript(processor, monkeypatch, chunked=True)
+    chunks = split_transcript(TRANSCRIPT, FORMAT_CHUNK_CHARS)
+    calls = processor.bedrock.calls
+
+    assert len(calls) == len(chunks) + 1
+    final = calls[-1]
+    assert final['final']
+    # The merge runs on bounded notes rather than the whole transcript
+    assert len(final['input']) <= FORMAT_NOTES_TOKENS * CHARS_PER_TOKEN + 2 * len(chunks)
+    assert final['output'] == final['input']  # under maxTokens, so nothing was cut off
+    for chunk in chunks:
+        assert chunk.split('.')[0] in formatted
+
+
+def test_chunked_formatting_is_faster_than_one_call(processor, monkeypatch):
+    _, single = format_transcript(processor, monkeypatch, chunked=False)
+
+    processor.bedrock.calls.clear()
+    processor.format_cache.entries.clear()
+    monkeypatch.undo()
+    _, chunked = format_transcript(processor, monkeypatch, chunked=True)
+
+    # The map calls overlap rather than running one after another
+    assert processor.bedrock.peak_in_flight > 1
+    assert chunked < single
@@ -0,0 +1,98 @@
+import json
+import random
+import pytest
+from botocore.awsrequest import AWSResponse
+from prompt_builder import compile_prompt
+from speech_processor import SpeechProcessor, StreamCleaner, clean_response
+
+RESPONSES = [
+    "Here is the email:\n\nSubject: Budget update   \n\nHi team,\n\nThe revised figures are attached.  \nThanks,\nSam\n",
+    "  Subject: Launch date\n\n\nHello all,\nWe are moving the launch to the 14th because of the supplier delay.\t\nBest regards\n",
+    "Formatted email:\nSubject: Notes",
+    # Meta-text late in a line the cleaner has already started to show
+    "Subject: Quick note on the offsite plans for next month - Here is the email:\nBody text\n",
+]
+
+
+def feed_in_chunks(text, seed):
+    rng = random.Random(seed)
+    cleaner = StreamCleaner()
+    shown = ""
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 12)
+        shown += cleaner.feed(text[i:i + size])
+        i += size
+    return cleaner, shown + cleaner.close()
+
+
+@pytest.mark.parametrize('response', RESPONSES)
+def test_stream_cleaner_text_matches_clean_response(response):
+    for seed in range(20):
+        cleaner, shown = feed_in_chunks(response, seed)
+        assert cleaner.text == clean_response(response)
+        if response is not RESPONSES[-1]:
+            assert shown == clean_response(response)
+
+
+class ConverseStreamStub:
+    """Answers ConverseStream calls on a real client after botocore has validated the request
+
+    Stubber cannot express an event stream response, so this hooks before-call
+    the same way it does.
+    """
+
+    def __init__(self, client, responses):
+        self.responses = list(responses)
+        self.requests = []
+        client.meta.events.register('before-call.bedrock-runtime.ConverseStream', self._respond)
+
+    def _respond(self, params, **kwargs):
+        self.requests.append(json.loads(params['body']))
+        return AWSResponse(None, 200, {}, None), self.responses.pop(0)
+
+
+def converse_stream_response(text, size=7):
+    events = [{'messageStart': {'role': 'assistant'}}]
+    events += [{'contentBlockDelta': {'contentBlockIndex': 0, 'delta': {'text': text[i:i + size]}}}
+               for i in range(0, len(text), size)]
+    events += [
+        {'messageStop': {'stopReason': 'end_turn'}},
+        {'metadata': {'usage': {'inputTokens': 50, 'outputTokens': 20, 'totalTokens': 70},
+                      'metrics': {'latencyMs': 10}}}
+    ]
+    return {'stream': events}
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    monkeypatch.setattr('model_router.BEDROCK_ROUTING', False)
+    processor = SpeechProcessor()
+    processor.format_cache.backend = 'memory'
+    return processor
+
+
+@pytest.mark.parametrize('response', RESPONSES)
+def test_streamed_and_converse_results_are_cached_alike(processor, response):
+    text = "hi team the revised budget figures are attached thanks sam"
+    stub = ConverseStreamStub(processor.bedrock, [converse_stream_response(response)])
+    result = {}
+    chunks = list(processor.format_with_bedrock_stream(text, 'Email', result=result))
+    assert not stub.responses
+
+    assert result['text'] == clean_response(response)
+    # Served from the cache: the same text format_with_bedrock would return
+    assert processor.format_with_bedrock(text, 'Email') == clean_response(response)
+    if response is not RESPONSES[-1]:
+        assert ''.join(chunks) == result['text']
+
+
+def test_converse_stream_request_sends_text_after_cached_system_prompt(processor):
+    stub = ConverseStreamStub(processor.bedrock, [converse_stream_response("Subject: Hi\n\nBody")])
+    chunks = list(processor.format_with_bedrock_stream("short note for the team", 'Email'))
+
+    assert ''.join(chunks) == "Subject: Hi\n\nBody"
+    [request] = stub.requests
+    assert request['system'] == compile_prompt('Email').system
+    assert request['system'][-1] == {'cachePoint': {'type': 'default'}}
+    assert request['messages'] == [{'role': 'user', 'content': [{'text': "short note for the team"}]}]
@@ -0,0 +1,60 @@
+import pytest
+import batch_runner
+from job_manager import COMPLETED, FAILED, Job, JobManager
+
+
+class TranscriptProcessor:
+    """Transcription stand-in: None while running, then the given transcript"""
+
+    def __init__(self, transcript, polls_until_done=1):
+        self.transcript = transcript
+        self.polls_until_done = polls_until_done
+        self.polls = 0
+
+    def get_transcription_result(self, job_name):
+        self.polls += 1
+        return self.transcript if self.polls > self.polls_until_done else None
+
+    def format_with_bedrock(self, text, doc_type, **kwargs):
+        return text.upper()
+
+    def format_with_bedrock_stream(self, text, doc_type, result=None, **kwargs):
+        result['text'] = text.upper()
+        yield result['text']
+
+    def cancel_transcription(self, job_name):
+        pass
+
+
+def run_job(processor):
+    manager = JobManager(max_workers=1)
+    job = manager.get(manager.submit_transcription(processor, 'transcribe-job', 'Email'))
+    assert job.wait(10), "job did not finish"
+    return job
+
+
+def test_transcript_is_formatted():
+    job = run_job(TranscriptProcessor("hello team"))
+    assert job.status == COMPLETED
+    assert job.result == "HELLO TEAM"
+
+
+@pytest.mark.parametrize('transcript', ["", "  "])
+def test_silent_recording_fails_instead_of_polling_forever(transcript):
+    job = run_job(TranscriptProcessor(transcript, polls_until_done=0))
+    assert job.status == FAILED
+    assert job.error == "No speech detected in recording"
+
+
+def test_wait_for_transcript_times_out():
+    job = Job('job-1', 'Email', {})
+    job.transcription_job = 'transcribe-job'
+    with pytest.raises(TimeoutError):
+        JobManager(max_workers=1)._wait_for_transcript(job, TranscriptProcessor(None), timeout=0.2)
+
+
+def test_batch_runner_fails_silent_recordings_and_times_out():
+    with pytest.raises(Exception, match="No speech detected"):
+        batch_runner.wait_for_transcript(TranscriptProcessor("", polls_until_done=0), 'transcribe-job')
+    with pytest.raises(TimeoutError):
+        batch_runner.wait_for_transcript(TranscriptProcessor(None), 'transcribe-job', timeout=0.2)
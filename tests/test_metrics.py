@@ -0,0 +1,43 @@
+import os
+import threading
+import metrics
+from metrics import MetricsRegistry, span
+
+
+def test_concurrent_spans_write_the_prom_file_safely(tmp_path, monkeypatch):
+    prom_file = tmp_path / 'speech.prom'
+    monkeypatch.setattr(metrics, 'METRICS_PROM_FILE', str(prom_file))
+    monkeypatch.setattr(metrics, 'PROM_FILE_INTERVAL_SECONDS', 0)
+    monkeypatch.setattr(metrics, 'registry', MetricsRegistry())
+    errors = []
+
+    def run_spans():
+        try:
+            for _ in range(300):
+                with span('bedrock_call'):
+                    pass
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run_spans) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    metrics.registry.maybe_write_file()
+    assert 'speech_formatter_stage_seconds_count{stage="bedrock_call"} 2400' in prom_file.read_text()
+    assert os.listdir(tmp_path) == ['speech.prom']  # no temp files left behind
+
+
+def test_export_failure_does_not_fail_the_measured_call(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_PROM_FILE', str(tmp_path / 'missing' / 'speech.prom'))
+    monkeypatch.setattr(metrics, 'PROM_FILE_INTERVAL_SECONDS', 0)
+    monkeypatch.setattr(metrics, 'registry', MetricsRegistry())
+
+    with span('bedrock_call') as sp:
+        sp['output_tokens'] = 5
+    metrics.count('model_route', model='nova-lite')
+
+    assert metrics.registry.summary()['bedrock_call']['count'] == 1
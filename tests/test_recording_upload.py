@@ -0,0 +1,58 @@
+import threading
+import pytest
+import recording_upload
+from api_server import fake_processor
+from recording_upload import RecordingError, RecordingManager
+
+
+@pytest.fixture
+def processor():
+    return fake_processor()
+
+
+@pytest.mark.parametrize('mode', ['multipart', 'spool'])
+def test_chunks_after_finish_are_refused(processor, monkeypatch, mode):
+    manager = RecordingManager(mode=mode)
+    recording_id = manager.start(processor, 'webm')
+    recording = manager.get(recording_id)
+    manager.append(recording_id, 0, b'\x1aE\xdf\xa3 first chunk')
+    manager.finish(recording_id, 'Email')
+
+    with pytest.raises(KeyError):
+        manager.append(recording_id, 1, b'late chunk')
+    # A request that looked the recording up just before finish() cannot write to it either
+    monkeypatch.setattr(manager, 'get', lambda _: recording)
+    with pytest.raises(RecordingError):
+        manager.append(recording_id, 1, b'late chunk')
+    with pytest.raises(RecordingError):
+        manager.finish(recording_id, 'Email')
+
+
+def test_finish_waits_for_a_chunk_being_written(processor):
+    manager = RecordingManager(mode='spool')
+    recording_id = manager.start(processor, 'webm')
+    manager.append(recording_id, 0, b'first chunk')
+    recording = manager.get(recording_id)
+    finishing = threading.Thread(target=manager.finish, args=(recording_id, 'Email'))
+
+    with recording.lock:  # as held by append() while it writes
+        finishing.start()
+        finishing.join(0.1)
+        assert finishing.is_alive() and not recording.closed
+    finishing.join(5)
+    assert recording.closed
+    assert processor.s3.objects[(recording_upload.TRANSCRIBE_BUCKET, recording.sink.key)] == b'first chunk'
+
+
+def test_sweep_aborts_idle_recordings(processor):
+    manager = RecordingManager(mode='multipart')
+    idle_id = manager.start(processor, 'webm')
+    active_id = manager.start(processor, 'webm')
+    idle = manager.get(idle_id)
+    idle.updated_at -= recording_upload.RECORDING_TTL_SECONDS + 1
+
+    manager.sweep()
+
+    assert manager.get(idle_id) is None and idle.closed
+    assert idle.sink.upload_id not in processor.s3.uploads
+    assert manager.get(active_id) is not None
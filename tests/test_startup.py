@@ -0,0 +1,56 @@
+import ast
+import importlib.util
+import os
+import pytest
+import startup
+from config import STARTUP_BUDGET_SECONDS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Loaded once, when a session first needs a processor, not on every script run
+SESSION_INIT_IMPORTS = {'speech_processor', 'boto3'}
+
+
+def imports_outside_functions(node, in_session_init=False):
+    """Yield (module, in_session_init) for each import the script itself can run
+
+    Function bodies are skipped; in_session_init marks imports inside an
+    `if '<key>' not in st.session_state:` block, which runs once per session.
+    """
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+        return
+    if isinstance(node, ast.Import):
+        for alias in node.names:
+            yield alias.name.split('.')[0], in_session_init
+    elif isinstance(node, ast.ImportFrom):
+        yield node.module.split('.')[0], in_session_init
+    if isinstance(node, ast.If) and is_session_init(node.test):
+        for child in node.body:
+            yield from imports_outside_functions(child, True)
+        for child in node.orelse:
+            yield from imports_outside_functions(child, in_session_init)
+        return
+    for child in ast.iter_child_nodes(node):
+        yield from imports_outside_functions(child, in_session_init)
+
+
+def is_session_init(test):
+    return (isinstance(test, ast.Compare) and isinstance(test.ops[0], ast.NotIn)
+            and ast.unparse(test.comparators[0]) == 'st.session_state')
+
+
+def test_ui_imports_processor_only_on_session_init():
+    with open(os.path.join(ROOT, 'speech_formatter.py'), encoding='utf-8') as f:
+        imports = list(imports_outside_functions(ast.parse(f.read())))
+    every_run = {module for module, in_session_init in imports if not in_session_init}
+    assert not every_run & SESSION_INIT_IMPORTS
+    assert {module for module, in_session_init in imports if in_session_init} & SESSION_INIT_IMPORTS
+
+
+def test_cold_start_profile():
+    # Reported rather than asserted: wall-clock time depends on the machine running the suite
+    missing = [m for m in startup.APP_MODULES if importlib.util.find_spec(m) is None]
+    if missing:
+        pytest.skip(f"App modules not installed: {', '.join(missing)}")
+    steps = startup.measure_cold_start()
+    print(f"Cold start {steps['total']:.2f}s (budget {STARTUP_BUDGET_SECONDS:.2f}s)")
+    assert {f"import {m}" for m in startup.APP_MODULES} <= set(steps)
@@ -0,0 +1,117 @@
+import asyncio
+import io
+import wave
+from types import SimpleNamespace
+import numpy as np
+from streaming_transcriber import read_wav_pcm, transcribe_stream
+
+# Limits Transcribe streaming enforces on PCM input
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 48000
+MAX_CHUNK_BYTES = 32 * 1024
+
+
+class FakeStreamingClient:
+    """Local stand-in for TranscribeStreamingClient
+
+    Checks the audio events the way the service does and sends a partial
+    and then a final result for every second of audio received.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.chunks = []
+
+    async def start_stream_transcription(self, language_code, media_sample_rate_hz, media_encoding):
+        assert media_encoding == 'pcm'
+        assert MIN_SAMPLE_RATE <= media_sample_rate_hz <= MAX_SAMPLE_RATE
+        self.requests.append((language_code, media_sample_rate_hz))
+        results = asyncio.Queue()
+        bytes_per_second = media_sample_rate_hz * 2
+        received = bytearray()
+
+        async def send_audio_event(audio_chunk):
+            assert len(audio_chunk) <= MAX_CHUNK_BYTES
+            assert len(audio_chunk) % 2 == 0, "PCM chunks must hold whole 16-bit samples"
+            self.chunks.append(audio_chunk)
+            received.extend(audio_chunk)
+            while len(received) >= bytes_per_second:
+                await self._emit(results, received[:bytes_per_second])
+                del received[:bytes_per_second]
+
+        async def end_stream():
+            if received:
+                await self._emit(results, received)
+            await results.put(None)
+
+        async def output_stream():
+            while (event := await results.get()) is not None:
+                yield event
+
+        return SimpleNamespace(
+            input_stream=SimpleNamespace(send_audio_event=send_audio_event, end_stream=end_stream),
+            output_stream=output_stream()
+        )
+
+    @staticmethod
+    async def _emit(results, pcm):
+        level = int(np.abs(np.frombuffer(bytes(pcm), dtype='<i2')).max())
+        for is_partial in (True, False):
+            text = f"{'partial' if is_partial else 'segment'} {level}"
+            result = SimpleNamespace(is_partial=is_partial, alternatives=[SimpleNamespace(transcript=text)])
+            await results.put(SimpleNamespace(transcript=SimpleNamespace(results=[result])))
+
+
+def make_wav(samples, sample_rate, sampwidth=2):
+    """WAV bytes from a frames x channels integer array"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(samples.shape[1])
+        wav.setsampwidth(sampwidth)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def tone(sample_rate, seconds, amplitude=8000, channels=1):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    mono = (amplitude * np.sin(2 * np.pi * 440 * t)).astype('<i2')
+    return np.repeat(mono[:, None], channels, axis=1)
+
+
+def test_16khz_mono_passes_through_unchanged():
+    samples = tone(16000, 0.5)
+    pcm, sample_rate = read_wav_pcm(make_wav(samples, 16000))
+    assert sample_rate == 16000
+    assert pcm == samples.tobytes()
+
+
+def test_stereo_48khz_is_mixed_down_and_resampled():
+    samples = tone(48000, 1.0, channels=2)
+    pcm, sample_rate = read_wav_pcm(make_wav(samples, 48000))
+    out = np.frombuffer(pcm, dtype='<i2')
+    assert sample_rate == 16000
+    assert len(out) == 16000
+    # A 440 Hz tone keeps its level through the low-pass filter
+    assert 7000 < np.abs(out[100:-100]).max() <= 8000
+
+
+def test_8bit_audio_is_centred():
+    samples = np.full((800, 1), 128, dtype=np.uint8)
+    pcm, sample_rate = read_wav_pcm(make_wav(samples, 8000, sampwidth=1))
+    assert sample_rate == 8000
+    assert not np.frombuffer(pcm, dtype='<i2').any()
+
+
+def test_transcribe_stream_sends_frames_and_keeps_final_results():
+    client = FakeStreamingClient()
+    audio = make_wav(tone(44100, 2.5, channels=2), 44100)
+
+    transcript = transcribe_stream(audio, client=client)
+
+    assert client.requests == [('en-US', 16000)]
+    # 2.5s resampled to 16 kHz, 16-bit mono
+    assert sum(len(chunk) for chunk in client.chunks) == 40000 * 2
+    assert transcript.split(' ')[::2] == ['segment'] * 3
+    assert 'partial' not in transcript
+
@@ -0,0 +1,102 @@
+import os
+import boto3
+import pytest
+from botocore.stub import Stubber
+import update_cloudfront_ips
+from update_cloudfront_ips import (
+    BATCH_SIZE, DESCRIPTION, ETAG_TAG, PORT, SYNC_TOKEN_TAG, cloudfront_cidrs, load_ip_ranges, permissions, run
+)
+
+GROUP_ID = 'sg-0123456789abcdef0'
+IP_RANGES = load_ip_ranges(os.path.join(os.path.dirname(__file__), 'fixtures', 'ip-ranges.json'))
+WANTED = sorted(cloudfront_cidrs(IP_RANGES))
+STALE = ['130.176.0.0/18', '130.176.64.0/18']
+
+
+@pytest.fixture
+def ec2(monkeypatch):
+    # One call at a time, so the stubbed responses are consumed in batch order
+    monkeypatch.setattr(update_cloudfront_ips, 'MAX_PARALLEL_CALLS', 1)
+    client = boto3.client('ec2', region_name='us-east-1')
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+def describe_response(cidrs, tags=()):
+    return {'SecurityGroups': [{
+        'GroupId': GROUP_ID,
+        'IpPermissions': [
+            {'IpProtocol': 'tcp', 'FromPort': PORT, 'ToPort': PORT,
+             'IpRanges': [{'CidrIp': cidr, 'Description': DESCRIPTION} for cidr in cidrs]},
+            # Other rules on the port are not ours to manage
+            {'IpProtocol': 'tcp', 'FromPort': PORT, 'ToPort': PORT,
+             'IpRanges': [{'CidrIp': '10.0.0.0/8', 'Description': 'VPC'}]}
+        ],
+        'Tags': [{'Key': key, 'Value': value} for key, value in tags]
+    }]}
+
+
+def expect_describe(stubber, cidrs, tags=()):
+    stubber.add_response('describe_security_groups', describe_response(cidrs, tags), {'GroupIds': [GROUP_ID]})
+
+
+def expect_batches(stubber, operation, cidrs):
+    for i in range(0, len(cidrs), BATCH_SIZE):
+        stubber.add_response(operation, {'Return': True},
+                             {'GroupId': GROUP_ID, 'IpPermissions': permissions(cidrs[i:i + BATCH_SIZE])})
+
+
+def expect_tags(stubber):
+    stubber.add_response('create_tags', {}, {
+        'Resources': [GROUP_ID], 'Tags': [{'Key': SYNC_TOKEN_TAG, 'Value': IP_RANGES['syncToken']}]
+    })
+
+
+def test_new_ranges_are_added_in_batches_before_stale_ones_are_removed(ec2):
+    client, stubber = ec2
+    current = WANTED[:5] + STALE
+    to_add = WANTED[5:]
+    expect_describe(stubber, current)
+    expect_batches(stubber, 'authorize_security_group_ingress', to_add)
+    expect_batches(stubber, 'revoke_security_group_ingress', STALE)
+    expect_tags(stubber)
+
+    summary = run(client, GROUP_ID, ip_ranges=IP_RANGES)
+
+    assert len(to_add) > BATCH_SIZE
+    assert summary['added'] == len(to_add) and summary['removed'] == len(STALE) and summary['unchanged'] == 5
+    assert summary['api_calls'] == 3
+
+
+def test_applied_sync_token_skips_the_update(ec2):
+    client, stubber = ec2
+    expect_describe(stubber, WANTED, tags=[(SYNC_TOKEN_TAG, IP_RANGES['syncToken']), (ETAG_TAG, '"abc"')])
+
+    assert run(client, GROUP_ID, ip_ranges=IP_RANGES)['skipped'] == 'sync token already applied'
+
+
+def test_dry_run_makes_no_changes(ec2):
+    client, stubber = ec2
+    expect_describe(stubber, STALE)
+
+    summary = run(client, GROUP_ID, ip_ranges=IP_RANGES, dry_run=True)
+
+    assert summary['dry_run'] and summary['added'] == len(WANTED) and summary['removed'] == len(STALE)
+
+
+def test_full_group_revokes_stale_ranges_first(ec2):
+    client, stubber = ec2
+    current = WANTED[2:] + STALE
+    to_add = WANTED[:2]
+    expect_describe(stubber, current)
+    stubber.add_client_error('authorize_security_group_ingress', 'RulesPerSecurityGroupLimitExceeded',
+                             expected_params={'GroupId': GROUP_ID, 'IpPermissions': permissions(to_add)})
+    expect_batches(stubber, 'revoke_security_group_ingress', STALE)
+    expect_batches(stubber, 'authorize_security_group_ingress', to_add)
+    expect_tags(stubber)
+
+    summary = run(client, GROUP_ID, ip_ranges=IP_RANGES)
+
+    assert summary['revoked_first']
+    assert summary['added'] == 2 and summary['removed'] == len(STALE)
@@ -0,0 +1,65 @@
+import base64
+import json
+import time
+import pytest
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+import user_identity
+from prompt_manager import DEFAULT_USER
+from user_identity import IdentityError, user_id_from_headers, verify_oidc_data
+
+ALB_ARN = 'arn:aws:elasticloadbalancing:us-east-1:123456789012:loadbalancer/app/speech/abc'
+KID = 'key-1'
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def make_token(key, signer=ALB_ARN, sub='user-1', exp=None):
+    """An ALB-style x-amzn-oidc-data token: ES256 with raw r || s signature"""
+    header = b64(json.dumps({'alg': 'ES256', 'kid': KID, 'signer': signer}).encode())
+    payload = b64(json.dumps({'sub': sub, 'exp': exp or time.time() + 60}).encode())
+    r, s = decode_dss_signature(key.sign(f"{header}.{payload}".encode(), ec.ECDSA(hashes.SHA256())))
+    return f"{header}.{payload}.{b64(r.to_bytes(32, 'big') + s.to_bytes(32, 'big'))}"
+
+
+@pytest.fixture
+def alb_key(monkeypatch):
+    key = ec.generate_private_key(ec.SECP256R1())
+    pem = key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+    monkeypatch.setattr(user_identity, '_public_key', lambda kid: pem)
+    monkeypatch.setattr(user_identity, 'TRUSTED_ALB_ARN', ALB_ARN)
+    return key
+
+
+def test_verified_token_identifies_the_user(alb_key):
+    headers = {'X-Amzn-Oidc-Data': make_token(alb_key)}
+    assert user_id_from_headers(headers) == 'user-1'
+
+
+def test_client_supplied_identity_header_is_ignored(alb_key):
+    assert user_id_from_headers({'X-Amzn-Oidc-Identity': 'someone-else'}) == DEFAULT_USER
+
+
+def test_no_trusted_alb_means_shared_settings(alb_key, monkeypatch):
+    monkeypatch.setattr(user_identity, 'TRUSTED_ALB_ARN', '')
+    assert user_id_from_headers({'X-Amzn-Oidc-Data': make_token(alb_key)}) == DEFAULT_USER
+
+
+@pytest.mark.parametrize('tamper', ['forged_key', 'other_signer', 'expired', 'edited_claims'])
+def test_untrusted_tokens_are_rejected(alb_key, tamper):
+    if tamper == 'forged_key':
+        token = make_token(ec.generate_private_key(ec.SECP256R1()))
+    elif tamper == 'other_signer':
+        token = make_token(alb_key, signer=ALB_ARN.replace('speech', 'attacker'))
+    elif tamper == 'expired':
+        token = make_token(alb_key, exp=time.time() - 1)
+    else:
+        header, _, signature = make_token(alb_key).split('.')
+        token = f"{header}.{b64(json.dumps({'sub': 'admin', 'exp': time.time() + 60}).encode())}.{signature}"
+
+    with pytest.raises(IdentityError):
+        verify_oidc_data(token, signer_arn=ALB_ARN, key_loader=user_identity._public_key)
+    assert user_id_from_headers({'X-Amzn-Oidc-Data': token}) == DEFAULT_USER
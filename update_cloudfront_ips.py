@@ -1,81 +1,197 @@
+"""Lambda that keeps a security group's port 8501 rules in step with CloudFront's IP ranges
+
+Each run fetches ip-ranges.json conditionally (If-None-Match with the ETag
+from the last sync) and stops early if the file, or its syncToken, has not
+changed. Otherwise only the difference against the group's current
+CloudFront rules is applied: new ranges are authorized before stale ones are
+revoked, so CloudFront traffic is never blocked mid-update. If the group has
+no room for both (its rules-per-group quota), the stale ranges are revoked
+first and the new ones authorized after. The ETag and
+syncToken of the applied file are stored as tags on the security group.
+
+Local dry run against a saved copy of the file (no changes are made):
+    python update_cloudfront_ips.py --ip-ranges ip-ranges.json --dry-run
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 import requests
-import json
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Configuration
+SECURITY_GROUP_ID = os.environ.get('SECURITY_GROUP_ID', 'sg-094f72ff744348adb')
+PORT = 8501
+DESCRIPTION = 'CloudFront Access - Auto Updated'
+IP_RANGES_URL = 'https://ip-ranges.amazonaws.com/ip-ranges.json'
+FETCH_TIMEOUT_SECONDS = 30
+
+# AWS accepts up to 50 ranges per call; a few calls at once stays well under EC2's rate limits
+BATCH_SIZE = 50
+MAX_PARALLEL_CALLS = 4
+SYNC_TOKEN_TAG = 'CloudFrontSyncToken'
+ETAG_TAG = 'CloudFrontIpRangesETag'
+
+# Safe to ignore: the rule is already in (or already gone from) the wanted state
+DUPLICATE_CODE = 'InvalidPermission.Duplicate'
+NOT_FOUND_CODE = 'InvalidPermission.NotFound'
+# Authorizing before revoking needs room for the old and new ranges at once
+RULES_LIMIT_CODE = 'RulesPerSecurityGroupLimitExceeded'
+
+
+def fetch_ip_ranges(etag=None, url=IP_RANGES_URL):
+    """Return (ip_ranges, etag), or (None, etag) if the file is unchanged since etag"""
+    headers = {'If-None-Match': etag} if etag else {}
+    response = requests.get(url, headers=headers, timeout=FETCH_TIMEOUT_SECONDS)
+    if response.status_code == 304:
+        return None, etag
+    response.raise_for_status()
+    return response.json(), response.headers.get('ETag')
+
+
+def load_ip_ranges(path):
+    """Read ip-ranges.json from a local file (e.g. a saved fixture)"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def cloudfront_cidrs(ip_ranges):
+    return {prefix['ip_prefix'] for prefix in ip_ranges['prefixes'] if prefix['service'] == 'CLOUDFRONT'}
+
+
+def describe_group(ec2, group_id):
+    """Return (CloudFront CIDRs currently allowed on PORT, group tags)"""
+    group = ec2.describe_security_groups(GroupIds=[group_id])['SecurityGroups'][0]
+    current = set()
+    for rule in group['IpPermissions']:
+        if rule.get('IpProtocol') != 'tcp' or rule.get('FromPort') != PORT or rule.get('ToPort') != PORT:
+            continue
+        # Only ranges we manage; other rules on the port are left alone
+        current.update(
+            ip_range['CidrIp'] for ip_range in rule.get('IpRanges', [])
+            if 'CloudFront' in ip_range.get('Description', '')
+        )
+    tags = {tag['Key']: tag['Value'] for tag in group.get('Tags', [])}
+    return current, tags
+
+
+def permissions(cidrs):
+    return [{
+        'IpProtocol': 'tcp',
+        'FromPort': PORT,
+        'ToPort': PORT,
+        'IpRanges': [{'CidrIp': cidr, 'Description': DESCRIPTION} for cidr in cidrs]
+    }]
+
+
+def apply_in_batches(call, group_id, cidrs, ignore_code):
+    """Send sorted CIDRs to an authorize/revoke call in parallel batches"""
+    cidrs = sorted(cidrs)
+    batches = [cidrs[i:i + BATCH_SIZE] for i in range(0, len(cidrs), BATCH_SIZE)]
+
+    def send(batch):
+        try:
+            call(GroupId=group_id, IpPermissions=permissions(batch))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != ignore_code:
+                raise
+            # One range in the batch was already done; apply the rest individually
+            for cidr in batch:
+                try:
+                    call(GroupId=group_id, IpPermissions=permissions([cidr]))
+                except ClientError as e:
+                    if e.response.get('Error', {}).get('Code') != ignore_code:
+                        raise
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_CALLS) as executor:
+        # list() re-raises the first failed batch
+        list(executor.map(send, batches))
+    return len(batches)
+
+
+def sync_security_group(ec2, group_id, ip_ranges, current, etag=None, dry_run=False):
+    """Authorize new and revoke stale CloudFront ranges against current; returns a summary dict"""
+    wanted = cloudfront_cidrs(ip_ranges)
+    to_add = wanted - current
+    to_remove = current - wanted
+    summary = {
+        'security_group_id': group_id,
+        'sync_token': ip_ranges.get('syncToken'),
+        'ranges': len(wanted),
+        'added': len(to_add),
+        'removed': len(to_remove),
+        'unchanged': len(wanted & current),
+        'api_calls': 0
+    }
+    print(f"Found {len(wanted)} CloudFront IP ranges: {len(to_add)} to add, {len(to_remove)} to remove")
+    if dry_run:
+        summary['dry_run'] = True
+        return summary
+
+    # Add before removing so a range moving between prefixes is never unreachable
+    if to_add:
+        try:
+            summary['api_calls'] += apply_in_batches(ec2.authorize_security_group_ingress, group_id, to_add, DUPLICATE_CODE)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != RULES_LIMIT_CODE or not to_remove:
+                raise
+            # No room for both sets: make room, then add (ranges already added count as duplicates)
+            print("Security group rule limit reached; revoking stale ranges first")
+            summary['revoked_first'] = True
+            summary['api_calls'] += apply_in_batches(ec2.revoke_security_group_ingress, group_id, to_remove, NOT_FOUND_CODE)
+            to_remove = set()
+            summary['api_calls'] += apply_in_batches(ec2.authorize_security_group_ingress, group_id, to_add, DUPLICATE_CODE)
+    if to_remove:
+        summary['api_calls'] += apply_in_batches(ec2.revoke_security_group_ingress, group_id, to_remove, NOT_FOUND_CODE)
+
+    tags = [{'Key': SYNC_TOKEN_TAG, 'Value': str(ip_ranges.get('syncToken', ''))}]
+    if etag:
+        tags.append({'Key': ETAG_TAG, 'Value': etag})
+    ec2.create_tags(Resources=[group_id], Tags=tags)
+    return summary
+
+
+def notified_sync_token(event):
+    """syncToken from an AmazonIpSpaceChanged SNS notification, if that is what triggered us"""
+    for record in (event or {}).get('Records', []):
+        try:
+            return str(json.loads(record['Sns']['Message'])['synctoken'])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+def run(ec2, group_id=SECURITY_GROUP_ID, event=None, ip_ranges=None, dry_run=False):
+    """One sync; ip_ranges skips the download (local file), otherwise fetch conditionally"""
+    current, tags = describe_group(ec2, group_id)
+    synced_token = tags.get(SYNC_TOKEN_TAG)
+
+    if ip_ranges is None:
+        if synced_token and notified_sync_token(event) == synced_token:
+            return {'security_group_id': group_id, 'skipped': 'sync token already applied'}
+        ip_ranges, etag = fetch_ip_ranges(tags.get(ETAG_TAG))
+        if ip_ranges is None:
+            return {'security_group_id': group_id, 'skipped': 'ip-ranges.json not modified'}
+    else:
+        etag = None
+
+    if synced_token and str(ip_ranges.get('syncToken')) == synced_token:
+        return {'security_group_id': group_id, 'skipped': 'sync token already applied'}
+    return sync_security_group(ec2, group_id, ip_ranges, current, etag, dry_run)
+
 
 def lambda_handler(event, context):
-    # Configuration
-    SECURITY_GROUP_ID = 'sg-094f72ff744348adb'
-    PORT = 8501
-    DESCRIPTION = 'CloudFront Access - Auto Updated'
-    
     try:
-        # Get current CloudFront IP ranges
-        response = requests.get('https://ip-ranges.amazonaws.com/ip-ranges.json')
-        ip_ranges = response.json()
-        
-        cloudfront_ips = [
-            prefix['ip_prefix'] for prefix in ip_ranges['prefixes'] 
-            if prefix['service'] == 'CLOUDFRONT'
-        ]
-        
-        print(f"Found {len(cloudfront_ips)} CloudFront IP ranges")
-        
-        # Initialize EC2 client
-        ec2 = boto3.client('ec2')
-        
-        # Get current security group rules
-        sg_response = ec2.describe_security_groups(GroupIds=[SECURITY_GROUP_ID])
-        current_rules = sg_response['SecurityGroups'][0]['IpPermissions']
-        
-        # Find existing CloudFront rules (port 8501 with CloudFront description)
-        cloudfront_rules = []
-        for rule in current_rules:
-            if (rule.get('FromPort') == PORT and 
-                rule.get('ToPort') == PORT and
-                any('CloudFront' in ip_range.get('Description', '') 
-                    for ip_range in rule.get('IpRanges', []))):
-                cloudfront_rules.append(rule)
-        
-        # Remove existing CloudFront rules
-        if cloudfront_rules:
-            print(f"Removing {len(cloudfront_rules)} existing CloudFront rules")
-            ec2.revoke_security_group_ingress(
-                GroupId=SECURITY_GROUP_ID,
-                IpPermissions=cloudfront_rules
-            )
-        
-        # Add new CloudFront rules (in batches due to AWS limits)
-        batch_size = 50  # AWS limit per request
-        for i in range(0, len(cloudfront_ips), batch_size):
-            batch = cloudfront_ips[i:i + batch_size]
-            
-            ip_permissions = [{
-                'IpProtocol': 'tcp',
-                'FromPort': PORT,
-                'ToPort': PORT,
-                'IpRanges': [
-                    {
-                        'CidrIp': ip,
-                        'Description': DESCRIPTION
-                    } for ip in batch
-                ]
-            }]
-            
-            ec2.authorize_security_group_ingress(
-                GroupId=SECURITY_GROUP_ID,
-                IpPermissions=ip_permissions
-            )
-            
-            print(f"Added batch {i//batch_size + 1}: {len(batch)} IP ranges")
-        
+        ec2 = boto3.client('ec2', config=Config(retries={'max_attempts': 10, 'mode': 'adaptive'}))
+        summary = run(ec2, event=event)
+        print(json.dumps(summary))
         return {
             'statusCode': 200,
-            'body': json.dumps({
-                'message': f'Successfully updated security group with {len(cloudfront_ips)} CloudFront IP ranges',
-                'security_group_id': SECURITY_GROUP_ID
-            })
+            'body': json.dumps(summary)
         }
-        
+
     except Exception as e:
         print(f"Error: {str(e)}")
         return {
@@ -84,3 +200,20 @@ def lambda_handler(event, context):
                 'error': str(e)
             })
         }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync a security group with CloudFront's IP ranges")
+    parser.add_argument('--security-group', default=SECURITY_GROUP_ID)
+    parser.add_argument('--ip-ranges', help="Local ip-ranges.json to use instead of downloading it")
+    parser.add_argument('--dry-run', action='store_true', help="Report the changes without applying them")
+    args = parser.parse_args()
+
+    ip_ranges = load_ip_ranges(args.ip_ranges) if args.ip_ranges else None
+    summary = run(boto3.client('ec2'), args.security_group, ip_ranges=ip_ranges, dry_run=args.dry_run)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
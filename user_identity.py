@@ -0,0 +1,95 @@
+"""Who is using a session, from the load balancer's signed OIDC claims
+
+An ALB with OIDC authentication signs the user's claims into the
+x-amzn-oidc-data header (an ES256 JWT naming the ALB as its signer). Any
+other identity header can be set by the client, so it is never trusted. With
+no TRUSTED_ALB_ARN configured, or a token that fails verification, the
+session is anonymous and uses DEFAULT_USER.
+"""
+import base64
+import json
+import logging
+import threading
+import time
+import urllib.request
+from prompt_manager import DEFAULT_USER
+from config import AWS_REGION, TRUSTED_ALB_ARN
+
+OIDC_DATA_HEADER = 'X-Amzn-Oidc-Data'
+PUBLIC_KEY_URL = 'https://public-keys.auth.elb.{region}.amazonaws.com/{kid}'
+KEY_FETCH_TIMEOUT_SECONDS = 5
+
+logger = logging.getLogger('speech_formatter.identity')
+
+_keys = {}
+_keys_lock = threading.Lock()
+
+
+class IdentityError(Exception):
+    """The OIDC token is missing, malformed, expired or not signed by the trusted ALB"""
+
+
+def _b64decode(segment):
+    # ALB tokens may or may not keep their base64 padding
+    return base64.urlsafe_b64decode(segment.rstrip('=') + '=' * (-len(segment.rstrip('=')) % 4))
+
+
+def _public_key(kid):
+    """The ALB's PEM public key for a key ID, fetched once per process"""
+    with _keys_lock:
+        if kid in _keys:
+            return _keys[kid]
+    url = PUBLIC_KEY_URL.format(region=AWS_REGION, kid=kid)
+    with urllib.request.urlopen(url, timeout=KEY_FETCH_TIMEOUT_SECONDS) as response:
+        key = response.read()
+    with _keys_lock:
+        _keys[kid] = key
+    return key
+
+
+def verify_oidc_data(token, signer_arn, key_loader=None, now=None):
+    """Return the verified claims of an ALB OIDC token; raises IdentityError"""
+    # Optional dependency: only needed when a trusted ALB is configured
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+    from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+    try:
+        header_b64, payload_b64, signature_b64 = token.split('.')
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+    except ValueError:
+        raise IdentityError("Malformed OIDC token")
+    if header.get('alg') != 'ES256' or len(signature) != 64:
+        raise IdentityError("OIDC token is not ES256-signed")
+    if not signer_arn or header.get('signer') != signer_arn:
+        raise IdentityError("OIDC token was not signed by the trusted load balancer")
+
+    key = load_pem_public_key((key_loader or _public_key)(header['kid']))
+    # JWT carries the raw r || s pair; cryptography expects DER
+    der_signature = encode_dss_signature(int.from_bytes(signature[:32], 'big'), int.from_bytes(signature[32:], 'big'))
+    try:
+        key.verify(der_signature, f"{header_b64}.{payload_b64}".encode('ascii'), ec.ECDSA(hashes.SHA256()))
+    except InvalidSignature:
+        raise IdentityError("OIDC token signature does not match")
+    if claims.get('exp', 0) < (now if now is not None else time.time()):
+        raise IdentityError("OIDC token has expired")
+    if not claims.get('sub'):
+        raise IdentityError("OIDC token has no subject")
+    return claims
+
+
+def user_id_from_headers(headers):
+    """The verified user's ID, or DEFAULT_USER when there is no trusted identity"""
+    token = next((v for k, v in (headers or {}).items() if k.lower() == OIDC_DATA_HEADER.lower()), None)
+    if not TRUSTED_ALB_ARN or not token:
+        return DEFAULT_USER
+    try:
+        return verify_oidc_data(token, TRUSTED_ALB_ARN)['sub']
+    except Exception as e:
+        # Includes key fetch failures and a missing cryptography package
+        logger.warning(f"Ignoring unverified identity: {e}")
+        return DEFAULT_USER